@@ -1,112 +1,123 @@
 import hydra
 import os
-import librosa
 import torchaudio
-import pandas as pd
+import numpy as np
 import torch
 from pathlib import Path
-import torchaudio.transforms as T
 from tqdm import tqdm
 from omegaconf import DictConfig
-from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder, AudioHelper
+from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder, SpeakerEmbeddingExtractor
+from src.utils.manifest import Manifest, config_hash, combine_hash
+from src.utils.audio_storage import storage_ext
+from src.utils.corpus_scan import scan_split, check_sample_rates
+from src.datamodule.clip_manifest import ClipManifest, write_clip_manifest
 
 
 @hydra.main(version_base=None, config_path="../conf", config_name="config")
 def main(cfg: DictConfig):
     root_path = Path(os.path.abspath(hydra.utils.get_original_cwd()))
-
+    cache_dataset(cfg, root_path, plan=cfg.process_data.plan)
+
+
+def cache_dataset(cfg, root_path, plan=False):
+    """
+    Incremental caching of the speech embeddings into each split's clip manifest, clips.parquet and dvecs.npy,
+    with the speaker centroid table speaker_centroids.npz.
+    Every clip is keyed by the hash of its audio, of the embedder checkpoint and of the embedding config,
+    clips whose key is already in the previous manifest reuse their d-vector instead of being embedded again.
+    :param plan: only print what would be embedded
+    :return: number of clips to embed
+    """
     data_path = root_path / cfg.dataset.data_path
+    bss = cfg.dataset.block_size_speaker
 
+    # file hashes of the clips and checkpoint, remembered by size and mtime
+    manifest = Manifest(data_path / 'cache_manifest.json')
+    params_hash = combine_hash(manifest.file_hash(cfg.model.embedder_path),
+                               config_hash({'block_size_speaker': bss, 'sample_rate': cfg.dataset.sample_rate}))
+
+    extractor = None
+    num_todo = 0
+    for split in ['train', 'val', 'test', 'predict']:
+        split_path = data_path / split
+        previous_dvecs = {}
+        if (split_path / 'clips.parquet').exists() and (split_path / 'dvecs.npy').exists():
+            previous = ClipManifest(split_path)
+            previous_dvecs = {clip_key: previous.dvec(row).numpy()
+                              for row, clip_key in enumerate(previous['clip_key'])}
+
+        clips, headers = list_clips(split_path, ext=storage_ext(cfg.process_data.storage_encoding))
+        check_sample_rates([x_file for x_file, _ in clips], [header['sample_rate'] for header in headers],
+                           cfg.dataset.sample_rate)
+        clip_keys = [combine_hash(manifest.file_hash(x_file), params_hash) for x_file, _ in clips]
+        todo = [key for key in clip_keys if key not in previous_dvecs]
+        num_todo += len(todo)
+        print(f"cache {split}: {len(todo)} clips to embed, {len(clip_keys) - len(todo)} reused")
+        if plan:
+            continue
+
+        if len(todo) > 0 and extractor is None:
+            extractor = load_extractor(cfg)
+
+        dvecs = embed_clips(clips, clip_keys, previous_dvecs, extractor, bss)
+        write_clip_manifest(split_path, [x_file for x_file, _ in clips], [speaker for _, speaker in clips],
+                            clip_keys=clip_keys, dvecs=dvecs, headers=headers)
+        print('Saved to:', split_path / 'clips.parquet')
+
+    if not plan:
+        manifest.save()
+    return num_todo
+
+
+def load_extractor(cfg):
     embedder = SpeechEmbedder()
     chkpt_embed = torch.load(cfg.model.embedder_path, map_location=torch.device(cfg.process_data.accelerator))
     embedder.load_state_dict(chkpt_embed)
     embedder.eval()
 
-    embedder.to(torch.device(cfg.process_data.accelerator))
-    audio_helper = AudioHelper()
-
-    # try to be as close as librosa's resampling
-    resampler = T.Resample(orig_freq=cfg.dataset.block_size_speaker,
-                                new_freq=embedder.get_target_sample_rate(),
-                                lowpass_filter_width=64,
-                                rolloff=0.9475937167399596,
-                                resampling_method="sinc_interp_kaiser",
-                                beta=14.769656459379492,
-                                )
-    bss = cfg.dataset.block_size_speaker
-    df_train = form_dataframe(data_path / 'train', resampler, audio_helper, embedder, bss)
-    df_val = form_dataframe(data_path / 'val', resampler, audio_helper, embedder, bss)
-    df_test = form_dataframe(data_path / 'test', resampler, audio_helper, embedder, bss)
-    df_predict = form_dataframe(data_path / 'predict', resampler, audio_helper, embedder, bss)
-
-    df_train_path = Path(data_path / 'train' / "dataframe.pkl")
-    df_val_path = Path(data_path / 'val' / "dataframe.pkl")
-    df_test_path = Path(data_path / 'test' / "dataframe.pkl")
-    df_predict_path = Path(data_path / 'predict' / "dataframe.pkl")
-
-    df_train.to_pickle(df_train_path)
-    print('Saved to:', df_train_path)
-    df_val.to_pickle(df_val_path)
-    print('Saved to:', df_val_path)
-    df_test.to_pickle(df_test_path)
-    print('Saved to:', df_test_path)
-    df_predict.to_pickle(df_predict_path)
-    print('Saved to:', df_predict_path)
-
-
-def form_dataframe(data_path, resampler, audio_helper, embedder, block_size_speaker):
-    dataset_speakers = [x for x in data_path.iterdir() if x.is_dir()]
-
-    speaker_names = []
-    x_files = []
-    dvecs = []
+    # resample from the dataset's sample rate, same as the training EMBLoss
+    extractor = SpeakerEmbeddingExtractor(embedder, orig_sr=cfg.dataset.sample_rate)
+    extractor.to(torch.device(cfg.process_data.accelerator))
+    return extractor
 
-    for speaker in tqdm(dataset_speakers, desc='Caching speaker'):
-        data_path_x = data_path / speaker.name
-        speaker_files = librosa.util.find_files(data_path_x, ext='wav')
-        for x_file in tqdm(speaker_files, desc='Caching audio', leave=False):
-            x_files.append(x_file)
-            speaker_names.append(speaker.name)
-
-            waveform_x, _ = torchaudio.load(x_file)
-            waveform_x = padding(waveform_x, block_size_speaker)
-            dvec = get_embedding_vec(waveform_x, resampler, audio_helper, embedder)
-            dvec = dvec.cpu().numpy()
-            dvecs.append(dvec)
-
-    data = {'x': x_files, 'speaker_name': speaker_names, 'dvec': dvecs}
-    df = pd.DataFrame(data=data)
-    df['related_speakers'] = ''
-
-    # pre insert indexes of the same speakers into related_speakers
-    for speaker in dataset_speakers:
-        indexes_to_speaker = df[df['speaker_name'] == speaker.name].index
-        df.loc[df["speaker_name"] == speaker.name, "related_speakers"] = \
-            [indexes_to_speaker.tolist()]  # yes, need a nested list
-
-    # remove 'self' index in the related_speakers
-    for index, row in df.iterrows():
-        indexes_to_speaker = row['related_speakers'].copy()  # somehow, we need a copy
-        indexes_to_speaker.remove(index)
-        df.loc[index, 'related_speakers'] = indexes_to_speaker  # no need for nested list
-
-    return df
-
-
-def get_embedding_vec(waveform_speaker, resampler, audio_helper, embedder):
-    # embedding d vec
-    waveform_speaker = resampler(waveform_speaker)  # resample to 16kHz
-    waveform_speaker = waveform_speaker.squeeze()  # [16000]
-
-    if torch.cuda.is_available():
-        if waveform_speaker.device.type == 'cpu':
-            dev = torch.device('cuda')
-            waveform_speaker = waveform_speaker.to(dev)
-
-    dvec_mel, _, _ = audio_helper.get_mel_torch(waveform_speaker)
+
+def list_clips(data_path, ext='wav'):
+    """
+    (clip file, speaker name) of every clip in the split folder, and the clips' headers
+    """
+    if not data_path.exists():
+        # a split can be empty with few speakers
+        return [], []
+    x_files, speaker_names, headers = scan_split(data_path, ext=ext)
+    return list(zip(x_files, speaker_names)), headers
+
+
+def embed_clips(clips, clip_keys, previous_dvecs, extractor, block_size_speaker):
+    """
+    d-vector of every clip, [num_clips, emb_size]. clips whose key is in previous_dvecs are not embedded again
+    """
+    dvecs = []
+    for (x_file, _), clip_key in tqdm(zip(clips, clip_keys), total=len(clips), desc='Caching audio'):
+        if clip_key in previous_dvecs:
+            dvecs.append(previous_dvecs[clip_key])
+            continue
+
+        waveform_x, _ = torchaudio.load(x_file)
+        waveform_x = padding(waveform_x, block_size_speaker)
+        dvec = get_embedding_vec(waveform_x, extractor)
+        dvec = dvec.cpu().numpy()
+        dvecs.append(dvec)
+    if len(dvecs) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack(dvecs).astype(np.float32)
+
+
+def get_embedding_vec(waveform_speaker, extractor):
+    # embedding d vec, on the extractor's device
+    waveform_speaker = waveform_speaker.to(next(extractor.parameters()).device)  # [1, samples]
     with torch.no_grad():
-        dvec = embedder(dvec_mel)
-        return dvec
+        dvec = extractor(waveform_speaker)  # [1, emb_dim]
+        return dvec.squeeze(dim=0)
 
 def padding(waveform, target_size):
     # do padding if file is too small
@@ -0,0 +1,33 @@
+import hydra
+import os
+import librosa
+import numpy as np
+from pathlib import Path
+from omegaconf import DictConfig
+from src.datamodule.augmentations.pitch_bank import render_pitch_bank
+from src.utils.audio_storage import storage_ext
+
+
+@hydra.main(version_base=None, config_path="../conf", config_name="config")
+def main(cfg: DictConfig):
+    root_path = Path(os.path.abspath(hydra.utils.get_original_cwd()))
+
+    data_path = root_path / cfg.dataset.data_path
+
+    # only training clips are augmented
+    files = librosa.util.find_files(data_path / 'train', ext=storage_ext(cfg.process_data.storage_encoding))
+    semitones = np.linspace(cfg.augmentations.min_transpose_semitones_indep,
+                            cfg.augmentations.max_transpose_semitones_indep,
+                            cfg.augmentations.pitchshift_bank_variants)
+
+    bank_path = data_path / 'train' / 'pitch_bank'
+    render_pitch_bank(files, bank_path,
+                      semitones=semitones,
+                      sample_rate=cfg.dataset.sample_rate,
+                      min_length=cfg.dataset.block_size,
+                      dtype=cfg.augmentations.pitchshift_bank_dtype)
+    print('Saved to:', bank_path)
+
+
+if __name__ == "__main__":
+    main()
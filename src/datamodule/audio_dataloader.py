@@ -1,8 +1,7 @@
-import numpy as np
 import torch
-import torchaudio
 import random
 import pandas as pd
+from typing import Union
 import torchaudio.transforms as T
 from torch.utils.data import Dataset
 from omegaconf import DictConfig
@@ -11,19 +10,42 @@ from torch_audiomentations import (
     Shift, AddColoredNoise, PitchShift, LowPassFilter)
 from src.datamodule.augmentations.custom_pitchshift import PitchShift_Slow
 from src.datamodule.augmentations.random_crop import RandomCrop
+from src.datamodule.augmentations.seeding import sample_seed, seeded_rng
+from src.datamodule.augmentations.pitch_bank import PitchBank
+from src.datamodule.clip_cache import SharedClipCache
+from src.datamodule.energy_index import EnergyIndex
+from src.datamodule.clip_manifest import ClipManifest, SpeakerCentroids
+from src.utils.profiling import StageTimer, add_forward_timer
+from src.utils.audio_storage import load_audio
 
 
 class AudioDataset(Dataset):
-    def __init__(self, df: pd.DataFrame, cfg: DictConfig, do_augmentation: bool = False):
-        self.df = df
+    def __init__(self, df: Union[pd.DataFrame, ClipManifest], cfg: DictConfig, do_augmentation: bool = False,
+                 stage_timer: StageTimer = None, pitch_bank: PitchBank = None, pad: bool = True,
+                 clip_cache: SharedClipCache = None, energy_index: EnergyIndex = None,
+                 centroids: SpeakerCentroids = None):
+        # columns only, no pandas in the workers
+        self.clips = df if isinstance(df, ClipManifest) else ClipManifest.from_dataframe(df)
         self.sample_length = int(
             cfg.dataset.sample_rate * cfg.process_data.clip_interval_ms / 1000.0)
         self.block_size = cfg.dataset.block_size
         self.block_size_speaker = cfg.dataset.block_size_speaker
         self.sample_rate = cfg.dataset.sample_rate
+        # decoder of the clips, null for torchaudio's default. see src/utils/audio_storage.py
+        self.audio_backend = cfg.dataset.audio_backend
+        # decoded clips shared in RAM by all workers and epochs
+        self.clip_cache = clip_cache
+        # speaker centroids instead of single clip d-vectors, see SpeakerCentroids
+        self.centroids = centroids
 
         # for cropping audio length
         self.do_random_block = cfg.dataset.do_random_block
+        # short clips are padded to block_size, unless batches are padded by pad_collate instead
+        self.pad = pad
+        # crops drawn toward voiced frames of the clip, plain random crops without an index
+        self.energy_index = energy_index
+        self.min_voiced_fraction = cfg.dataset.min_voiced_fraction
+        self.voiced_thresh_db = cfg.dataset.voiced_thresh_db
 
         # augmentations params
         self.do_augmentation = do_augmentation
@@ -68,6 +90,23 @@ class AudioDataset(Dataset):
         self.max_cutoff_freq_x = cfg.augmentations.max_cutoff_freq_x
         self.low_pass_p_x = cfg.augmentations.low_pass_p_x
 
+        # augmentations are seeded per sample from (seed, epoch, idx), reproducible for any num_workers
+        self.seed = cfg.training.distributed.seed
+        self.pitchshift_cache_dir = cfg.augmentations.pitchshift_cache_dir
+        self.pitchshift_cache_max_bytes = int(cfg.augmentations.pitchshift_cache_max_gb * 2 ** 30)
+
+        # precomputed independent pitch shifts, see cache_pitch_bank.py
+        self.pitch_bank = pitch_bank
+        self.pitchshift_bank_interpolate = cfg.augmentations.pitchshift_bank_interpolate
+        self.pitch_shift_bank = None
+
+        # per stage timings for profiling, see src.utils.callbacks.ProfilingCallback
+        self.timer = stage_timer if stage_timer is not None else StageTimer(enabled=False)
+
+        # the energies are of the stored clip, an independent time shift before the crop moves them
+        if self.energy_index is not None and self.do_augmentation and self.aug_timeshift_indep:
+            raise ValueError("dataset.energy_crop cannot be combined with augmentations.do_timeshift_indep")
+
         self.__initialise_augmentations()
 
         self.model_name = cfg.model.model_name
@@ -80,6 +119,19 @@ class AudioDataset(Dataset):
         # crop and augment on smaller blocks later
         transforms = [Identity()]
 
+        # the bank holds whole clips, so its shifts come before the time shift and cropping
+        if self.aug_pitchshift_indep and self.pitch_bank is not None:
+            self.pitch_shift_bank = PitchShift_Slow(min_transpose_semitones=self.min_transpose_semitones_indep,
+                                                    max_transpose_semitones=self.max_transpose_semitones_indep,
+                                                    p=self.pitchshift_p_indep,
+                                                    sample_rate=self.sample_rate,
+                                                    p_mode='per_example',
+                                                    bank=self.pitch_bank,
+                                                    interpolate=self.pitchshift_bank_interpolate,
+                                                    cache_dir=self.pitchshift_cache_dir,
+                                                    cache_max_bytes=self.pitchshift_cache_max_bytes)
+            transforms.append(self.pitch_shift_bank)
+
         if self.aug_timeshift_indep:
             transforms.append(Shift(min_shift=self.min_shift_indep,
                                     max_shift=self.max_shift_indep,
@@ -129,13 +181,15 @@ class AudioDataset(Dataset):
                                    p_mode='per_example'))
 
         # micro pitch cannot be done on torch_audiomentation, revert to original audiomentation
-        if self.aug_pitchshift_indep:
+        if self.aug_pitchshift_indep and self.pitch_bank is None:
             transforms.append(
                 PitchShift_Slow(min_transpose_semitones=self.min_transpose_semitones_indep,
                                 max_transpose_semitones=self.max_transpose_semitones_indep,
                                 p=self.pitchshift_p_indep,
                                 sample_rate=self.sample_rate,
-                                p_mode='per_example'))
+                                p_mode='per_example',
+                                cache_dir=self.pitchshift_cache_dir,
+                                cache_max_bytes=self.pitchshift_cache_max_bytes))
 
         self.apply_augmentation_indep = Compose(transforms)
 
@@ -163,8 +217,21 @@ class AudioDataset(Dataset):
             )
         self.apply_augmentation_x = Compose(transforms)
 
+        if self.timer.enabled:
+            self.__add_augmentation_timers()
+
+    def __add_augmentation_timers(self):
+        augmentation_groups = {'before_crop': self.apply_augmentation_before_crop,
+                               'combo': self.apply_augmentation_combo,
+                               'indep': self.apply_augmentation_indep,
+                               'input_only': self.apply_augmentation_x}
+        for group, compose in augmentation_groups.items():
+            for transform in compose.transforms:
+                if not isinstance(transform, Identity):
+                    add_forward_timer(transform, self.timer, f"aug/{group}/{type(transform).__name__}")
+
     def __len__(self):
-        return len(self.df)
+        return len(self.clips)
 
     def __process_augmentations_input_only(self, waveform):
         waveform = self.apply_augmentation_x(waveform, sample_rate=self.sample_rate)
@@ -188,6 +255,14 @@ class AudioDataset(Dataset):
             waveform = self.apply_augmentation_crop(waveform, sample_rate=self.sample_rate)
         return waveform
 
+    def __voiced_offset(self, waveform, x_path):
+        # drawn from the stored clip's energies, None for a clip without crop
+        if waveform.size(dim=2) <= self.block_size:
+            return None
+        return self.energy_index.voiced_offset(x_path, waveform.size(dim=2), self.block_size,
+                                               min_voiced_fraction=self.min_voiced_fraction,
+                                               thresh_db=self.voiced_thresh_db)
+
     def __random_block_speaker(self, waveform):
         if waveform.size(dim=2) > self.block_size_speaker:
             waveform = self.apply_augmentation_crop_speaker(waveform, sample_rate=self.sample_rate)
@@ -203,46 +278,74 @@ class AudioDataset(Dataset):
         return waveform
 
     def __getitem__(self, idx):
-        data = self.df.iloc[idx]
-        x_path = data['x']
-        speaker_name = data['speaker_name']
-        related_speakers = data['related_speakers']
-
-        # id_other = random.choice(related_speakers)
-        # speaker_path = self.df.iloc[id_other].x
-
-        waveform_x, _ = torchaudio.load(x_path)
-        if self.model_name == 'AutoEncoder_Speaker_PL' or \
-            self.model_name == 'AutoEncoder_Speaker_PL2':
-            own_dvec = self.df.iloc[idx].dvec
-            if isinstance(own_dvec, np.ndarray):
-                own_dvec = torch.from_numpy(own_dvec)
-
-            unrelated_speakers = [i for i in range(0, len(self.df)) if i not in related_speakers]
-            unrelated_speakers.remove(idx)
-            id_other_unrelated = random.choice(unrelated_speakers)
-            target_speaker_vec = self.df.iloc[id_other_unrelated].dvec
-            if isinstance(target_speaker_vec, np.ndarray):
-                target_speaker_vec = torch.from_numpy(target_speaker_vec)
-            target_speaker_name = self.df.iloc[id_other_unrelated].speaker_name
+        # the train sampler yields (epoch, idx), see SpeakerShardSampler
+        epoch, idx = idx if isinstance(idx, tuple) else (0, idx)
+        with seeded_rng(sample_seed(self.seed, epoch, idx)):
+            return self.__get_sample(idx)
+
+    def __get_sample(self, idx):
+        x_path = self.clips['x'][idx]
+
+        with self.timer.time('decode'):
+            if self.clip_cache is not None:
+                waveform_x = self.clip_cache.load(x_path)
+            else:
+                waveform_x, _ = load_audio(x_path, self.audio_backend)
+
+        return self.sample_from_waveform(idx, waveform_x)
+
+    def sample_from_waveform(self, idx, waveform_x):
+        """
+        the sample of row idx from its decoded clip [channels, samples], also used by ShardedAudioDataset
+        """
+        x_path = self.clips['x'][idx]
+        speaker_name = self.clips['speaker_name'][idx]
+
+        speaker_model = self.model_name == 'AutoEncoder_Speaker_PL' or \
+            self.model_name == 'AutoEncoder_Speaker_PL2'
+        if speaker_model and self.centroids is not None:
+            # the target drawn among the speakers, not the clips
+            own_dvec = self.centroids.centroid(speaker_name)
+            target_speaker_name = self.centroids.other_speaker(speaker_name)
+            target_speaker_vec = self.centroids.centroid(target_speaker_name)
+        elif speaker_model:
+            own_dvec = self.clips.dvec(idx)
+
+            id_other_unrelated = random.choice(self.clips.unrelated(idx))
+            target_speaker_vec = self.clips.dvec(id_other_unrelated)
+            target_speaker_name = self.clips['speaker_name'][id_other_unrelated]
         else:
             own_dvec = []
             target_speaker_vec = []
             target_speaker_name = ""
 
-        waveform_x = self.__padding(waveform_x, self.block_size)
+        if self.pad:
+            waveform_x = self.__padding(waveform_x, self.block_size)
 
         # 'batch' up waveforms x and y together
         waveform_x = torch.unsqueeze(waveform_x, dim=0)
         waveform_y = waveform_x  # copy input as target
         waveform = torch.cat((waveform_x, waveform_y), 0)
 
+        # voiced crops are placed before the augmentations, the bank's pitch shifts keep the clip's timing
+        voiced_offset = None
+        if self.do_random_block and self.energy_index is not None and x_path in self.energy_index:
+            with self.timer.time('crop'):
+                voiced_offset = self.__voiced_offset(waveform, x_path)
+
         # decided to do time shift earlier then do block cropping, to prevent too many zero pads
         if self.do_augmentation:
+            if self.pitch_shift_bank is not None:
+                self.pitch_shift_bank.select_clip(x_path)
             waveform = self.__process_augmentations_before_crop(waveform)
 
         if self.do_random_block:
-            waveform = self.__random_block(waveform)
+            with self.timer.time('crop'):
+                if voiced_offset is not None:
+                    # x and y cropped at the same offset
+                    waveform = waveform[:, :, voiced_offset:voiced_offset + self.block_size]
+                else:
+                    waveform = self.__random_block(waveform)
 
         # do the rest of the augmentations with smaller block for faster processing
 
@@ -261,10 +364,13 @@ class AudioDataset(Dataset):
             waveform_x = self.__process_augmentations_input_only(waveform_x)
             waveform_x = waveform_x[0]
 
-        waveform_x = self.__padding(waveform_x, self.block_size)
-        waveform_y = self.__padding(waveform_y, self.block_size)
+        if self.pad:
+            waveform_x = self.__padding(waveform_x, self.block_size)
+            waveform_y = self.__padding(waveform_y, self.block_size)
 
         # waveform_x = torch.cat((waveform_x, waveform_x), dim=0) # fake stereo
         # waveform_y = torch.cat((waveform_y, waveform_y), dim=0)
 
+        self.timer.flush()
+
         return waveform_x, waveform_y, (own_dvec, target_speaker_vec), (speaker_name, target_speaker_name)
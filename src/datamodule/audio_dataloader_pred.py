@@ -2,46 +2,37 @@ import torch
 import torchaudio
 import random
 import pandas as pd
-import torchaudio.transforms as T
 from torch.utils.data import Dataset
 from omegaconf import DictConfig
-from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder, AudioHelper
+from typing import Union
+from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder, SpeakerEmbeddingExtractor
+from src.datamodule.clip_manifest import ClipManifest, SpeakerCentroids
 
 
 class AudioDatasetPred(Dataset):
-    def __init__(self, df: pd.DataFrame, cfg: DictConfig):
-        self.df = df
+    def __init__(self, df: Union[pd.DataFrame, ClipManifest], cfg: DictConfig, centroids: SpeakerCentroids = None):
+        self.clips = df if isinstance(df, ClipManifest) else ClipManifest.from_dataframe(df)
+        # speaker centroids instead of d-vectors of other clips, the predict clips need not be embedded
+        self.centroids = centroids
         self.model_name = cfg.model.model_name
         self.block_size_speaker = cfg.dataset.block_size_speaker
 
         if self.model_name == 'AutoEncoder_Speaker_PL':
             # speech embedder
-            self.embedder = SpeechEmbedder()
+            embedder = SpeechEmbedder()
             chkpt_embed = torch.load(cfg.model.embedder_path, map_location=cfg.training.accelerator)
-            self.embedder.load_state_dict(chkpt_embed)
-            self.embedder.eval()
-            self.audio_helper = AudioHelper()
-
-            # try to be as close as librosa's resampling
-            self.resampler = T.Resample(orig_freq=cfg.dataset.block_size_speaker,
-                                        new_freq=self.embedder.get_target_sample_rate(),
-                                        lowpass_filter_width=64,
-                                        rolloff=0.9475937167399596,
-                                        resampling_method="sinc_interp_kaiser",
-                                        beta=14.769656459379492,
-                                        )
+            embedder.load_state_dict(chkpt_embed)
+            embedder.eval()
+            self.extractor = SpeakerEmbeddingExtractor(embedder, orig_sr=cfg.dataset.sample_rate)
 
     def __get_embedding_vec(self, waveform_speaker):
         # embedding d vec
-        waveform_speaker = self.resampler(waveform_speaker)  # resample to 16kHz
-        waveform_speaker = waveform_speaker.squeeze()  # [16000]
-        dvec_mel, _, _ = self.audio_helper.get_mel_torch(waveform_speaker)
         with torch.no_grad():
-            dvec = self.embedder(dvec_mel)
-            return dvec
+            dvec = self.extractor(waveform_speaker)  # [1, emb_dim]
+            return dvec.squeeze(dim=0)
 
     def __len__(self):
-        return len(self.df)
+        return len(self.clips)
 
     def __padding(self, waveform, target_size):
         # do padding if file is too small
@@ -53,19 +44,8 @@ class AudioDatasetPred(Dataset):
         return waveform
 
     def __getitem__(self, idx):
-        data = self.df.iloc[idx]
-        x_path = data['x']
-        speaker_name = data['speaker_name']
-        related_speakers = data['related_speakers']
-        id_other_related = random.choice(related_speakers)
-        # speaker_path = self.df.iloc[id_other_related].x
-
-        unrelated_speakers = [i for i in range(0, len(self.df)) if i not in related_speakers]
-        unrelated_speakers.remove(idx)
-
-        id_other_unrelated = random.choice(unrelated_speakers)
-        # unrelated_speaker_path = self.df.iloc[id_other_unrelated].x
-        unrelated_speakers_name = self.df.iloc[id_other_unrelated].speaker_name
+        x_path = self.clips['x'][idx]
+        speaker_name = self.clips['speaker_name'][idx]
 
         waveform_x, _ = torchaudio.load(x_path)
         # waveform_speaker, _ = torchaudio.load(speaker_path)
@@ -75,10 +55,19 @@ class AudioDatasetPred(Dataset):
         # waveform_speaker = self.__padding(waveform_speaker, self.block_size_speaker)
 
         # get speaker embeddings
-        if self.model_name == 'AutoEncoder_Speaker_PL' or  \
-                self.model_name == 'AutoEncoder_Speaker_PL2':
-            dvec_related = self.df.iloc[id_other_related].dvec
-            dvec_unrelated = self.df.iloc[id_other_unrelated].dvec
+        speaker_model = self.model_name == 'AutoEncoder_Speaker_PL' or \
+            self.model_name == 'AutoEncoder_Speaker_PL2'
+        if speaker_model and self.centroids is not None:
+            unrelated_speakers_name = self.centroids.other_speaker(speaker_name)
+            dvec = (self.centroids.centroid(speaker_name), self.centroids.centroid(unrelated_speakers_name))
+            speaker_names = (speaker_name, unrelated_speakers_name)
+        elif speaker_model:
+            id_other_related = random.choice(self.clips.related(idx))
+            id_other_unrelated = random.choice(self.clips.unrelated(idx))
+            unrelated_speakers_name = self.clips['speaker_name'][id_other_unrelated]
+
+            dvec_related = self.clips.dvec(id_other_related)
+            dvec_unrelated = self.clips.dvec(id_other_unrelated)
 
             dvec = (dvec_related, dvec_unrelated)
             speaker_names = (speaker_name, unrelated_speakers_name)
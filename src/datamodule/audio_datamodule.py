@@ -1,11 +1,21 @@
+import multiprocessing
 import pytorch_lightning as pl
-import librosa
-import pandas as pd
 from pathlib import Path
 from omegaconf import DictConfig
 from src.datamodule.audio_dataloader import AudioDataset
 from src.datamodule.audio_dataloader_pred import AudioDatasetPred
+from src.datamodule.samplers import SpeakerShardSampler, LengthBucketBatchSampler
+from src.datamodule.collate import pad_collate
+from src.datamodule.augmentations.pitch_bank import PitchBank
+from src.datamodule.clip_cache import SharedClipCache
+from src.datamodule.energy_index import EnergyIndex
+from src.datamodule.clip_manifest import ClipManifest, SpeakerCentroids
+from src.datamodule.shards import ShardedAudioDataset
+from src.utils.profiling import StageTimer
+from src.utils.audio_storage import storage_ext
+from src.utils.corpus_scan import scan_split, check_sample_rates
 from torch.utils.data import DataLoader
+from functools import partial
 
 
 class AudioDataModule(pl.LightningDataModule):
@@ -17,14 +27,17 @@ class AudioDataModule(pl.LightningDataModule):
                  do_aug_in_val: bool = False,
                  do_aug_in_test: bool = False,
                  do_aug_in_train: bool = True,
+                 bucket_by_length: bool = False,
+                 pad_multiple: int = 1,
                  ):
         super().__init__()
         self.data_dir = data_dir
         self.batch_size = batch_size
-        self.ext = cfg.process_data.ext
+        self.ext = storage_ext(cfg.process_data.storage_encoding)
         self.df_train = None
         self.df_val = None
         self.df_test = None
+        self.df_predict = None
         self.num_workers = cfg.training.num_workers
         self.do_aug_in_predict = do_aug_in_predict
         self.do_aug_in_val = do_aug_in_val
@@ -32,97 +45,201 @@ class AudioDataModule(pl.LightningDataModule):
         self.do_aug_in_train = do_aug_in_train
         self.shuffle_train = shuffle_train
         self.cfg = cfg
+        # test and predict batches of similar length files, padded to the batch's longest only
+        self.bucket_by_length = bucket_by_length
+        self.pad_multiple = pad_multiple
+
+        # training workers send their stage timings back through the queue, see ProfilingCallback
+        profiling = cfg.training.profiling.enabled
+        self.stage_timer = StageTimer(enabled=profiling,
+                                      queue=multiprocessing.Queue(maxsize=10000) if profiling else None,
+                                      sync_cuda=True)
+        self.dataset_timer = self.stage_timer.worker_timer()
+        self.transfer_start = None
+
+        # decoded train, val and test clips kept in RAM across workers and epochs
+        self.clip_cache = None
+        if cfg.training.clip_cache.enabled:
+            self.clip_cache = SharedClipCache(cache_dir=cfg.training.clip_cache.dir,
+                                              max_bytes=int(cfg.training.clip_cache.max_gb * 2 ** 30),
+                                              backend=cfg.dataset.audio_backend,
+                                              storage_encoding=cfg.process_data.storage_encoding)
 
     def setup(self, stage: str):
-        if self.cfg.model.model_name == 'AutoEncoder_Speaker_PL' or \
-            self.cfg.model.model_name == 'AutoEncoder_Speaker_PL2':
-            if stage == "fit":
-                self.df_train = pd.read_pickle(self.data_dir / 'train' / 'dataframe.pkl')
-                self.df_val = pd.read_pickle(self.data_dir / 'val' / 'dataframe.pkl')
-            if stage == "test":
-                self.df_test = pd.read_pickle(self.data_dir / 'test' / 'dataframe.pkl')
-            if stage == "predict":
-                self.df_predict = pd.read_pickle(self.data_dir / 'predict' / 'dataframe.pkl')
-        else:
-            if stage == "fit":
-                self.df_train = self.form_dataframe(self.data_dir / 'train')
-                self.df_val = self.form_dataframe(self.data_dir / 'val')
-            if stage == "test":
-                self.df_test = self.form_dataframe(self.data_dir / 'test')
-            if stage == "predict":
-                self.df_predict = self.form_dataframe(self.data_dir / 'predict')
+        if stage == "fit" and self.cfg.dataset.train_shards:
+            # the shards carry their own manifest, the train folder is not read
+            self.df_train = ClipManifest(self.data_dir / 'train_shards')
+        elif stage == "fit":
+            self.df_train = self.__load_split('train')
+        if stage == "fit":
+            self.df_val = self.__load_split('val')
+        if stage == "test":
+            self.df_test = self.__load_split('test')
+        if stage == "predict":
+            self.df_predict = self.__load_split('predict')
+
+        # a clip at another sample rate fails here, not mid epoch
+        for clips in [self.df_train, self.df_val, self.df_test, self.df_predict]:
+            if clips is not None:
+                check_sample_rates(clips['x'], clips['sample_rate'], self.cfg.dataset.sample_rate)
+
+        if stage == "fit" and self.clip_cache is not None and self.cfg.training.clip_cache.warmup:
+            train_files = [] if self.cfg.dataset.train_shards else list(self.df_train['x'])
+            self.clip_cache.warm(train_files + list(self.df_val['x']))
+
+    def __load_split(self, split):
+        speaker_model = self.cfg.model.model_name == 'AutoEncoder_Speaker_PL' or \
+            self.cfg.model.model_name == 'AutoEncoder_Speaker_PL2'
+        if split == 'predict' and speaker_model and self.cfg.dataset.speaker_centroids:
+            # targets from the test speakers' centroids, the predict clips are not embedded
+            return self.form_dataframe(self.data_dir / split)
+        if speaker_model:
+            # clip manifests written by cache_dataset.py
+            return ClipManifest(self.data_dir / split)
+        return self.form_dataframe(self.data_dir / split)
 
     def form_dataframe(self, data_path):
-        dataset_speakers = [x for x in data_path.iterdir() if x.is_dir()]
-
-        speaker_names = []
-        x_files = []
-
-        for speaker in dataset_speakers:
-            data_path_x = data_path / speaker.name
-            speaker_files = librosa.util.find_files(data_path_x, ext=self.ext)
-            for x_file in speaker_files:
-                x_files.append(x_file)
-                speaker_names.append(speaker.name)
-
-        data = {'x': x_files, 'speaker_name': speaker_names}
-        df = pd.DataFrame(data=data)
-        df['related_speakers'] = ''
-
-        # pre insert indexes of the same speakers into related_speakers
-        for speaker in dataset_speakers:
-            indexes_to_speaker = df[df['speaker_name'] == speaker.name].index
-            df.loc[df["speaker_name"] == speaker.name, "related_speakers"] = \
-                [indexes_to_speaker.tolist()]  # yes, need a nested list
-
-        # remove 'self' index in the related_speakers
-        for index, row in df.iterrows():
-            indexes_to_speaker = row['related_speakers'].copy()  # somehow, we need a copy
-            indexes_to_speaker.remove(index)
-            df.loc[index, 'related_speakers'] = indexes_to_speaker  # no need for nested list
-
-        return df
+        """
+        clip manifest of a split folder, file headers are read in parallel, no audio is decoded
+        """
+        x_files, speaker_names, headers = scan_split(data_path, ext=self.ext)
+        return ClipManifest.from_scan(x_files, speaker_names, headers)
+
+    def __centroids(self, split):
+        # speaker centroid table written by cache_dataset.py, for the speaker models only
+        speaker_model = self.cfg.model.model_name == 'AutoEncoder_Speaker_PL' or \
+            self.cfg.model.model_name == 'AutoEncoder_Speaker_PL2'
+        if not speaker_model or not self.cfg.dataset.speaker_centroids:
+            return None
+        return SpeakerCentroids.load(self.data_dir / split)
+
+    def __shard_sampler(self, df, shuffle, with_epoch=False):
+        # one shard per process when training distributed, the whole set otherwise
+        if self.trainer is None:
+            num_replicas, rank = 1, 0
+        else:
+            num_replicas, rank = self.trainer.world_size, self.trainer.global_rank
+        return SpeakerShardSampler(df,
+                                   num_replicas=num_replicas,
+                                   rank=rank,
+                                   shuffle=shuffle,
+                                   seed=self.cfg.training.distributed.seed,
+                                   with_epoch=with_epoch)
 
     def train_dataloader(self):
         assert (self.df_train is not None)
+        pitch_bank = None
+        if self.cfg.augmentations.do_pitchshift_indep and self.cfg.augmentations.pitchshift_bank:
+            pitch_bank = PitchBank(self.data_dir / 'train' / 'pitch_bank')
+        energy_index = None
+        if self.cfg.dataset.energy_crop:
+            energy_index = EnergyIndex(self.data_dir / 'train')
+        persist_worker = True if self.num_workers > 0 else False
+        if self.cfg.dataset.train_shards:
+            # sequential reads of tar shards, shuffled by shard then in each worker's buffer.
+            # the pitch bank is keyed by the train folder's paths, shifts are computed on the fly instead
+            if self.trainer is None:
+                num_replicas, rank = 1, 0
+            else:
+                num_replicas, rank = self.trainer.world_size, self.trainer.global_rank
+            train_set = ShardedAudioDataset(self.data_dir / 'train_shards',
+                                            cfg=self.cfg,
+                                            do_augmentation=self.do_aug_in_train,
+                                            num_replicas=num_replicas,
+                                            rank=rank,
+                                            shuffle_buffer=self.cfg.dataset.shard_shuffle_buffer,
+                                            stage_timer=self.dataset_timer,
+                                            energy_index=energy_index,
+                                            centroids=self.__centroids('train_shards'))
+            return DataLoader(train_set,
+                              batch_size=self.batch_size,
+                              num_workers=self.num_workers,
+                              persistent_workers=persist_worker)
+
         train_set = AudioDataset(self.df_train,
                                  cfg=self.cfg,
-                                 do_augmentation=self.do_aug_in_train)
-        persist_worker = True if self.num_workers > 0 else False
+                                 do_augmentation=self.do_aug_in_train,
+                                 stage_timer=self.dataset_timer,
+                                 pitch_bank=pitch_bank,
+                                 clip_cache=self.clip_cache,
+                                 energy_index=energy_index,
+                                 centroids=self.__centroids('train'))
         return DataLoader(train_set,
                           batch_size=self.batch_size,
                           num_workers=self.num_workers,
                           persistent_workers=persist_worker,
-                          shuffle=self.shuffle_train)
+                          sampler=self.__shard_sampler(self.df_train, shuffle=self.shuffle_train, with_epoch=True))
 
     def val_dataloader(self):
         assert (self.df_val is not None)
-        val_set = AudioDataset(self.df_val, cfg=self.cfg, do_augmentation=self.do_aug_in_val)
+        val_set = AudioDataset(self.df_val, cfg=self.cfg, do_augmentation=self.do_aug_in_val,
+                               clip_cache=self.clip_cache, centroids=self.__centroids('val'))
         persist_worker = True if self.num_workers > 0 else False
 
         return DataLoader(val_set,
                           batch_size=self.batch_size,
                           num_workers=self.num_workers,
-                          persistent_workers=persist_worker)
+                          persistent_workers=persist_worker,
+                          sampler=self.__shard_sampler(self.df_val, shuffle=False))
 
     def test_dataloader(self):
         assert (self.df_test is not None)
-        test_set = AudioDataset(self.df_test, cfg=self.cfg, do_augmentation=self.do_aug_in_test)
+        test_set = AudioDataset(self.df_test, cfg=self.cfg, do_augmentation=self.do_aug_in_test,
+                                pad=not self.bucket_by_length, clip_cache=self.clip_cache,
+                                centroids=self.__centroids('test'))
         persist_worker = True if self.num_workers > 0 else False
+        sampler = self.__shard_sampler(self.df_test, shuffle=False)
+        if self.bucket_by_length:
+            # clips longer than a block are cropped to it
+            max_length = self.cfg.dataset.block_size if self.cfg.dataset.do_random_block else None
+            return DataLoader(test_set,
+                              num_workers=self.num_workers,
+                              persistent_workers=persist_worker,
+                              batch_sampler=self.__bucket_sampler(self.df_test, list(sampler), max_length),
+                              collate_fn=partial(pad_collate, pad_multiple=self.pad_multiple))
         return DataLoader(test_set,
                           batch_size=self.batch_size,
                           num_workers=self.num_workers,
-                          persistent_workers=persist_worker)
+                          persistent_workers=persist_worker,
+                          sampler=sampler)
 
     def predict_dataloader(self):
         assert (self.df_predict is not None)
+        # predict uses the test speakers
+        centroids = self.__centroids('test')
         if self.do_aug_in_predict:
-            pred_set = AudioDataset(self.df_predict, cfg=self.cfg, do_augmentation=True)
+            pred_set = AudioDataset(self.df_predict, cfg=self.cfg, do_augmentation=True,
+                                    pad=not self.bucket_by_length, centroids=centroids)
             pred_set.set_random_crop(False)
         else:
-            pred_set = AudioDatasetPred(self.df_predict, cfg=self.cfg)
+            pred_set = AudioDatasetPred(self.df_predict, cfg=self.cfg, centroids=centroids)
+        if self.bucket_by_length:
+            # predict files are not chunked, they are batched by length instead of one at a time
+            return DataLoader(pred_set,
+                              batch_sampler=self.__bucket_sampler(self.df_predict),
+                              collate_fn=partial(pad_collate, pad_multiple=self.pad_multiple))
         return DataLoader(pred_set, batch_size=self.batch_size)
 
+    def __bucket_sampler(self, df, indexes=None, max_length=None):
+        # from the headers read when the split was scanned or cached
+        lengths = df['num_frames'].tolist()
+        if max_length is not None:
+            lengths = [min(length, max_length) for length in lengths]
+        return LengthBucketBatchSampler(lengths, batch_size=self.batch_size, indexes=indexes)
+
+    def on_before_batch_transfer(self, batch, dataloader_idx):
+        # host to device copy of training batches
+        if self.stage_timer.enabled and self.trainer is not None and self.trainer.training:
+            self.transfer_start = self.stage_timer._now()
+        return batch
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        if self.stage_timer.enabled and self.transfer_start is not None:
+            self.stage_timer.add('h2d', self.stage_timer._now() - self.transfer_start)
+            self.transfer_start = None
+        return batch
+
     def teardown(self, stage: str):
         # Used to clean-up when the run is finished
-        ...
+        if self.clip_cache is not None and not self.cfg.training.clip_cache.keep:
+            self.clip_cache.clear()
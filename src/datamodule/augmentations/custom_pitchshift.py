@@ -1,10 +1,15 @@
+import hashlib
 import librosa
 import random
+import numpy as np
 import torch
+from pathlib import Path
 from torch import Tensor
 from typing import Optional
 from torch_audiomentations.core.transforms_interface import BaseWaveformTransform
 from torch_audiomentations.utils.object_dict import ObjectDict
+from src.datamodule.augmentations.pitch_bank import PitchBank
+from src.datamodule.clip_cache import SharedClipCache
 
 
 class PitchShift_Slow(BaseWaveformTransform):
@@ -32,6 +37,10 @@ class PitchShift_Slow(BaseWaveformTransform):
         sample_rate: int = None,
         target_rate: int = None,
         output_type: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        cache_max_bytes: int = 4 * 2 ** 30,
+        bank: Optional[PitchBank] = None,
+        interpolate: bool = False,
     ):
         """
         :param sample_rate:
@@ -41,6 +50,14 @@ class PitchShift_Slow(BaseWaveformTransform):
         :param p:
         :param p_mode:
         :param target_rate:
+        :param cache_dir: if set, shifted outputs are stored here as .npy, keyed by the input and transposition,
+            and reused whenever the same input is shifted the same way again
+        :param cache_max_bytes: the least recently read outputs are evicted once the cache grows past this
+        :param bank: bank mode, reads the clip's precomputed variants instead of shifting, see render_pitch_bank.
+            The clip is picked with select_clip, so this has to run on whole clips before any cropping.
+            Clips missing from the bank or changed since it was rendered are shifted on the fly
+        :param interpolate: bank mode, any transposition in range by mixing the two neighbouring variants,
+            otherwise one of the rendered variants is picked
         """
         super().__init__(
             mode=mode,
@@ -64,6 +81,21 @@ class PitchShift_Slow(BaseWaveformTransform):
         self.max_transpose_semitones = max_transpose_semitones
 
         self._mode = mode
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self.cache = None if cache_dir is None else SharedClipCache(cache_dir, max_bytes=cache_max_bytes)
+
+        self.bank = bank
+        self.interpolate = interpolate
+        self.bank_row = None
+        if self.bank is not None:
+            assert mode == "per_example", "bank mode shifts whole examples"
+
+    def select_clip(self, file):
+        # bank mode, the clip the next samples are read from. None shifts them on the fly
+        if file in self.bank and self.bank.is_fresh(file):
+            self.bank_row = self.bank.row(file)
+        else:
+            self.bank_row = None
 
     def randomize_parameters(
         self,
@@ -78,7 +110,10 @@ class PitchShift_Slow(BaseWaveformTransform):
         """
         batch_size, num_channels, num_samples = samples.shape
 
-        if self._mode == "per_example":
+        if self.bank is not None and not self.interpolate:
+            self.transform_parameters["transpositions"] = \
+                [random.choice(self.bank.semitones) for _ in range(0, batch_size)]
+        elif self._mode == "per_example":
             list_of_trans = []
             for b in range(0, batch_size):
                 list_of_trans.append(
@@ -98,6 +133,22 @@ class PitchShift_Slow(BaseWaveformTransform):
             self.transform_parameters["transpositions"] = \
                 random.uniform(self.min_transpose_semitones, self.max_transpose_semitones)
 
+    def __pitch_shift(self, samples, n_steps, sample_rate):
+        if self.cache is None:
+            return librosa.effects.pitch_shift(samples, n_steps=n_steps, sr=sample_rate)
+
+        key = hashlib.sha1(np.ascontiguousarray(samples).tobytes())
+        key.update(f"{samples.shape}{samples.dtype}{float(n_steps)!r}{sample_rate}".encode())
+        key = key.hexdigest()
+        cache_file = self.cache_dir / key[:2] / f"{key}.npy"
+        shifted = self.cache.read(cache_file)
+        if shifted is not None:
+            return np.array(shifted)
+
+        shifted = librosa.effects.pitch_shift(samples, n_steps=n_steps, sr=sample_rate)
+        self.cache.store(cache_file, shifted)
+        return shifted
+
     def apply_transform(
         self,
         samples: Tensor = None,
@@ -121,28 +172,35 @@ class PitchShift_Slow(BaseWaveformTransform):
         # convert to ndarray
         samples = samples.numpy()
 
-        if self._mode == "per_example":
+        if self.bank is not None and self.bank_row is not None:
+            for i in range(batch_size):
+                # a memory read instead of a phase vocoder
+                samples[i, ...] = self.bank.shift(self.bank_row,
+                                                  n_steps=self.transform_parameters["transpositions"][i],
+                                                  interpolate=self.interpolate)
+
+        elif self._mode == "per_example":
             for i in range(batch_size):
-                samples[i, ...] = librosa.effects.pitch_shift(
+                samples[i, ...] = self.__pitch_shift(
                     samples[i][None],
                     n_steps=self.transform_parameters["transpositions"][i],
-                    sr=sample_rate,
+                    sample_rate=sample_rate,
                 )[0]
 
         elif self._mode == "per_channel":
             for i in range(batch_size):
                 for j in range(num_channels):
-                    samples[i, j, ...] = librosa.effects.pitch_shift(
+                    samples[i, j, ...] = self.__pitch_shift(
                         samples[i][j][None][None],
                         n_steps=self.transform_parameters["transpositions"][i][j],
-                        sr=sample_rate,
+                        sample_rate=sample_rate,
                     )[0][0]
 
         elif self._mode == "per_batch":
-            samples = librosa.effects.pitch_shift(
+            samples = self.__pitch_shift(
                 samples,
                 n_steps=self.transform_parameters["transpositions"][0],
-                sr=sample_rate
+                sample_rate=sample_rate
             )
 
         # revert to tensor
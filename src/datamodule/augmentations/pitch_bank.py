@@ -0,0 +1,102 @@
+import json
+import os
+import librosa
+import numpy as np
+import torchaudio
+from pathlib import Path
+from tqdm import tqdm
+
+
+def render_pitch_bank(files, bank_path, semitones, sample_rate, min_length=0, dtype='float32'):
+    """
+    Renders every clip pitch shifted by each of the semitones into one memory mapped array,
+    [num_clips, num_variants, max_length], clips zero padded to the longest one.
+    :param files: clip wav files, as in the x column of the dataset's dataframe
+    :param bank_path: folder to write variants.npy and bank.json into, with each clip's size and mtime
+    :param min_length: clips shorter than this are padded like AudioDataset does, e.g. cfg.dataset.block_size
+    """
+    bank_path = Path(bank_path)
+    bank_path.mkdir(parents=True, exist_ok=True)
+
+    lengths = [max(torchaudio.info(file).num_frames, min_length) for file in files]
+    stats = [os.stat(file) for file in files]
+    variants = np.lib.format.open_memmap(bank_path / 'variants.npy', mode='w+', dtype=dtype,
+                                         shape=(len(files), len(semitones), max(lengths)))
+
+    for row, file in enumerate(tqdm(files, desc='Rendering pitch bank')):
+        waveform, sr = torchaudio.load(file)
+        assert sr == sample_rate, f"{file} is {sr}Hz, expected {sample_rate}Hz"
+        waveform = waveform[0].numpy()
+        if len(waveform) < min_length:
+            # same padding as AudioDataset, one sample in front
+            waveform = np.pad(waveform, (1, min_length - len(waveform) - 1))
+        for variant, n_steps in enumerate(semitones):
+            variants[row, variant, :len(waveform)] = librosa.effects.pitch_shift(waveform, sr=sample_rate,
+                                                                                 n_steps=n_steps)
+    variants.flush()
+
+    with open(bank_path / 'bank.json', 'w') as f:
+        json.dump({'files': [str(file) for file in files],
+                   'lengths': lengths,
+                   'sizes': [stat.st_size for stat in stats],
+                   'mtimes_ns': [stat.st_mtime_ns for stat in stats],
+                   'semitones': [float(n_steps) for n_steps in semitones],
+                   'sample_rate': sample_rate}, f)
+
+
+class PitchBank:
+    """
+    Reads the pitch shifted variants written by render_pitch_bank.
+    The array is memory mapped on first use in each process, so dataloader workers share the page cache
+    instead of pickling the bank.
+    A clip missing from the bank, or changed since it was rendered, is not fresh and has to be shifted on the fly.
+    """
+    def __init__(self, bank_path):
+        self.bank_path = Path(bank_path)
+        with open(self.bank_path / 'bank.json', 'r') as f:
+            bank = json.load(f)
+        self.rows = {file: row for row, file in enumerate(bank['files'])}
+        self.lengths = bank['lengths']
+        # banks rendered without them are never fresh
+        self.sizes = bank.get('sizes')
+        self.mtimes_ns = bank.get('mtimes_ns')
+        self.semitones = np.array(bank['semitones'])
+        self.sample_rate = bank['sample_rate']
+        self.variants = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['variants'] = None
+        return state
+
+    def __contains__(self, file):
+        return str(file) in self.rows
+
+    def row(self, file):
+        return self.rows[str(file)]
+
+    def is_fresh(self, file):
+        # same size and mtime as when the clip was rendered
+        if self.sizes is None or file not in self:
+            return False
+        stat = os.stat(file)
+        row = self.row(file)
+        return stat.st_size == self.sizes[row] and stat.st_mtime_ns == self.mtimes_ns[row]
+
+    def shift(self, row, n_steps, interpolate=False):
+        """
+        the clip shifted by the nearest rendered variant, or linearly mixed from the two neighbouring variants
+        """
+        if self.variants is None:
+            self.variants = np.load(self.bank_path / 'variants.npy', mmap_mode='r')
+        length = self.lengths[row]
+
+        position = np.interp(n_steps, self.semitones, np.arange(len(self.semitones)))
+        if not interpolate:
+            return np.asarray(self.variants[row, int(round(position)), :length], dtype=np.float32)
+
+        lower = int(np.floor(position))
+        upper = min(lower + 1, len(self.semitones) - 1)
+        weight = position - lower
+        return (1.0 - weight) * np.asarray(self.variants[row, lower, :length], dtype=np.float32) + \
+            weight * np.asarray(self.variants[row, upper, :length], dtype=np.float32)
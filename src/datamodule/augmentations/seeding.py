@@ -0,0 +1,32 @@
+import random
+import numpy as np
+import torch
+from contextlib import contextmanager
+
+
+def sample_seed(seed, epoch, idx):
+    """
+    Seed of one sample's augmentations, from a counter based rng (philox) keyed by the global seed and
+    counted by (epoch, idx). The same sample in the same epoch always gets the same seed, whichever worker loads it.
+    """
+    bit_generator = np.random.Philox(key=seed, counter=[idx, epoch, 0, 0])
+    return int(bit_generator.random_raw() >> 1)  # 63 bits, fits torch.manual_seed
+
+
+@contextmanager
+def seeded_rng(seed):
+    """
+    Seeds python, numpy and torch cpu rngs for the block, then restores them.
+    torch_audiomentations draws from torch, the custom augmentations and target speaker choice from python.
+    """
+    python_state = random.getstate()
+    numpy_state = np.random.get_state()
+    with torch.random.fork_rng(devices=[]):
+        random.seed(seed)
+        np.random.seed(seed % 2**32)
+        torch.manual_seed(seed)
+        try:
+            yield
+        finally:
+            random.setstate(python_state)
+            np.random.set_state(numpy_state)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import getpass
+import hashlib
+import tempfile
+import numpy as np
+import torch
+from pathlib import Path
+from tqdm import tqdm
+from src.utils.audio_storage import load_audio
+
+
+def default_cache_dir(name='svpc_clip_cache'):
+    # tmpfs where there is one, the temp folder otherwise (e.g. macos). one folder per user on shared nodes
+    name = f"{name}_{getpass.getuser()}"
+    if os.path.isdir('/dev/shm'):
+        return Path('/dev/shm') / name
+    return Path(tempfile.gettempdir()) / name
+
+
+class SharedClipCache:
+    """
+    Decoded clips kept as .npy files in a RAM backed folder, /dev/shm by default.
+    Every dataloader worker, persistent or not, and every epoch reads the same files. Reads are memory mapped
+    copy on write, so workers share the pages instead of each holding a copy.
+    Clips are decoded and stored on first access, or all at once by warm().
+    Once the folder grows past max_bytes the least recently read clips are evicted. Each process only
+    counts its own writes between scans of the folder, so the cap is approximate.
+    The folder outlives the process, clear() removes it, see AudioDataModule.teardown.
+    read() and store() also serve other arrays kept this way, e.g. PitchShift_Slow's shifted blocks.
+    """
+    def __init__(self, cache_dir=None, max_bytes=8 * 2 ** 30, backend=None, storage_encoding=None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.storage_encoding = storage_encoding
+        self.bytes_estimate = None
+
+    def cache_file(self, file):
+        # the source's path, size and mtime, a rewritten clip is decoded again.
+        # clips decoded by another backend or from another storage encoding are not shared
+        stat = os.stat(file)
+        key = hashlib.sha1(f"{os.path.abspath(file)}/{stat.st_size}/{stat.st_mtime_ns}/"
+                           f"{self.backend}/{self.storage_encoding}".encode()).hexdigest()
+        return self.cache_dir / key[:2] / (key + '.npy')
+
+    def load(self, file):
+        """
+        the decoded clip [channels, samples], from the cache or decoded and stored
+        """
+        cache_file = self.cache_file(file)
+        waveform = self.read(cache_file)
+        if waveform is not None:
+            return torch.from_numpy(waveform)
+
+        waveform, _ = load_audio(file, self.backend)
+        self.store(cache_file, waveform.numpy())
+        return waveform
+
+    def read(self, cache_file):
+        """
+        the memory mapped array of cache_file, None when it is not cached
+        """
+        try:
+            array = np.load(cache_file, mmap_mode='c')
+            os.utime(cache_file)  # last read, for eviction
+            return array
+        except (FileNotFoundError, ValueError):
+            # not cached yet, evicted meanwhile, or another process is still writing it
+            return None
+
+    def store(self, cache_file, waveform):
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'wb') as f:
+            np.save(f, waveform)
+        os.replace(tmp_file, cache_file)
+
+        if self.bytes_estimate is None:
+            self.bytes_estimate = self.size()
+        else:
+            self.bytes_estimate += os.path.getsize(cache_file)
+        if self.bytes_estimate > self.max_bytes:
+            self.evict()
+
+    def size(self):
+        return sum(cache_file.stat().st_size for cache_file in self.cache_dir.glob('*/*.npy'))
+
+    def evict(self, low_watermark=0.9):
+        """
+        deletes the least recently read clips until the cache is under low_watermark * max_bytes
+        """
+        cache_files = []
+        for cache_file in self.cache_dir.glob('*/*.npy'):
+            try:
+                stat = cache_file.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process
+            cache_files.append((stat.st_mtime_ns, stat.st_size, cache_file))
+        cache_files.sort()
+
+        total = sum(size for _, size, _ in cache_files)
+        for _, size, cache_file in cache_files:
+            if total <= low_watermark * self.max_bytes:
+                break
+            # open memory maps of other workers stay valid after the unlink
+            cache_file.unlink(missing_ok=True)
+            total -= size
+        self.bytes_estimate = total
+
+    def clear(self):
+        """
+        removes the cache folder and the RAM it holds, open memory maps stay valid
+        """
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.bytes_estimate = None
+
+    def warm(self, files):
+        """
+        decodes every file not cached yet, e.g. before the dataloader workers start
+        """
+        for file in tqdm(files, desc='Warming clip cache'):
+            if not self.cache_file(file).exists():
+                self.load(file)
@@ -0,0 +1,207 @@
+import os
+import random
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+from pathlib import Path
+from src.datamodule.energy_index import EnergyIndex, clip_key
+from src.utils.corpus_scan import read_headers
+
+
+def write_clip_manifest(split_path, x_files, speaker_names, clip_keys=None, dvecs=None, thresh_db=-40.0,
+                        headers=None):
+    """
+    Writes a split's clips.parquet, one row per clip, and its d-vectors as the dvecs.npy matrix.
+    Lengths are read from the file headers, energy stats from the split's energy_index.pkl when there is one.
+    With d-vectors, the speaker centroid table is written as speaker_centroids.npz, see SpeakerCentroids.
+    :param dvecs: [num_clips, emb_size] array or None for models without speaker embeddings
+    :param thresh_db: frames above are counted in voiced_fraction
+    :param headers: the clips' headers from scan_split, read here when not given
+    """
+    split_path = Path(split_path)
+    split_path.mkdir(parents=True, exist_ok=True)
+    names, speakers = np.unique(np.array(speaker_names, dtype=str), return_inverse=True)
+
+    if headers is None:
+        headers = read_headers(x_files)
+    energies = {}
+    if (split_path / 'energy_index.pkl').exists():
+        energy_index = EnergyIndex(split_path)
+        energies = {x_file: energy_index.clips.get(clip_key(x_file)) for x_file in x_files}
+    energy_db = [energies.get(x_file) for x_file in x_files]
+
+    table = pa.table({
+        # relative to the split folder, the dataset can be moved
+        'x': [Path(os.path.relpath(x_file, split_path)).as_posix() for x_file in x_files],
+        'speaker': pa.array(speakers, type=pa.int32()),
+        'speaker_name': [str(name) for name in speaker_names],
+        'num_frames': pa.array([header['num_frames'] for header in headers], type=pa.int64()),
+        'sample_rate': pa.array([header['sample_rate'] for header in headers], type=pa.int32()),
+        'channels': pa.array([header['channels'] for header in headers], type=pa.int32()),
+        'duration': pa.array([header['num_frames'] / header['sample_rate'] for header in headers],
+                             type=pa.float32()),
+        'mtime_ns': pa.array([header['mtime_ns'] for header in headers], type=pa.int64()),
+        'energy_mean_db': pa.array([np.nan if db is None else float(np.mean(db.astype(np.float32)))
+                                    for db in energy_db], type=pa.float32()),
+        'voiced_fraction': pa.array([np.nan if db is None else float(np.mean(db.astype(np.float32) > thresh_db))
+                                     for db in energy_db], type=pa.float32()),
+        'clip_key': [''] * len(x_files) if clip_keys is None else list(clip_keys),
+        'dvec_row': pa.array(np.arange(len(x_files)) if dvecs is not None else np.full(len(x_files), -1),
+                             type=pa.int32()),
+    })
+
+    if dvecs is not None:
+        tmp_path = split_path / 'dvecs.tmp.npy'
+        np.save(tmp_path, np.asarray(dvecs, dtype=np.float32))
+        tmp_path.replace(split_path / 'dvecs.npy')
+    if dvecs is not None and len(x_files) > 0:
+        centroids, counts = speaker_centroids(speakers, dvecs, len(names))
+        tmp_path = split_path / 'speaker_centroids.tmp.npz'
+        np.savez(tmp_path, speaker_names=names, centroids=centroids, counts=counts)
+        tmp_path.replace(split_path / 'speaker_centroids.npz')
+    tmp_path = split_path / 'clips.tmp.parquet'
+    pq.write_table(table, tmp_path)
+    tmp_path.replace(split_path / 'clips.parquet')
+
+
+def speaker_centroids(speakers, dvecs, num_speakers):
+    """
+    mean of each speaker's normalized d-vectors, normalized again like a single d-vector
+    :param speakers: speaker row of every clip
+    :return: [num_speakers, emb_size] centroids, [num_speakers] clips per speaker
+    """
+    dvecs = np.asarray(dvecs, dtype=np.float32).reshape(len(speakers), -1)
+    dvecs = dvecs / np.maximum(np.linalg.norm(dvecs, axis=1, keepdims=True), 1e-8)
+    counts = np.bincount(speakers, minlength=num_speakers)
+    centroids = np.zeros((num_speakers, dvecs.shape[1]), dtype=np.float32)
+    np.add.at(centroids, speakers, dvecs)
+    centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-8)
+    return centroids, counts
+
+
+class SpeakerCentroids:
+    """
+    One d-vector per speaker of a split, read from the speaker_centroids.npz written by write_clip_manifest.
+    Targets are drawn among the speakers instead of among the clips, and need no clip embedded at inference.
+    """
+    def __init__(self, speaker_names, centroids, counts):
+        self.speaker_names = [str(name) for name in speaker_names]
+        self.rows = {name: row for row, name in enumerate(self.speaker_names)}
+        self.centroids = torch.from_numpy(np.asarray(centroids, dtype=np.float32))
+        self.counts = np.asarray(counts)
+
+    @classmethod
+    def load(cls, split_path):
+        with np.load(Path(split_path) / 'speaker_centroids.npz') as table:
+            return cls(table['speaker_names'], table['centroids'], table['counts'])
+
+    @classmethod
+    def from_manifest(cls, clips):
+        """
+        centroids of a manifest with d-vectors, in memory
+        """
+        names, speakers = np.unique(clips['speaker_name'], return_inverse=True)
+        dvecs = np.stack([clips.dvec(row).numpy() for row in range(0, len(clips))])
+        return cls(names, *speaker_centroids(speakers, dvecs, len(names)))
+
+    def __len__(self):
+        return len(self.speaker_names)
+
+    def __contains__(self, speaker_name):
+        return str(speaker_name) in self.rows
+
+    def centroid(self, speaker_name):
+        """
+        the speaker's centroid as a tensor [emb_size]
+        """
+        return self.centroids[self.rows[str(speaker_name)]]
+
+    def other_speaker(self, speaker_name):
+        # any other speaker, drawn with python's rng. any speaker when this one is not in the table
+        row = self.rows.get(str(speaker_name))
+        if row is None:
+            return self.speaker_names[random.randrange(len(self))]
+        other = random.randrange(len(self) - 1)
+        return self.speaker_names[other + 1 if other >= row else other]
+
+
+class ClipManifest:
+    """
+    Clips of a split as columns, read from the clips.parquet and dvecs.npy written by write_clip_manifest,
+    or from a corpus scan, or from a dataframe with x and speaker_name (and dvec) columns.
+    Columns are read on first access, memory mapped, and returned as numpy arrays, manifest['x'] works as
+    df['x'] did. The d-vectors stay memory mapped, dataloader workers read them from the page cache.
+    When pickled into workers, columns read from the files are left behind and read again there.
+    """
+    def __init__(self, split_path=None):
+        self.split_path = Path(split_path) if split_path is not None else None
+        self.columns = {}
+        self.dvecs = None
+        self.num_rows = None
+        if self.split_path is not None:
+            self.num_rows = pq.ParquetFile(self.split_path / 'clips.parquet').metadata.num_rows
+
+    @classmethod
+    def from_scan(cls, x_files, speaker_names, headers):
+        """
+        in memory manifest of a split without speaker embeddings, from scan_split
+        """
+        manifest = cls()
+        manifest.num_rows = len(x_files)
+        manifest.columns['x'] = np.array(x_files, dtype=str)
+        manifest.columns['speaker_name'] = np.array(speaker_names, dtype=str)
+        _, manifest.columns['speaker'] = np.unique(manifest.columns['speaker_name'], return_inverse=True)
+        for column in ['num_frames', 'sample_rate', 'channels', 'mtime_ns']:
+            manifest.columns[column] = np.array([header[column] for header in headers], dtype=np.int64)
+        return manifest
+
+    @classmethod
+    def from_dataframe(cls, df):
+        manifest = cls()
+        manifest.num_rows = len(df)
+        manifest.columns['x'] = np.array([str(x) for x in df['x']])
+        manifest.columns['speaker_name'] = np.array([str(name) for name in df['speaker_name']])
+        _, manifest.columns['speaker'] = np.unique(manifest.columns['speaker_name'], return_inverse=True)
+        if 'dvec' in df.columns:
+            manifest.dvecs = np.stack([np.asarray(dvec, dtype=np.float32).reshape(-1) for dvec in df['dvec']])
+            manifest.columns['dvec_row'] = np.arange(len(df))
+        return manifest
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, column):
+        if column not in self.columns:
+            table = pq.read_table(self.split_path / 'clips.parquet', columns=[column], memory_map=True)
+            values = table.column(column).to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)
+            if column == 'x':
+                values = np.char.add(self.split_path.as_posix() + '/', values)
+            self.columns[column] = values
+        return self.columns[column]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.split_path is not None:
+            state['columns'] = {}
+            state['dvecs'] = None
+        return state
+
+    def dvec(self, row):
+        """
+        the d-vector of a clip as a tensor [emb_size]
+        """
+        if self.dvecs is None:
+            self.dvecs = np.load(self.split_path / 'dvecs.npy', mmap_mode='r')
+        return torch.from_numpy(np.array(self.dvecs[self['dvec_row'][row]]))
+
+    def unrelated(self, row):
+        # clips of every other speaker
+        return np.flatnonzero(self['speaker'] != self['speaker'][row])
+
+    def related(self, row):
+        # other clips of the same speaker
+        speakers = self['speaker']
+        return np.flatnonzero((speakers == speakers[row]) & (np.arange(len(speakers)) != row))
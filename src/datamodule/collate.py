@@ -0,0 +1,19 @@
+import math
+import torch
+from torch.utils.data import default_collate
+
+
+def pad_collate(batch, pad_multiple=1):
+    """
+    Collates (x, y, dvecs, names) samples of different lengths. x and y are zero padded at the end to the batch's
+    longest sample, rounded up to pad_multiple for models that need whole blocks.
+    Returns (x, y, dvecs, names, lengths), lengths of the unpadded samples so losses can leave the padding out.
+    """
+    lengths = torch.tensor([x.size(-1) for x, _, _, _ in batch])
+    max_length = math.ceil(int(lengths.max()) / pad_multiple) * pad_multiple
+
+    x = torch.stack([torch.nn.functional.pad(x, (0, max_length - x.size(-1))) for x, _, _, _ in batch])
+    y = torch.stack([torch.nn.functional.pad(y, (0, max_length - y.size(-1))) for _, y, _, _ in batch])
+    dvecs, names = default_collate([(dvecs, names) for _, _, dvecs, names in batch])
+    return x, y, dvecs, names, lengths
+
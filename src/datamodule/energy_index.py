@@ -0,0 +1,97 @@
+import os
+import pickle
+import librosa
+import numpy as np
+import soundfile as sf
+import torch
+from pathlib import Path
+
+
+def frame_energy_db(waveform, hop_length=1024):
+    """
+    rms of each non overlapping frame in dBFS, the last partial frame included. waveform [samples]
+    """
+    num_frames = int(np.ceil(len(waveform) / hop_length))
+    frames = np.zeros(num_frames * hop_length, dtype=np.float32)
+    frames[:len(waveform)] = waveform
+    rms = np.sqrt(np.mean(frames.reshape(num_frames, hop_length) ** 2, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-5))
+
+
+def clip_key(file):
+    # speaker/clip name, the same whichever folder the split was read from
+    return Path(file).parent.name + '/' + Path(file).name
+
+
+def build_energy_index(split_path, ext='wav', hop_length=1024):
+    """
+    Frame energies of every clip in a split, written to <split_path>/energy_index.pkl.
+    Clips whose size and mtime are unchanged since the last build are not read again.
+    :return: number of clips read
+    """
+    split_path = Path(split_path)
+    index_path = split_path / 'energy_index.pkl'
+    previous = {}
+    if index_path.exists():
+        with open(index_path, 'rb') as f:
+            index = pickle.load(f)
+        if index['hop_length'] == hop_length:
+            previous = index['clips']
+
+    clips = {}
+    num_read = 0
+    for file in librosa.util.find_files(split_path, ext=ext):
+        stat = os.stat(file)
+        key = clip_key(file)
+        entry = previous.get(key)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            waveform, _ = sf.read(file, dtype='float32', always_2d=True)
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                     'db': frame_energy_db(waveform.mean(axis=1), hop_length).astype(np.float16)}
+            num_read += 1
+        clips[key] = entry
+
+    tmp_path = index_path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'hop_length': hop_length, 'clips': clips}, f)
+    tmp_path.replace(index_path)
+    return num_read
+
+
+class EnergyIndex:
+    """
+    Reads the frame energies written by build_energy_index, and draws crop offsets weighted toward voiced frames.
+    """
+    def __init__(self, split_path):
+        with open(Path(split_path) / 'energy_index.pkl', 'rb') as f:
+            index = pickle.load(f)
+        self.hop_length = index['hop_length']
+        self.clips = {key: entry['db'] for key, entry in index['clips'].items()}
+
+    def __contains__(self, file):
+        return clip_key(file) in self.clips
+
+    def voiced_offset(self, file, length, block_size, min_voiced_fraction=0.5, thresh_db=-40.0):
+        """
+        Start of a block_size crop of a clip of length samples, drawn with torch's rng.
+        Among the crops with at least min_voiced_fraction of frames above thresh_db, more voiced crops are drawn
+        more often. When none reaches min_voiced_fraction, the most voiced crops are drawn from.
+        """
+        voiced = (self.clips[clip_key(file)].astype(np.float32) > thresh_db).astype(np.float32)
+        max_start = length - block_size
+        # crops starting at every frame boundary
+        starts = np.arange(0, max_start // self.hop_length + 1)
+        block_frames = max(block_size // self.hop_length, 1)
+        voiced_sum = np.concatenate([[0.0], np.cumsum(voiced)])
+        ends = np.minimum(starts + block_frames, len(voiced))
+        fractions = (voiced_sum[ends] - voiced_sum[np.minimum(starts, len(voiced))]) / block_frames
+
+        weights = np.where(fractions >= min_voiced_fraction, fractions, 0.0)
+        if weights.sum() == 0:
+            # no crop is voiced enough, the most voiced ones then. all of them for a silent clip
+            weights = (fractions == fractions.max()).astype(np.float64)
+
+        start = int(starts[torch.multinomial(torch.from_numpy(weights), 1).item()]) * self.hop_length
+        # anywhere within the frame, still inside the clip
+        jitter = int(torch.randint(0, self.hop_length, (1,)).item())
+        return min(start + jitter, max_start)
@@ -0,0 +1,117 @@
+import math
+import torch
+import pandas as pd
+from torch.utils.data import Sampler
+
+
+class SpeakerShardSampler(Sampler):
+    """
+    Rank aware sampler, each rank gets an equal sized shard with every speaker's files spread evenly across ranks.
+    The shard only decides which rows are the source clips, target speakers are still drawn from the full dataframe
+    by AudioDataset, so speaker pairs stay valid on every rank.
+    Lightning calls set_epoch at the start of each epoch, all ranks reshuffle the same way from seed + epoch.
+    With with_epoch, (epoch, index) pairs are yielded so AudioDataset can seed each sample's augmentations,
+    persistent workers never see set_epoch themselves.
+    """
+    def __init__(self, df: pd.DataFrame,
+                 num_replicas: int = 1,
+                 rank: int = 0,
+                 shuffle: bool = True,
+                 seed: int = 0,
+                 drop_last: bool = False,
+                 with_epoch: bool = False):
+        assert 0 <= rank < num_replicas, f"invalid rank {rank} for {num_replicas} replicas"
+        self.speaker_names = df['speaker_name'].tolist()
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.with_epoch = with_epoch
+        self.epoch = 0
+
+        if self.drop_last:
+            self.num_samples = len(self.speaker_names) // self.num_replicas
+        else:
+            self.num_samples = math.ceil(len(self.speaker_names) / self.num_replicas)
+        self.total_size = self.num_samples * self.num_replicas
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+
+        speakers = {}
+        for index, speaker_name in enumerate(self.speaker_names):
+            speakers.setdefault(speaker_name, []).append(index)
+
+        # speaker by speaker, so dealing the indexes round robin gives each rank the same share of a speaker
+        speaker_order = sorted(speakers.keys())
+        if self.shuffle:
+            speaker_order = [speaker_order[i] for i in torch.randperm(len(speaker_order), generator=generator)]
+
+        indexes = []
+        for speaker_name in speaker_order:
+            speaker_indexes = speakers[speaker_name]
+            if self.shuffle:
+                speaker_indexes = [speaker_indexes[i] for i in
+                                   torch.randperm(len(speaker_indexes), generator=generator)]
+            indexes += speaker_indexes
+
+        if self.drop_last:
+            indexes = indexes[:self.total_size]
+        elif len(indexes) < self.total_size:
+            padding_size = self.total_size - len(indexes)
+            indexes += (indexes * math.ceil(padding_size / len(indexes)))[:padding_size]
+
+        shard = indexes[self.rank:self.total_size:self.num_replicas]
+
+        if self.shuffle:
+            # mix speakers within the shard
+            shard = [shard[i] for i in torch.randperm(len(shard), generator=generator)]
+
+        if self.with_epoch:
+            return iter([(self.epoch, index) for index in shard])
+        return iter(shard)
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Batches files of similar length together, so padding to the batch's longest file wastes little.
+    Indexes are sorted by length and cut into batches, the batch order is shuffled when shuffle is set.
+    """
+    def __init__(self, lengths,
+                 batch_size: int,
+                 indexes=None,
+                 shuffle: bool = False,
+                 seed: int = 0):
+        """
+        :param lengths: length in samples of every row of the dataset
+        :param indexes: rows to batch, e.g. a rank's shard, all rows if None
+        """
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.indexes = list(range(len(lengths))) if indexes is None else list(indexes)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self):
+        return math.ceil(len(self.indexes) / self.batch_size)
+
+    def __iter__(self):
+        indexes = sorted(self.indexes, key=lambda index: self.lengths[index])
+        batches = [indexes[i:i + self.batch_size] for i in range(0, len(indexes), self.batch_size)]
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=generator)]
+        return iter(batches)
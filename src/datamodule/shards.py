@@ -0,0 +1,159 @@
+import io
+import json
+import multiprocessing
+import random
+import tarfile
+import numpy as np
+import soundfile as sf
+import torch
+from pathlib import Path
+from omegaconf import DictConfig
+from torch.utils.data import IterableDataset, get_worker_info
+from src.datamodule.audio_dataloader import AudioDataset
+from src.datamodule.clip_manifest import ClipManifest, write_clip_manifest
+from src.datamodule.augmentations.seeding import sample_seed, seeded_rng
+
+
+def write_shards(clips: ClipManifest, shard_dir, samples_per_shard=512, seed=0):
+    """
+    Writes the clips of a split into tar shards of samples_per_shard samples, in a shuffled order.
+    Each sample is <row>.<ext> with the clip as stored, <row>.json with its metadata and <row>.dvec.npy with its
+    d-vector for speaker models, row being its row in the clips.parquet and dvecs.npy written next to the shards.
+    Those two are the in memory table the speaker pairs are drawn from.
+    :return: the shard files
+    """
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    x_files = clips['x'].tolist()
+    speaker_names = clips['speaker_name'].tolist()
+    dvecs = None
+    if clips.dvecs is not None or (clips.split_path is not None and (clips.split_path / 'dvecs.npy').exists()):
+        dvecs = np.stack([clips.dvec(row).numpy() for row in range(0, len(clips))])
+    write_clip_manifest(shard_dir, x_files, speaker_names, dvecs=dvecs)
+
+    order = np.random.default_rng(seed).permutation(len(x_files))
+    shard_files = []
+    for shard, start in enumerate(range(0, len(order), samples_per_shard)):
+        shard_file = shard_dir / f"shard-{shard:06d}.tar"
+        with tarfile.open(shard_dir / (shard_file.name + '.tmp'), 'w') as tar:
+            for row in order[start:start + samples_per_shard]:
+                key = f"{row:08d}"
+                _add_bytes(tar, key + Path(x_files[row]).suffix, Path(x_files[row]).read_bytes())
+                _add_bytes(tar, key + '.json', json.dumps({'row': int(row),
+                                                           'speaker_name': speaker_names[row]}).encode())
+                if dvecs is not None:
+                    buffer = io.BytesIO()
+                    np.save(buffer, dvecs[row])
+                    _add_bytes(tar, key + '.dvec.npy', buffer.getvalue())
+        (shard_dir / (shard_file.name + '.tmp')).replace(shard_file)
+        shard_files.append(shard_file)
+
+    with open(shard_dir / 'shards.json', 'w') as f:
+        json.dump({'shards': [shard_file.name for shard_file in shard_files],
+                   'num_samples': [len(order[start:start + samples_per_shard])
+                                   for start in range(0, len(order), samples_per_shard)]}, f)
+    return shard_files
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def read_shard(shard_file):
+    """
+    streams the samples of a shard in order, (row, clip bytes)
+    """
+    with tarfile.open(shard_file, 'r|') as tar:
+        sample = {}
+        for member in tar:
+            key, ext = member.name.split('.', 1)
+            if sample and sample['key'] != key:
+                yield sample['row'], sample['audio']
+                sample = {}
+            data = tar.extractfile(member).read()
+            sample['key'] = key
+            if ext == 'json':
+                sample['row'] = json.loads(data)['row']
+            elif ext != 'dvec.npy':
+                sample['audio'] = data
+        if sample:
+            yield sample['row'], sample['audio']
+
+
+class ShardedAudioDataset(IterableDataset):
+    """
+    Streams a split from the tar shards written by write_shards, each shard read sequentially.
+    Shards are shuffled every epoch and dealt to ranks then dataloader workers, samples go through a shuffle buffer.
+    Every rank yields the same number of samples, workers with fewer samples in their shards read them again.
+    Samples are made by AudioDataset from the decoded clips, speaker pairs are drawn from the shards' clip manifest.
+    The epoch is shared with the dataloader workers, persistent ones included. Lightning only sets the epoch of
+    samplers, so ShardEpochCallback sets it from the trainer every epoch.
+    """
+    def __init__(self, shard_dir, cfg: DictConfig, do_augmentation: bool = False,
+                 num_replicas: int = 1, rank: int = 0, shuffle_buffer: int = 1000, **dataset_kwargs):
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir / 'shards.json', 'r') as f:
+            index = json.load(f)
+        self.shards = index['shards']
+        self.num_samples = index['num_samples']
+        self.dataset = AudioDataset(ClipManifest(self.shard_dir), cfg=cfg, do_augmentation=do_augmentation,
+                                    **dataset_kwargs)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = cfg.training.distributed.seed
+        self.epoch = multiprocessing.Value('i', 0)
+
+    def set_epoch(self, epoch: int):
+        self.epoch.value = epoch
+
+    def __len__(self):
+        return sum(self.num_samples) // self.num_replicas
+
+    def __worker_shards(self, epoch):
+        worker_info = get_worker_info()
+        num_workers, worker_id = (1, 0) if worker_info is None else (worker_info.num_workers, worker_info.id)
+
+        shards = list(range(0, len(self.shards)))
+        random.Random(self.seed + epoch).shuffle(shards)
+        # every rank and worker reads other shards, shared round robin when there are fewer shards than workers
+        num_readers = self.num_replicas * num_workers
+        reader = self.rank * num_workers + worker_id
+        worker_shards = [shards[i % len(shards)] for i in range(reader, max(len(shards), num_readers), num_readers)]
+
+        limit = len(self) // num_workers + (1 if worker_id < len(self) % num_workers else 0)
+        return worker_shards, limit, worker_id
+
+    def __samples(self, worker_shards, limit):
+        count = 0
+        while count < limit:
+            for shard in worker_shards:
+                for row, audio in read_shard(self.shard_dir / self.shards[shard]):
+                    if count == limit:
+                        return
+                    count += 1
+                    yield row, audio
+
+    def __iter__(self):
+        epoch = self.epoch.value
+        worker_shards, limit, worker_id = self.__worker_shards(epoch)
+        rng = random.Random(sample_seed(self.seed, epoch, self.rank * 1000 + worker_id))
+
+        buffer = []
+        for sample in self.__samples(worker_shards, limit):
+            buffer.append(sample)
+            if len(buffer) >= self.shuffle_buffer:
+                yield self.__make_sample(buffer.pop(rng.randrange(len(buffer))), epoch)
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self.__make_sample(sample, epoch)
+
+    def __make_sample(self, sample, epoch):
+        row, audio = sample
+        with self.dataset.timer.time('decode'):
+            waveform, _ = sf.read(io.BytesIO(audio), dtype='float32', always_2d=True)
+            waveform = torch.from_numpy(waveform.T.copy())
+        with seeded_rng(sample_seed(self.seed, epoch, row)):
+            return self.dataset.sample_from_waveform(row, waveform)
@@ -4,10 +4,9 @@ import os
 import shutil
 import gdown
 import urllib.request
-import librosa.util
-import soundfile as sf
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 from tqdm import tqdm
+from src.utils.ingest import ingest_zip
 
 
 def main():
@@ -67,58 +66,34 @@ def download_vocalset():
     ## vocalset
     vocalset_raw_path = Path("./data/raw/vocalset")
     vocalset_interim_path = Path("./data/interim/vocalset")
-    vocalset_raw_path_posix = (root_path / vocalset_raw_path).as_posix()
     vocalset_filename = "VocalSet11.zip"
+    vocalset_zip_path = root_path / vocalset_raw_path / vocalset_filename
 
-    # download vocalset
-    if not (root_path / vocalset_raw_path).exists():
-        print("Creating vocalset folder")
-        Path.mkdir(root_path / vocalset_raw_path)
+    # download vocalset, an archive already in data/raw is used as is
+    if not vocalset_zip_path.exists():
+        print("Downloading vocalset")
+        Path.mkdir(root_path / vocalset_raw_path, parents=True, exist_ok=True)
 
         ## use v1.1 version for smaller download than v1.2
         vocalset_link = "https://zenodo.org/record/1203819/files/VocalSet11.zip?download=1"
-        download_url(vocalset_link, (root_path / vocalset_raw_path / vocalset_filename).as_posix())
+        download_url(vocalset_link, vocalset_zip_path.as_posix())
     else:
-        print("vocalset folder existed")
+        print("vocalset archive existed")
 
-    ## move vocalset folder to interim
+    ## stream the wav files into interim, without extracting the archive
     if not (root_path / vocalset_interim_path).exists():
         print("Creating vocalset interim folder")
         Path.mkdir(root_path / vocalset_interim_path)
 
-        # extract zip file
-        shutil.unpack_archive(root_path / vocalset_raw_path / vocalset_filename,
-                              root_path / vocalset_raw_path)
-
-        # copy extracted wav to interim
-        for file_path in Path(vocalset_raw_path_posix).glob('**/*.wav'):
-            # include this dataset's spoken files
-            speaker_name = file_path.parent.parent.parent.name  # only specific to vocalset dataset
-            speaker_path = root_path / vocalset_interim_path / speaker_name
-            target_path = speaker_path / file_path.name
-
-            if not speaker_path.exists():
-                Path.mkdir(speaker_path)
-
-            i = 1
-            while True:
-                if target_path.exists():
-                    target_path = speaker_path / (
-                            file_path.stem + '_' + str(i) + file_path.suffix
-                    )
-                    i += 1
-                    continue
-                else:
-                    break
-            shutil.copy(file_path, target_path)
-
-        # delete original extracted files
-        shutil.rmtree(root_path / vocalset_raw_path / '__MACOSX');
-        shutil.rmtree(root_path / vocalset_raw_path / 'FULL');
-        (root_path / vocalset_raw_path / 'readme-anon.txt').unlink()
-        (root_path / vocalset_raw_path / 'test_singers_technique.txt').unlink()
-        (root_path / vocalset_raw_path / 'train_singers_technique.txt').unlink()
-        (root_path / vocalset_raw_path / 'DataSetVocalises.pdf').unlink()
+        def select(name):
+            # skip the mac resource forks
+            name = PurePosixPath(name)
+            return name.suffix == '.wav' and name.parts[0] != '__MACOSX' and not name.name.startswith('._')
+
+        def speaker_of(name):
+            return PurePosixPath(name).parent.parent.parent.name  # only specific to vocalset dataset
+
+        ingest_zip(vocalset_zip_path, root_path / vocalset_interim_path, select=select, speaker_of=speaker_of)
     else:
         print("vocalset interim folder existed")
 
@@ -129,69 +104,33 @@ def download_vctk():
     ## vctk
     vctk_raw_path = Path("./data/raw/vctk")
     vctk_interim_path = Path("./data/interim/vctk")
-    vctk_raw_path_posix = (root_path / vctk_raw_path).as_posix()
     vctk_filename = "DS_10283_3443.zip"
+    vctk_zip_path = root_path / vctk_raw_path / vctk_filename
 
-    # download vctk
-    if not (root_path / vctk_raw_path).exists():
-        print("Creating vctk folder")
-        Path.mkdir(root_path / vctk_raw_path)
+    # download vctk, an archive already in data/raw is used as is
+    if not vctk_zip_path.exists():
+        print("Downloading vctk")
+        Path.mkdir(root_path / vctk_raw_path, parents=True, exist_ok=True)
         vctk_link = 'https://datashare.ed.ac.uk/download/DS_10283_3443.zip'
-        download_url(vctk_link, (root_path / vctk_raw_path / vctk_filename).as_posix())
+        download_url(vctk_link, vctk_zip_path.as_posix())
     else:
-        print("vctk folder existed")
+        print("vctk archive existed")
 
-    ## move vctk folder to interim
+    ## convert the mic1 flac files to wav into interim, read from the corpus zip inside the download
     if not (root_path / vctk_interim_path).exists():
         print("Creating vctk interim folder")
         Path.mkdir(root_path / vctk_interim_path)
 
-        vctk_raw_zip_path = root_path / vctk_raw_path / Path("./VCTK-Corpus-0.92.zip")
-        if not vctk_raw_zip_path.exists():
-            # extract zip file
-            shutil.unpack_archive(root_path / vctk_raw_path / vctk_filename,
-                                  root_path / vctk_raw_path)
-
-        if not (root_path / vctk_raw_path / Path('./wav48_silence_trimmed')).exists():
-            shutil.unpack_archive(vctk_raw_zip_path,
-                                  root_path / vctk_raw_path)
-
-        flac_files = librosa.util.find_files(root_path / vctk_raw_path, ext='flac')
-
-        # copy extracted flac to wav to interim
-        for file_path in tqdm(flac_files):
-            if 'mic1' in str(file_path):  # store only mic1 audio
-                # send all of this dataset's spoken files
-                file_path = Path(file_path)
-                speaker_name = file_path.parent.name  # only specific to vctk dataset
-                speaker_path = root_path / vctk_interim_path / speaker_name
-                target_path = speaker_path / file_path.name
-
-                if not speaker_path.exists():
-                    Path.mkdir(speaker_path)
+        def select(name):
+            # store only mic1 audio
+            name = PurePosixPath(name)
+            return name.suffix == '.flac' and 'mic1' in name.name
 
-                i = 1
-                while True:
-                    if target_path.exists():
-                        target_path = speaker_path / (
-                                file_path.stem + '_' + str(i) + file_path.suffix
-                        )
-                        i += 1
-                        continue
-                    else:
-                        break
-                data, sr = sf.read(file_path)
-                sf.write(target_path.with_suffix('.wav'), data, sr, subtype='PCM_16')
-
-        # delete original extracted files
-        shutil.rmtree(root_path / vctk_raw_path / 'txt');
-        shutil.rmtree(root_path / vctk_raw_path / 'wav48_silence_trimmed');
-        (root_path / vctk_raw_path / 'license_text').unlink()
-        (root_path / vctk_raw_path / 'README.txt').unlink()
-        (root_path / vctk_raw_path / 'speaker-info.txt').unlink()
-        (root_path / vctk_raw_path / 'update.txt').unlink()
-        (root_path / vctk_raw_path / 'VCTK-Corpus-0.92.zip').unlink()
+        def speaker_of(name):
+            return PurePosixPath(name).parent.name  # only specific to vctk dataset
 
+        ingest_zip(vctk_zip_path, root_path / vctk_interim_path, select=select, speaker_of=speaker_of,
+                   nested='VCTK-Corpus-0.92.zip', to_wav=True)
     else:
         print("vctk interim folder existed")
 
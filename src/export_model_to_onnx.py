@@ -1,66 +1,179 @@
 import hydra
 import os
+import time
 import torch
 import torch.onnx
 import onnx
 import onnxruntime as ort
 import numpy as np
+import pandas as pd
 from pathlib import Path
 from omegaconf import DictConfig
-from src.model.wavenet import WaveNet_PL
+from src.model.wavenet import WaveNet_PL, StreamingWaveNet
 from src.model.waveUnet import WaveUNet_PL
 from src.model.autoencoder import AutoEncoder_PL
 from src.model.autoencoder_speaker import AutoEncoder_Speaker_PL
+from src.model.autoencoder_speaker2 import AutoEncoder_Speaker_PL2
+from src.utils.quantization import (
+    quantized_filename, quantize_onnx_dynamic, quantize_onnx_static, load_clips,
+    ClipCalibrationReader, compare_onnx_variants)
+from src.utils.audio_storage import storage_ext
+
+speaker_models = ['AutoEncoder_Speaker_PL', 'AutoEncoder_Speaker_PL2']
+model_names = ['WaveNet_PL', 'WaveUNet_PL', 'AutoEncoder_PL'] + speaker_models
+# the names export_to_onnx.model accepted before it took the class names
+model_aliases = {'wavenet': 'WaveNet_PL', 'waveunet': 'WaveUNet_PL'}
+
+
+def resolve_model_name(model_name):
+    """
+    class name of export_to_onnx.model, the old 'wavenet' and 'waveunet' aliases included
+    """
+    model_name = model_aliases.get(model_name, model_name)
+    if model_name not in model_names:
+        raise ValueError(f"export_to_onnx.model {model_name!r} is invalid, "
+                         f"choose one of {model_names + list(model_aliases)}")
+    return model_name
 
 
 @hydra.main(version_base=None, config_path="../conf", config_name="config")
 def main(cfg: DictConfig):
     cur_path = Path(os.path.abspath(hydra.utils.get_original_cwd()))
-    ckpt_path = cfg.export_to_onnx.checkpoint_file
+    ckpt_path = cur_path / Path(cfg.export_to_onnx.checkpoint_file)
+    model_name = resolve_model_name(cfg.export_to_onnx.model)
 
-    if cfg.export_to_onnx.model == 'wavenet':
-        model_pl = WaveNet_PL.load_from_checkpoint(cur_path/Path(ckpt_path))
+    if model_name == 'WaveNet_PL':
+        model_pl = WaveNet_PL.load_from_checkpoint(ckpt_path)
         torch_model = model_pl.wavenet
 
-    elif cfg.export_to_onnx.model == 'waveunet':
-        model_pl = WaveUNet_PL.load_from_checkpoint(cur_path / Path(ckpt_path))
+    elif model_name == 'WaveUNet_PL':
+        model_pl = WaveUNet_PL.load_from_checkpoint(ckpt_path)
         torch_model = model_pl.waveunet
 
-    elif cfg.testing.model_name == 'AutoEncoder_PL':
-        model_pl = AutoEncoder_PL.load_from_checkpoint(cur_path / Path(ckpt_path))
+    elif model_name == 'AutoEncoder_PL':
+        model_pl = AutoEncoder_PL.load_from_checkpoint(ckpt_path)
         torch_model = model_pl.autoencoder
 
-    elif cfg.testing.model_name == 'AutoEncoder_Speaker_PL':
-        model_pl = AutoEncoder_Speaker_PL.load_from_checkpoint(cur_path / Path(ckpt_path))
+    elif model_name == 'AutoEncoder_Speaker_PL':
+        cfg.model.embedder_path = cur_path / Path(cfg.model.embedder_path)
+        cfg.model.ae_path = cur_path / Path(cfg.model.ae_path)
+        model_pl = AutoEncoder_Speaker_PL.load_from_checkpoint(ckpt_path, cfg=cfg)
+        torch_model = model_pl.autoencoder
+
+    elif model_name == 'AutoEncoder_Speaker_PL2':
+        cfg.model.embedder_path = cur_path / Path(cfg.model.embedder_path)
+        cfg.model.ae_path = cur_path / Path(cfg.model.ae_path)
+        model_pl = AutoEncoder_Speaker_PL2.load_from_checkpoint(ckpt_path, cfg=cfg)
         torch_model = model_pl.autoencoder
-    else:
-        assert False
 
     sample_block_size = cfg.export_to_onnx.sample_block_size
     onnx_filename = cfg.export_to_onnx.export_filename
-    torch_model.eval()
+    emb_size = cfg.model.emb_size if model_name in speaker_models else None
+
+    torch_model = unwrap_compiled(torch_model)
+    export_to_onnx(torch_model, onnx_filename, sample_block_size, emb_size=emb_size)
+    print("saved: " + onnx_filename)
 
-    if cfg.testing.model_name == 'AutoEncoder_Speaker_PL':
-        dummy_wav = torch.randn(1, 1, sample_block_size)
-        dummy_dvec = torch.randn(1, cfg.model.emb_size)
-        test_out = torch_model(dummy_wav, dummy_dvec)
+    batch_sizes = cfg.export_to_onnx.parity_batch_sizes
+    block_sizes = cfg.export_to_onnx.parity_block_sizes
+    if block_sizes is None:
+        block_sizes = [sample_block_size // 2, sample_block_size, sample_block_size * 2]
+
+    report = check_onnx_parity(torch_model, onnx_filename,
+                               batch_sizes=batch_sizes,
+                               block_sizes=block_sizes,
+                               emb_size=emb_size,
+                               latency_runs=cfg.export_to_onnx.latency_runs)
+    print(report.to_string(index=False))
+
+    if cfg.export_to_onnx.parity_report is not None:
+        report.to_csv(cur_path / Path(cfg.export_to_onnx.parity_report), index=False)
+
+    if cfg.export_to_onnx.quantization is not None:
+        quantize(cfg, cur_path, onnx_filename, sample_block_size, model_name, emb_size)
+
+    if cfg.export_to_onnx.streaming:
+        assert model_name == 'WaveNet_PL', "streaming export is only available for WaveNet_PL"
+        streaming_model = StreamingWaveNet(torch_model)
+        streaming_filename = streaming_onnx_filename(onnx_filename)
+        export_streaming_to_onnx(streaming_model, streaming_filename,
+                                 buffer_size=cfg.export_to_onnx.streaming_buffer_sizes[0])
+        print("saved: " + streaming_filename)
+
+        report = check_streaming_parity(torch_model, streaming_filename,
+                                        buffer_sizes=cfg.export_to_onnx.streaming_buffer_sizes,
+                                        signal_length=sample_block_size,
+                                        sample_rate=cfg.dataset.sample_rate)
+        print(report.to_string(index=False))
+
+    print("Conversion done")
 
-        dummy_input = (dummy_wav, dummy_dvec)
-        assert (test_out.size() == dummy_wav.size())
 
+def quantize(cfg, cur_path, onnx_filename, sample_block_size, model_name, emb_size):
+    mode = cfg.export_to_onnx.quantization
+    if mode == 'auto':
+        # lstm heavy speaker models are weight bound, the conv models are activation bound
+        mode = 'dynamic' if model_name in speaker_models else 'static'
 
+    val_path = cur_path / Path(cfg.dataset.data_path) / 'val'
+    feeds = load_clips(val_path, ext=storage_ext(cfg.process_data.storage_encoding), block_size=sample_block_size,
+                       num_clips=cfg.export_to_onnx.calibration_clips, emb_size=emb_size)
+
+    output_filename = quantized_filename(onnx_filename, mode)
+    if mode == 'dynamic':
+        quantize_onnx_dynamic(onnx_filename, output_filename)
+    elif mode == 'static':
+        quantize_onnx_static(onnx_filename, output_filename, ClipCalibrationReader(feeds))
     else:
-        dummy_input = torch.randn(1, 1, sample_block_size)
-        test_out = torch_model(dummy_input)
-        assert (test_out.size() == dummy_input.size())
+        assert False, " quantization mode is invalid!"
+    print("saved: " + output_filename)
+
+    report = compare_onnx_variants({'fp32': onnx_filename, f'int8_{mode}': output_filename}, feeds,
+                                   latency_runs=cfg.export_to_onnx.latency_runs)
+    print(report.to_string(index=False))
+
+
+def unwrap_compiled(torch_model):
+    # torch.compile wraps modules in an OptimizedModule, onnx export needs the original module
+    torch_model = getattr(torch_model, '_orig_mod', torch_model)
+    for name, child in list(torch_model.named_children()):
+        if hasattr(child, '_orig_mod'):
+            setattr(torch_model, name, child._orig_mod)
+    return torch_model
+
+
+def dummy_inputs(sample_block_size, batch_size=1, emb_size=None):
+    dummy_wav = torch.randn(batch_size, 1, sample_block_size)
+    if emb_size is None:
+        return (dummy_wav,)
+
+    dummy_dvec = torch.randn(batch_size, emb_size)
+    dummy_dvec = dummy_dvec / torch.norm(dummy_dvec, p=2, dim=1, keepdim=True)  # d-vectors are normalised
+    return dummy_wav, dummy_dvec
+
+
+def export_to_onnx(torch_model, onnx_filename, sample_block_size, emb_size=None):
+    """
+    Exports a single input model, or a speaker model taking (audio, d-vector) when emb_size is given,
+    with dynamic batch and block size axes.
+    """
+    torch_model.eval()
+    dummy_input = dummy_inputs(sample_block_size, emb_size=emb_size)
 
-        input_names = ["input1"]
+    with torch.no_grad():
+        test_out = torch_model(*dummy_input)
+    assert (test_out.size() == dummy_input[0].size())
 
+    input_names = ["input1"]
     dynamic_axes = {
-        "input1": {2: 'blocksize'},  # dim 2
-        "output1": {2: 'blocksize'}  # dim 2
+        "input1": {0: 'batch', 2: 'blocksize'},
+        "output1": {0: 'batch', 2: 'blocksize'}
     }
 
+    if emb_size is not None:
+        input_names.append("dvec")
+        dynamic_axes["dvec"] = {0: 'batch'}
+
     output_names = ["output1"]
 
     torch.onnx.export(
@@ -71,79 +184,153 @@ def main(cfg: DictConfig):
         output_names=output_names,
         dynamic_axes=dynamic_axes,
     )
-    print("saved: " + onnx_filename)
 
     onnx_model = onnx.load(onnx_filename)
     onnx.checker.check_model(onnx_model)
 
-    if cfg.testing.model_name == 'AutoEncoder_Speaker_PL':
-        print("test with expected blocksize")
-        test_speaker_embedding_model_onnx_output(torch_model, onnx_filename,
-                                      sample_block_size=sample_block_size,
-                                                 emb_size=cfg.model.emb_size)
 
-        # print("test with larger blocksize")
-        # test_speaker_embedding_model_onnx_output(torch_model, onnx_filename,
-        #                                          sample_block_size=(sample_block_size * 2),
-        #                                          emb_size=cfg.model.emb_size)
+def time_ms(fn, runs):
+    fn()  # warm up
+    timings = []
+    for _ in range(0, runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
 
-        # print("test with smaller blocksize ")
-        # test_speaker_embedding_model_onnx_output(torch_model, onnx_filename,
-        #                               sample_block_size=(sample_block_size // 2),
-        #                                          emb_size=cfg.model.emb_size)
 
-    else:
-        print("test with expected blocksize")
-        test_single_input_onnx_output(torch_model, onnx_filename, sample_block_size=sample_block_size)
+def check_onnx_parity(torch_model, onnx_filename, batch_sizes, block_sizes, emb_size=None,
+                      latency_runs=10, rtol=1e-03, atol=1e-02):
+    """
+    Runs the torch model and the onnxruntime session on every batch size and block size,
+    asserts the outputs are close and returns a dataframe of the differences and median latencies.
+    """
+    ort_session = ort.InferenceSession(onnx_filename, providers=['CPUExecutionProvider'])
+    torch_model.eval()
 
-        print("test with larger blocksize")
-        test_single_input_onnx_output(torch_model, onnx_filename, sample_block_size=(sample_block_size * 2))
+    rows = []
+    for batch_size in batch_sizes:
+        for block_size in block_sizes:
+            dummy_input = dummy_inputs(block_size, batch_size=batch_size, emb_size=emb_size)
+            ort_inputs = {"input1": dummy_input[0].numpy()}
+            if emb_size is not None:
+                ort_inputs["dvec"] = dummy_input[1].numpy()
 
-        print("test with smaller blocksize ")
-        test_single_input_onnx_output(torch_model, onnx_filename,
-                                      sample_block_size=(sample_block_size // 2))
+            def run_onnx():
+                return ort_session.run(None, ort_inputs)[0]
 
-    print("Conversion done")
+            def run_torch():
+                with torch.no_grad():
+                    return torch_model(*dummy_input).numpy()
 
+            onnx_outputs = run_onnx()
+            torch_outputs = run_torch()
+            np.testing.assert_allclose(torch_outputs, onnx_outputs, rtol=rtol, atol=atol,
+                                       err_msg=f"batch size {batch_size}, block size {block_size}")
 
-def test_single_input_onnx_output(torch_model, onnx_filename, sample_block_size):
-    ort_session = ort.InferenceSession(onnx_filename)
-    dummy_input = torch.randn(1, 1, sample_block_size)
+            ort_ms = time_ms(run_onnx, latency_runs)
+            rows.append({'batch_size': batch_size,
+                         'block_size': block_size,
+                         'max_abs_diff': float(np.max(np.abs(torch_outputs - onnx_outputs))),
+                         'torch_ms': time_ms(run_torch, latency_runs),
+                         'onnx_ms': ort_ms,
+                         'onnx_ms_per_sample': ort_ms / batch_size})
 
-    onnx_outputs = ort_session.run(
-        None,
-        {"input1": dummy_input.numpy()},
-    )
-    # print(onnx_outputs[0][0])
+    return pd.DataFrame(rows)
 
-    torch_model.eval()
-    torch_outputs = torch_model(dummy_input)
 
-    # print(torch_outputs[0])
+def streaming_onnx_filename(onnx_filename):
+    onnx_filename = Path(onnx_filename)
+    return (onnx_filename.parent / f"{onnx_filename.stem}.streaming{onnx_filename.suffix}").as_posix()
 
-    np.testing.assert_allclose(torch_outputs[0].detach().numpy(), onnx_outputs[0][0], rtol=1e-03, atol=1e-02)
-    print("Model output delta is close... Good!")
 
+def export_streaming_to_onnx(streaming_model, onnx_filename, buffer_size=256):
+    """
+    Exports a StreamingWaveNet taking (input1, cache_0...) and returning (output1, new_cache_0...),
+    with dynamic batch and buffer size axes.
+    """
+    streaming_model.eval()
+    caches = streaming_model.initial_caches()
+    dummy_input = (torch.randn(1, 1, buffer_size), *caches)
 
-def test_speaker_embedding_model_onnx_output(torch_model, onnx_filename, sample_block_size, emb_size):
-    ort_session = ort.InferenceSession(onnx_filename)
-    dummy_wav = torch.randn(1, 1, sample_block_size)
-    dummy_dvec = torch.randn(1, emb_size)
+    cache_names = [f"cache_{i}" for i in range(0, len(caches))]
+    input_names = ["input1"] + cache_names
+    output_names = ["output1"] + [f"new_{name}" for name in cache_names]
 
-    onnx_outputs = ort_session.run(
-        None,
-        {"input1": dummy_wav.numpy(),
-         "dvec": dummy_dvec.numpy()},
+    dynamic_axes = {
+        "input1": {0: 'batch', 2: 'buffersize'},
+        "output1": {0: 'batch', 2: 'buffersize'}
+    }
+    for name in cache_names:
+        dynamic_axes[name] = {0: 'batch'}
+        dynamic_axes[f"new_{name}"] = {0: 'batch'}
+
+    torch.onnx.export(
+        streaming_model,
+        args=dummy_input,
+        f=onnx_filename,
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
     )
-    # print(onnx_outputs[0][0])
 
-    torch_model.eval()
-    torch_outputs = torch_model(dummy_wav, dummy_dvec)
+    onnx_model = onnx.load(onnx_filename)
+    onnx.checker.check_model(onnx_model)
 
-    # print(torch_outputs[0])
 
-    np.testing.assert_allclose(torch_outputs[0].detach().numpy(), onnx_outputs[0][0], rtol=1e-03, atol=1e-02)
-    print("Model output delta is close... Good!")
+def stream_onnx(ort_session, signal, buffer_size):
+    """
+    Reference host loop, feeds the signal buffer by buffer and carries the caches between calls.
+    Returns the streamed output and the time taken by each call.
+    :param signal: numpy array [b, 1, samples]
+    """
+    cache_inputs = [i for i in ort_session.get_inputs() if i.name.startswith('cache_')]
+    caches = {i.name: np.zeros((signal.shape[0], i.shape[1], i.shape[2]), dtype=np.float32)
+              for i in cache_inputs}
+
+    out_blocks = []
+    timings = []
+    for start in range(0, signal.shape[2], buffer_size):
+        feed = {"input1": signal[:, :, start:start + buffer_size], **caches}
+        begin = time.perf_counter()
+        outputs = ort_session.run(None, feed)
+        timings.append(time.perf_counter() - begin)
+
+        out_blocks.append(outputs[0])
+        caches = {i.name: cache for i, cache in zip(cache_inputs, outputs[1:])}
+
+    return np.concatenate(out_blocks, axis=2), np.array(timings)
+
+
+def check_streaming_parity(torch_model, onnx_filename, buffer_sizes, signal_length, sample_rate,
+                           rtol=1e-03, atol=1e-04):
+    """
+    Streams a random signal through the onnx graph for every buffer size, asserts the output matches
+    the offline torch model on the whole signal and reports the per buffer latency and cpu load,
+    the share of the buffer's duration spent computing it.
+    """
+    ort_session = ort.InferenceSession(onnx_filename, providers=['CPUExecutionProvider'])
+    torch_model.eval()
+
+    signal = torch.randn(1, 1, signal_length)
+    with torch.no_grad():
+        offline = torch_model(signal).numpy()
+
+    rows = []
+    for buffer_size in buffer_sizes:
+        streamed, timings = stream_onnx(ort_session, signal.numpy(), buffer_size)
+        np.testing.assert_allclose(offline, streamed, rtol=rtol, atol=atol,
+                                   err_msg=f"buffer size {buffer_size}")
+
+        timings = timings[1:]  # first call warms up the session
+        buffer_duration = buffer_size / sample_rate
+        rows.append({'buffer_size': buffer_size,
+                     'max_abs_diff': float(np.max(np.abs(offline - streamed))),
+                     'latency_ms_median': float(np.median(timings)) * 1000,
+                     'latency_ms_p99': float(np.percentile(timings, 99)) * 1000,
+                     'cpu_load': float(np.mean(timings)) / buffer_duration})
+
+    return pd.DataFrame(rows)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+## python src/export_shards.py dataset=nus
+## python src/export_shards.py dataset=nus model=autoencoder_speaker  # after cache_dataset.py, with the d-vectors
+import hydra
+import os
+from pathlib import Path
+from omegaconf import DictConfig
+from src.datamodule.clip_manifest import ClipManifest
+from src.datamodule.shards import write_shards
+from src.utils.audio_storage import storage_ext
+from src.utils.corpus_scan import scan_split
+
+
+@hydra.main(version_base=None, config_path="../conf", config_name="config")
+def main(cfg: DictConfig):
+    root_path = Path(os.path.abspath(hydra.utils.get_original_cwd()))
+
+    data_path = root_path / cfg.dataset.data_path
+    split_path = data_path / 'train'
+
+    # the manifest written by cache_dataset.py keeps the d-vectors, a scan of the folder otherwise
+    if (split_path / 'clips.parquet').exists():
+        clips = ClipManifest(split_path)
+    else:
+        clips = ClipManifest.from_scan(*scan_split(split_path, ext=storage_ext(cfg.process_data.storage_encoding)))
+
+    shard_path = data_path / 'train_shards'
+    shard_files = write_shards(clips, shard_path,
+                               samples_per_shard=cfg.dataset.shard_samples,
+                               seed=cfg.training.distributed.seed)
+    print(f'Saved {len(clips)} clips in {len(shard_files)} shards to:', shard_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,6 @@ import pytorch_lightning as pl
 from omegaconf import DictConfig
 from src.utils.losses import Losses, PreEmphasisFilter
 from audio_encoders_pytorch import AutoEncoder1d
-from archisound import ArchiSound
 
 
 
@@ -21,6 +20,7 @@ class AutoEncoder_PL(pl.LightningModule):
             factors=[4, 4, 4],          # Downsampling/upsampling factor per layer
             num_blocks=[2, 2, 2]        # Number of resnet blocks per layer
         )
+        # from archisound import ArchiSound  # pulls in transformers
         # self.autoencoder = ArchiSound.from_pretrained("autoencoder1d-AT-v1")
 
         self.lr = cfg.training.learning_rate
@@ -52,14 +52,14 @@ class AutoEncoder_PL(pl.LightningModule):
     def forward(self, x):
         return self.autoencoder(x)
 
-    def _lossfn(self, y, y_pred):
+    def _lossfn(self, y, y_pred, lengths=None):
         if self.loss_preemphasis_hp_filter:
             y, y_pred = self.fir_filter(y, y_pred)
 
         if self.loss_preemphasis_aw_filter:
             y, y_pred = self.aw_filter(y, y_pred)
 
-        return self.loss.forward(y, y_pred)
+        return self.loss.forward(y, y_pred, lengths=lengths)
 
     def training_step(self, batch, batch_idx):
         y, y_pred = self._shared_eval_step(batch)
@@ -69,7 +69,7 @@ class AutoEncoder_PL(pl.LightningModule):
         return {"loss": loss, "log": logs}
 
     def _shared_eval_step(self, batch):
-        x, y, dvec, name = batch
+        x, y, dvec, name = batch[:4]
         y_pred = self.forward(x)
         return y, y_pred
 
@@ -87,7 +87,8 @@ class AutoEncoder_PL(pl.LightningModule):
 
     def test_step(self, batch, batch_idx):
         y, y_pred = self._shared_eval_step(batch)
-        loss = self._lossfn(y, y_pred)
+        lengths = batch[4] if len(batch) > 4 else None  # length bucketed batches, see pad_collate
+        loss = self._lossfn(y, y_pred, lengths)
         return {"test_loss": loss}
 
     def on_test_epoch_end(self):
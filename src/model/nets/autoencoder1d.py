@@ -0,0 +1,174 @@
+import json
+import torch
+import torch.nn as nn
+from pathlib import Path
+from torch import Tensor
+from audio_encoders_pytorch import TanhBottleneck
+from audio_encoders_pytorch.modules import Encoder1d, Decoder1d, Bottleneck
+from audio_encoders_pytorch.utils import default, prefix_dict
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+
+bottleneck = {'tanh': TanhBottleneck}
+
+
+class AutoEncoder1dConfig:
+    """
+    config of the hugging face archinetai/autoencoder1d-AT-v1 model, read from its config.json
+    """
+    model_type = "archinetai/autoencoder1d-AT-v1"
+
+    def __init__(
+            self,
+            in_channels: int = 2,
+            patch_size: int = 4,
+            channels: int = 32,
+            multipliers: Sequence[int] = [1, 2, 4, 8, 8, 8, 1],
+            factors: Sequence[int] = [2, 2, 2, 1, 1, 1],
+            num_blocks: Sequence[int] = [2, 2, 8, 8, 8, 8],
+            bottleneck: str = 'tanh',
+            **kwargs
+    ):
+        # kwargs takes hugging face's own keys, e.g. architectures, torch_dtype, transformers_version
+        self.in_channels = in_channels
+        self.patch_size = patch_size
+        self.channels = channels
+        self.multipliers = multipliers
+        self.factors = factors
+        self.num_blocks = num_blocks
+        self.bottleneck = bottleneck
+
+    @classmethod
+    def from_json_file(cls, json_file):
+        with open(json_file, 'r') as f:
+            return cls(**json.load(f))
+
+    def to_dict(self):
+        return {'architectures': ['AutoEncoder1d'],
+                'model_type': self.model_type,
+                'in_channels': self.in_channels,
+                'patch_size': self.patch_size,
+                'channels': self.channels,
+                'multipliers': list(self.multipliers),
+                'factors': list(self.factors),
+                'num_blocks': list(self.num_blocks),
+                'bottleneck': self.bottleneck}
+
+
+class AutoEncoder1d(nn.Module):
+    """
+    Hugging face AE model, loaded from its config.json and state dict without transformers
+    """
+
+    config_class = AutoEncoder1dConfig
+
+    def __init__(self, config: AutoEncoder1dConfig):
+        super().__init__()
+        self.config = config
+
+        self.autoencoder = AE1d(
+            in_channels=config.in_channels,
+            patch_size=config.patch_size,
+            channels=config.channels,
+            multipliers=config.multipliers,
+            factors=config.factors,
+            num_blocks=config.num_blocks,
+            bottleneck=bottleneck[config.bottleneck]()
+        )
+
+    @classmethod
+    def from_pretrained(cls, pretrained_path):
+        # same files as transformers' save_pretrained, in eval mode like transformers' from_pretrained
+        pretrained_path = Path(pretrained_path)
+        model = cls(cls.config_class.from_json_file(pretrained_path / 'config.json'))
+
+        if (pretrained_path / 'model.safetensors').exists():
+            from safetensors.torch import load_file
+            state_dict = load_file(pretrained_path / 'model.safetensors')
+        else:
+            state_dict = torch.load(pretrained_path / 'pytorch_model.bin', map_location='cpu')
+
+        model.load_state_dict(state_dict)
+        model.eval()
+        return model
+
+    def save_pretrained(self, pretrained_path):
+        pretrained_path = Path(pretrained_path)
+        pretrained_path.mkdir(parents=True, exist_ok=True)
+        with open(pretrained_path / 'config.json', 'w') as f:
+            json.dump(self.config.to_dict(), f, indent=2)
+        torch.save(self.state_dict(), pretrained_path / 'pytorch_model.bin')
+
+    def forward(self, *args, **kwargs):
+        return self.autoencoder(*args, **kwargs)
+
+    def encode(self, *args, **kwargs):
+        return self.autoencoder.encode(*args, **kwargs)
+
+    def decode(self, *args, **kwargs):
+        return self.autoencoder.decode(*args, **kwargs)
+
+
+class AE1d(nn.Module):
+    """
+    audio_encoders_pytorch's ae model
+    """
+
+    def __init__(
+            self,
+            in_channels: int,
+            channels: int,
+            multipliers: Sequence[int],
+            factors: Sequence[int],
+            num_blocks: Sequence[int],
+            patch_size: int = 1,
+            resnet_groups: int = 8,
+            out_channels: Optional[int] = None,
+            bottleneck: Union[Bottleneck, List[Bottleneck]] = [],
+            bottleneck_channels: Optional[int] = None,
+    ):
+        super().__init__()
+        out_channels = default(out_channels, in_channels)
+
+        self.encoder = Encoder1d(
+            in_channels=in_channels,
+            out_channels=bottleneck_channels,
+            channels=channels,
+            multipliers=multipliers,
+            factors=factors,
+            num_blocks=num_blocks,
+            patch_size=patch_size,
+            resnet_groups=resnet_groups,
+            bottleneck=bottleneck,
+        )
+
+        self.decoder = Decoder1d(
+            in_channels=bottleneck_channels,
+            out_channels=out_channels,
+            channels=channels,
+            multipliers=multipliers[::-1],
+            factors=factors[::-1],
+            num_blocks=num_blocks[::-1],
+            patch_size=patch_size,
+            resnet_groups=resnet_groups,
+        )
+
+    def forward(
+            self, x: Tensor, with_info: bool = False
+    ) -> Union[Tensor, Tuple[Tensor, Any]]:
+        z, info_encoder = self.encode(x, with_info=True)
+        y, info_decoder = self.decode(z, with_info=True)
+        info = {
+            **dict(latent=z),
+            **prefix_dict("encoder_", info_encoder),
+            **prefix_dict("decoder_", info_decoder),
+        }
+        return (y, info) if with_info else y
+
+    def encode(
+            self, x: Tensor, with_info: bool = False
+    ) -> Union[Tensor, Tuple[Tensor, Any]]:
+        return self.encoder(x, with_info=with_info)
+
+    def decode(self, x: Tensor, with_info: bool = False) -> Tensor:
+        return self.decoder(x, with_info=with_info)
@@ -0,0 +1,107 @@
+import torch
+import torch.nn as nn
+from src.model.nets.autoencoder1d import AutoEncoder1d
+
+
+class AutoEncoder_Speaker(nn.Module):
+    def __init__(self, cfg):
+        super(AutoEncoder_Speaker, self).__init__()
+
+        self.autoencoder = AutoEncoder1d.from_pretrained(cfg.model.ae_path)
+        ae_config = self.autoencoder.config
+
+        if cfg.model.freeze_encoder:
+            for p in self.autoencoder.autoencoder.encoder.parameters():
+                p.requires_grad = False
+
+        if cfg.model.freeze_decoder:
+            for p in self.autoencoder.autoencoder.decoder.parameters():
+                p.requires_grad = False
+
+        self.bottleneck_dropout = nn.Dropout(p=cfg.model.bottleneck_dropout)
+
+        # the autoencoder's encoder output size is [1, 32 channels, input//32]
+        # this lstm will learn from embedding sized input and will be fused into the bottleneck z
+        self.ae_channel_size = ae_config.channels
+        emb_size = cfg.model.emb_size
+        self.latent_slice_size = cfg.model.latent_slice_size
+        self.lstm_layers = cfg.model.lstm_layers
+
+        # 32 ae_channel_size
+        self.lstms = nn.ModuleList([nn.LSTM(input_size=emb_size + self.latent_slice_size,
+                                            hidden_size=self.latent_slice_size,
+                                            num_layers=self.lstm_layers,
+                                            bidirectional=True,
+                                            batch_first=True) for _ in
+                                    range(0, self.ae_channel_size)])
+
+        self.projections = nn.ModuleList([nn.Linear(in_features=self.latent_slice_size * 2,
+                                                    out_features=self.latent_slice_size)
+                                          for _ in range(0, self.ae_channel_size)])
+
+        # self.dev = torch.device(cfg.training.accelerator)
+        # self.init_hidden(cfg.training.batch_size)
+
+        self.activations = nn.Tanh()  # follows the same activation output from the encoder z
+
+    # def init_hidden(self, batch_size):
+    #     self.prev_h0 = [torch.zeros(self.lstm_layers * 2, batch_size, \
+    #                                 self.latent_slice_size, requires_grad=False, device=self.dev)
+    #                     for _ in range(0, self.ae_channel_size)]
+    #
+    #     self.prev_c0 = [torch.zeros(self.lstm_layers * 2, batch_size, \
+    #                                 self.latent_slice_size, requires_grad=False, device=self.dev)
+    #                     for _ in range(0, self.ae_channel_size)]
+
+    def fuse_embedding(self, z, dvec):
+        # z is [b, 32 channels, xsize/32 ], dvec is [b, 256]
+        # the channel is sliced by reshaping instead of splitting, so the number of slices follows the block size
+        # when exported to onnx
+        z_fuses = []
+
+        for i, lstm in enumerate(self.lstms):  # for each channel
+            z_channel = z[:, i, :]  # z_channel is [b, xsize/32]
+
+            # sequence of slices [b, num_z_partials, latent_slice_size]
+            z_partials = z_channel.reshape(z_channel.size(0), -1, self.latent_slice_size)
+
+            # create sequences for lstm, tensor [b, num_z_partials ,latent_slice_size+256]
+            dvecs = dvec.unsqueeze(1).expand(-1, z_partials.size(1), -1)
+            z_channel_emb_seq_in = torch.cat([z_partials, dvecs], dim=2)
+
+            # tensor [b, num_z_partials ,latent_slice_size*2] due to bidirectional
+            z_channel_emb_seq_out, (h, c) = lstm(z_channel_emb_seq_in)
+
+            # reproject to input dimensions, [b, num_z_partials , latent_slice_size]
+            projected = self.activations(self.projections[i](z_channel_emb_seq_out))
+
+            # tensor [b, xsize/32]
+            z_channel_emb_out = torch.flatten(projected, start_dim=1, end_dim=- 1)
+
+            z_fuses.append(z_channel_emb_out)
+
+        # z_fuses is list of [tensor [b, 1 , xsize/32]]
+        z_fused = torch.stack(z_fuses, dim=1)  # [b, 32 channels, xsize/32 ]
+        return z_fused
+
+    def forward(self, x, dvec):
+        with torch.no_grad():
+            # auto encoder encodes
+            # force sum to mono, then create stereo
+            x = torch.sum(x, dim=1, keepdim=True)
+            x = x.repeat(1, 2, 1)  # create stereo
+            z = self.autoencoder.encode(x)
+
+        z = self.bottleneck_dropout(z)  # [b, 32 channels, xsize/32 ]
+
+        z_fused = self.fuse_embedding(z, dvec) + z  # skip connection
+
+        # z_fused = z
+
+        # auto encoder encodes z fused with embedding
+        y_pred = self.autoencoder.decode(z_fused)
+
+        # sum to mono
+        y_pred = torch.sum(y_pred, dim=1, keepdim=True)
+
+        return y_pred
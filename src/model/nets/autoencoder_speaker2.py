@@ -0,0 +1,112 @@
+import torch
+import torch.nn as nn
+from src.model.nets.autoencoder1d import AutoEncoder1d
+
+
+# Style adaptive layer norm adapted from
+# https://github.com/KevinMIN95/StyleSpeech/blob/main/models/Modules.py
+
+
+class AffineLinear(nn.Module):
+    def __init__(self, in_dim, out_dim):
+        super(AffineLinear, self).__init__()
+        affine = nn.Linear(in_dim, out_dim)
+        self.affine = affine
+
+    def forward(self, input):
+        return self.affine(input)
+
+
+class StyleAdaptiveLayerNorm(nn.Module):
+    def __init__(self, in_channel, style_dim):
+        super(StyleAdaptiveLayerNorm, self).__init__()
+        self.in_channel = in_channel
+        self.norm = nn.LayerNorm(in_channel, elementwise_affine=False)
+
+        self.style = AffineLinear(style_dim, in_channel * 2)
+        self.style.affine.bias.data[:in_channel] = 1
+        self.style.affine.bias.data[in_channel:] = 0
+
+    def forward(self, input, style_code):
+        # style
+        style = self.style(style_code)
+        gamma, beta = style.chunk(2, dim=-1)
+        norm = self.norm(input)
+        out = gamma * norm + beta
+        return out
+
+class AutoEncoder_Speaker2(nn.Module):
+    def __init__(self, cfg):
+        super(AutoEncoder_Speaker2, self).__init__()
+
+        self.autoencoder = AutoEncoder1d.from_pretrained(cfg.model.ae_path)
+        ae_config = self.autoencoder.config
+
+        if cfg.model.freeze_encoder:
+            for p in self.autoencoder.autoencoder.encoder.parameters():
+                p.requires_grad = False
+
+        if cfg.model.freeze_decoder:
+            for p in self.autoencoder.autoencoder.decoder.parameters():
+                p.requires_grad = False
+
+        self.bottleneck_dropout = nn.Dropout(p=cfg.model.bottleneck_dropout)
+
+        # the autoencoder's encoder output size is [1, 32 channels, input//32]
+        # this lstm will learn from embedding sized input and will be fused into the bottleneck z
+        self.ae_channel_size = ae_config.channels
+        emb_size = cfg.model.emb_size
+        self.latent_slice_size = cfg.model.latent_slice_size
+
+        # 32 ae_channel_size
+        self.aslns = nn.ModuleList([StyleAdaptiveLayerNorm(in_channel=self.latent_slice_size,
+                                                          style_dim=emb_size)
+                                          for _ in range(0, self.ae_channel_size)])
+
+        self.activations = nn.Tanh()  # follows the same activation output from the encoder z
+
+    def fuse_embedding(self, z, dvec):
+        # z is [b, 32 channels, xsize/32 ], dvec is [b, 256]
+        # the channel is sliced by reshaping instead of splitting, so the number of slices follows the block size
+        # when exported to onnx
+        z_fuses = []
+        style_code = dvec.unsqueeze(1)  # [b, 1, 256], shared by all slices
+
+        for i, asln in enumerate(self.aslns):  # for each channel
+            z_channel = z[:, i, :]  # z_channel is [b, xsize/32]
+
+            # slices [b, num_z_partials, latent_slice_size]
+            z_partials = z_channel.reshape(z_channel.size(0), -1, self.latent_slice_size)
+
+            #  [b, num_z_partials ,latent_slice_size]
+            z_n_partials_nslices = self.activations(asln(z_partials, style_code))
+
+            # tensor[b, xsize / 32]
+            z_channel_emb_out = torch.flatten(z_n_partials_nslices, start_dim=1, end_dim=- 1)
+            z_fuses.append(z_channel_emb_out)
+
+        # z_fuses is list of [tensor [b, 1 , xsize/32]]
+        z_fused = torch.stack(z_fuses, dim=1)  # [b, 32 channels, xsize/32 ]
+        return z_fused
+
+    def forward(self, x, dvec):
+        with torch.no_grad():
+            # auto encoder encodes
+            # force sum to mono, then create stereo
+            x = torch.sum(x, dim=1, keepdim=True)
+            x = x.repeat(1, 2, 1)  # create stereo
+            z = self.autoencoder.encode(x)
+
+        z = self.bottleneck_dropout(z)  # [b, 32 channels, xsize/32 ]
+
+        z_fused = self.fuse_embedding(z, dvec) + z  # skip connection
+
+        # z_fused = z
+
+        # auto encoder encodes z fused with embedding
+        y_pred = self.autoencoder.decode(z_fused)
+
+        # sum to mono
+        y_pred = torch.sum(y_pred, dim=1, keepdim=True)
+
+        return y_pred
@@ -0,0 +1,135 @@
+# Adapted from https://github.com/GuitarML/PedalNetRT/blob/master/model.py
+
+import torch
+import torch.nn as nn
+
+
+class CausalConv1d(torch.nn.Conv1d):
+    def __init__(self, in_channels, out_channels, kernel_size, stride=1, dilation=1, groups=1,
+                 bias=True):
+        self.__padding = (kernel_size - 1) * dilation
+
+        super(CausalConv1d, self).__init__(
+            in_channels,
+            out_channels,
+            kernel_size=kernel_size,
+            stride=stride,
+            padding=self.__padding,
+            dilation=dilation,
+            groups=groups,
+            bias=bias,
+        )
+
+    def forward(self, input):
+        result = super(CausalConv1d, self).forward(input)
+        if self.__padding != 0:
+            return result[:, :, : -self.__padding]
+        return result
+
+
+def _conv_stack(dilations, in_channels, out_channels, kernel_size):
+    """
+    Create stack of dilated convolutional layers, outlined in WaveNet paper:
+    https://arxiv.org/pdf/1609.03499.pdf
+    """
+    return nn.ModuleList(
+        [
+            CausalConv1d(
+                in_channels=in_channels,
+                out_channels=out_channels,
+                dilation=d,
+                kernel_size=kernel_size,
+            )
+            for i, d in enumerate(dilations)
+        ]
+    )
+
+
+class WaveNet(nn.Module):
+    def __init__(self, num_channels, dilation_depth, num_repeat, kernel_size=2):
+        super(WaveNet, self).__init__()
+        dilations = [2 ** d for d in range(dilation_depth)] * num_repeat
+        internal_channels = int(num_channels * 2)
+        self.hidden = _conv_stack(dilations, num_channels, internal_channels, kernel_size)
+        self.residuals = _conv_stack(dilations, num_channels, num_channels, 1)
+        self.input_layer = CausalConv1d(
+            in_channels=1,
+            out_channels=num_channels,
+            kernel_size=1,
+        )
+
+        self.linear_mix = nn.Conv1d(
+            in_channels=num_channels * dilation_depth * num_repeat,
+            out_channels=1,
+            kernel_size=1,
+        )
+        self.num_channels = num_channels
+
+    def forward(self, x):
+        out = x
+        skips = []
+        out = self.input_layer(out)
+
+        for hidden, residual in zip(self.hidden, self.residuals):
+            x = out
+            out_hidden = hidden(x)
+
+            # gated activation
+            #   split (32,16,3) into two (16,16,3) for tanh and sigm calculations
+            out_hidden_split = torch.split(out_hidden, self.num_channels, dim=1)
+            out = torch.tanh(out_hidden_split[0]) * torch.sigmoid(out_hidden_split[1])
+
+            skips.append(out)
+
+            out = residual(out)
+            out = out + x[:, :, -out.size(2):]
+
+        # modified "postprocess" step:
+        out = torch.cat([s[:, :, -out.size(2):] for s in skips], dim=1)
+        out = self.linear_mix(out)
+        return out
+
+
+class StreamingWaveNet(nn.Module):
+    """
+    Block by block WaveNet sharing the weights of a trained WaveNet, for real time use with small buffers.
+    Each dilated layer keeps the last (kernel_size - 1) * dilation samples of its input as a cache,
+    forward takes (block, caches...) and returns (out_block, new_caches...), the caller carries the caches
+    between calls. Streaming a signal block by block gives the same output as WaveNet.forward on the whole signal.
+    """
+    def __init__(self, wavenet: WaveNet):
+        super(StreamingWaveNet, self).__init__()
+        self.wavenet = wavenet
+        self.cache_sizes = [(hidden.kernel_size[0] - 1) * hidden.dilation[0] for hidden in wavenet.hidden]
+
+    def initial_caches(self, batch_size=1, dtype=torch.float32, device=None):
+        # silence before the first block, same as the causal zero padding of the offline model
+        return [torch.zeros(batch_size, self.wavenet.num_channels, cache_size, dtype=dtype, device=device)
+                for cache_size in self.cache_sizes]
+
+    def forward(self, x, *caches):
+        wavenet = self.wavenet
+        skips = []
+        new_caches = []
+        out = wavenet.input_layer(x)
+
+        for hidden, residual, cache in zip(wavenet.hidden, wavenet.residuals, caches):
+            x = out
+            # the cache replaces the causal padding
+            x_history = torch.cat([cache, x], dim=2)
+            out_hidden = torch.nn.functional.conv1d(x_history, hidden.weight, hidden.bias,
+                                                    dilation=hidden.dilation)
+            new_caches.append(x_history[:, :, x_history.size(2) - cache.size(2):])
+
+            # gated activation
+            out_hidden_split = torch.split(out_hidden, wavenet.num_channels, dim=1)
+            out = torch.tanh(out_hidden_split[0]) * torch.sigmoid(out_hidden_split[1])
+
+            skips.append(out)
+
+            out = residual(out)
+            out = out + x
+
+        out = torch.cat(skips, dim=1)
+        out = wavenet.linear_mix(out)
+        return (out, *new_caches)
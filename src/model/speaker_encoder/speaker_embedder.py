@@ -1,8 +1,11 @@
 import torch
-import librosa
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 
+# librosa and torchaudio are imported where they are used,
+# so the embedder and the inference paths import with torch and numpy only
+
 
 class LinearNorm(nn.Module):
     def __init__(self, lstm_hidden, emb_dim):
@@ -62,7 +65,7 @@ class SpeechEmbedder(nn.Module):
 
     def batched_forward(self, mel):
         # (b, n_mels, T)
-        mels = mel.unfold(2, self.window, self.stride)  # [b, n_mels, T', window]
+        mels = frame(mel, self.window, self.stride)  # [b, n_mels, T', window]
         mels = mels.permute(0, 2, 3, 1)   # [b, T', window, n_mels]
 
         batch_size = mels.size(0)
@@ -81,35 +84,182 @@ class SpeechEmbedder(nn.Module):
         return x
 
 
+def frame(x, window, stride):
+    """
+    same as x.unfold(-1, window, stride), as an index gather so the number of frames stays dynamic in onnx
+    """
+    num_frames = (x.size(-1) - window) // stride + 1
+    starts = torch.arange(0, num_frames, device=x.device) * stride
+    indexes = starts.unsqueeze(1) + torch.arange(0, window, device=x.device).unsqueeze(0)  # [T', window]
+    frames = torch.index_select(x, -1, indexes.reshape(-1))
+    return frames.reshape(*x.shape[:-1], num_frames, window)
+
+
+class PolyphaseResampler(nn.Module):
+    """
+    torchaudio's polyphase sinc resampler, same kernel and same output as T.Resample,
+    with the output length computed from tensor sizes so it exports to onnx for any input length.
+    """
+    def __init__(self, orig_freq, new_freq, **kwargs):
+        super(PolyphaseResampler, self).__init__()
+        import torchaudio.transforms as T
+        resample = T.Resample(orig_freq=orig_freq, new_freq=new_freq, **kwargs)
+        self.orig_freq = orig_freq
+        self.new_freq = new_freq
+        self.gcd = resample.gcd
+        self.width = resample.width
+        self.register_buffer('kernel', resample.kernel)  # [new_freq, 1, taps], one filter per phase
+
+    def forward(self, waveform):
+        # [..., samples]
+        orig_freq = int(self.orig_freq) // self.gcd
+        new_freq = int(self.new_freq) // self.gcd
+
+        shape = waveform.shape
+        waveform = waveform.reshape(-1, 1, shape[-1])
+        length = waveform.size(-1)
+
+        waveform = F.pad(waveform, (self.width, self.width + orig_freq))
+        resampled = F.conv1d(waveform, self.kernel, stride=orig_freq)  # [b, phases, steps]
+        resampled = resampled.transpose(1, 2).reshape(waveform.size(0), -1)  # interleave the phases
+
+        target_length = (new_freq * length + orig_freq - 1) // orig_freq  # ceil
+        resampled = resampled[:, :target_length]
+        return resampled.reshape(*shape[:-1], -1)
+
+
 # adapted from Keith Ito's tacotron implementation
 # https://github.com/keithito/tacotron/blob/master/util/audio.py
 
 
+# process-wide caches, so filterbanks and windows are built once per (params, device, dtype)
+# instead of once per AudioHelper / dataloader worker
+_mel_basis_cache = {}
+_hann_window_cache = {}
+_dft_basis_cache = {}
+
+
+def get_mel_basis(sr, n_fft, n_mels, device=None, dtype=torch.float32):
+    """
+    librosa's slaney mel filterbank as a torch tensor, cached per (sr, n_fft, n_mels, device, dtype)
+    """
+    device = torch.device('cpu') if device is None else torch.device(device)
+    key = (sr, n_fft, n_mels, device, dtype)
+    mel_basis = _mel_basis_cache.get(key)
+    if mel_basis is None:
+        # may be first called in lightning's validation loop,
+        # cached tensors must not be inference tensors or training's backward will fail
+        with torch.inference_mode(False):
+            cpu_key = (sr, n_fft, n_mels, torch.device('cpu'), torch.float32)
+            mel_basis = _mel_basis_cache.get(cpu_key)
+            if mel_basis is None:
+                # somehow, torch's melscale is not close enough
+                import librosa
+                mel_basis = torch.from_numpy(librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels))
+                _mel_basis_cache[cpu_key] = mel_basis
+            mel_basis = mel_basis.to(device=device, dtype=dtype)
+        _mel_basis_cache[key] = mel_basis
+    return mel_basis
+
+
+def get_hann_window(win_length, device=None, dtype=torch.float32):
+    """
+    hann window, cached per (win_length, device, dtype)
+    """
+    device = torch.device('cpu') if device is None else torch.device(device)
+    key = (win_length, device, dtype)
+    window = _hann_window_cache.get(key)
+    if window is None:
+        with torch.inference_mode(False):
+            window = torch.hann_window(window_length=win_length, device=device, dtype=dtype)
+        _hann_window_cache[key] = window
+    return window
+
+
+def get_dft_basis(n_fft, win_length, device=None, dtype=torch.float32):
+    """
+    hann windowed real and imaginary dft kernels for a conv1d based stft, [2 * (n_fft//2 + 1), 1, n_fft].
+    the window is centered within n_fft the same way torch.stft pads it.
+    cached per (n_fft, win_length, device, dtype)
+    """
+    device = torch.device('cpu') if device is None else torch.device(device)
+    key = (n_fft, win_length, device, dtype)
+    basis = _dft_basis_cache.get(key)
+    if basis is None:
+        with torch.inference_mode(False):
+            num_freq = n_fft // 2 + 1
+            window = torch.hann_window(window_length=win_length, dtype=torch.float64)
+            pad_left = (n_fft - win_length) // 2
+            window = F.pad(window, (pad_left, n_fft - win_length - pad_left))
+
+            n = torch.arange(n_fft, dtype=torch.float64)
+            k = torch.arange(num_freq, dtype=torch.float64)
+            angles = 2.0 * np.pi * k.unsqueeze(1) * n.unsqueeze(0) / n_fft  # [num_freq, n_fft]
+            basis = torch.cat([torch.cos(angles) * window,
+                               -torch.sin(angles) * window], dim=0)  # [2 * num_freq, n_fft]
+            basis = basis.unsqueeze(1).to(device=device, dtype=dtype)
+        _dft_basis_cache[key] = basis
+    return basis
+
+
+class SpeakerEmbeddingExtractor(nn.Module):
+    """
+    resample -> stft -> mel -> log -> windowed lstm as one differentiable module.
+    runs entirely on the device of its input, with the resampling kernel as a buffer and
+    the filterbanks from the shared caches.
+    the spectral front end is always computed in fp32, the embedder follows any enclosing autocast.
+    with use_dft_stft, the stft is always a conv1d against dft kernels, so the module exports to onnx as one graph.
+    """
+    def __init__(self, embedder: SpeechEmbedder, orig_sr=44100, use_dft_stft=False):
+        super(SpeakerEmbeddingExtractor, self).__init__()
+        self.embedder = embedder
+        self.audio_helper = AudioHelper()
+        self.use_dft_stft = use_dft_stft
+
+        # try to be as close as librosa's resampling
+        self.resampler = PolyphaseResampler(orig_freq=orig_sr,
+                                            new_freq=embedder.get_target_sample_rate(),
+                                            lowpass_filter_width=64,
+                                            rolloff=0.9475937167399596,
+                                            resampling_method="sinc_interp_kaiser",
+                                            beta=14.769656459379492,
+                                            )
+
+    def get_mel(self, waveform):
+        # [b, samples] at the embedder's sample rate
+        if self.use_dft_stft or waveform.device.type == 'mps':
+            # mps is not able to process complex types in stft
+            mel, _, _ = self.audio_helper.get_mel_dft(waveform)
+        else:
+            mel, _, _ = self.audio_helper.get_mel_torch(waveform)
+        return mel
+
+    def forward(self, waveform):
+        # [b, 1, samples] or [b, samples]
+        if waveform.dim() == 3:
+            waveform = waveform.squeeze(dim=1)
+
+        autocast_device = 'cuda' if waveform.is_cuda else 'cpu'
+        with torch.autocast(device_type=autocast_device, enabled=False):
+            waveform = self.resampler(waveform.float())  # resample to 16kHz
+            mel = self.get_mel(waveform)  # [b, n_mels, T]
+
+        return self.embedder.batched_forward(mel)  # [b, emb_dim]
+
+
 class AudioHelper:
     def __init__(self):
+        # filterbanks and windows are looked up from the shared caches on use,
+        # and follow the device / dtype of the input tensor
         self.init_hp()
-        self.mel_basis = librosa.filters.mel(sr=self.sample_rate,
-                                             n_fft=self.n_fft,
-                                             n_mels=self.num_mels)
-
-        # somehow, torch's melscale is not close enough
-        self.mel_basis_np = torch.from_numpy(self.mel_basis)
-
-        # self.mel_basis_torch = F.melscale_fbanks(
-        #     int(self.n_fft // 2 + 1),
-        #     n_mels=self.num_mels,
-        #     f_min=0.0,
-        #     f_max=self.sample_rate / 2.0,
-        #     sample_rate=self.sample_rate,
-        #     norm="slaney",
-        # )
 
-        dev = torch.device('cpu')
-        if torch.cuda.is_available():
-            dev = torch.device("cuda")
-            self.mel_basis_np = self.mel_basis_np.to(dev)
+    @property
+    def mel_basis(self):
+        return get_mel_basis(self.sample_rate, self.n_fft, self.num_mels).numpy()
 
-        self.hann_window = torch.hann_window(window_length=self.win_length, device=dev)
+    @property
+    def mel_basis_np(self):
+        return get_mel_basis(self.sample_rate, self.n_fft, self.num_mels)
 
     def init_hp(self):
         self.num_mels = 40
@@ -131,6 +281,7 @@ class AudioHelper:
         self.power = 0.30
 
     def get_mel(self, y):
+        import librosa
         y = librosa.core.stft(y=y, n_fft=self.n_fft,
                               hop_length=self.hop_length,
                               win_length=self.win_length,
@@ -141,10 +292,28 @@ class AudioHelper:
         return mel, magnitudes, dot_prod
 
     def get_mel_torch(self, y):
+        mel_basis = get_mel_basis(self.sample_rate, self.n_fft, self.num_mels,
+                                  device=y.device, dtype=y.dtype)
         y = self.stft_torch(y)
         y = torch.abs(y)
         magnitudes = torch.pow(y, 2)  # [601,101]
-        dot_prod = torch.matmul(self.mel_basis_np, magnitudes)  # [40, 601]. [601,101] = [40, 101]
+        dot_prod = torch.matmul(mel_basis, magnitudes)  # [40, 601]. [601,101] = [40, 101]
+        mel = torch.log10(dot_prod + 1e-6)  # [40, 101]
+        return mel, magnitudes, dot_prod
+
+    def get_mel_dft(self, y):
+        # same as get_mel_torch, with the stft done as a conv1d against dft kernels.
+        # avoids complex tensors, for mps and onnx export
+        mel_basis = get_mel_basis(self.sample_rate, self.n_fft, self.num_mels,
+                                  device=y.device, dtype=y.dtype)
+        dft_basis = get_dft_basis(self.n_fft, self.win_length, device=y.device, dtype=y.dtype)
+
+        y = y.unsqueeze(-2)  # [b, 1, samples]
+        y = F.pad(y, (self.n_fft // 2, self.n_fft // 2), mode='constant')  # center=True
+        y = F.conv1d(y, dft_basis, stride=self.hop_length)  # [b, 2 * 601, 101]
+        real, imag = torch.chunk(y, 2, dim=-2)
+        magnitudes = real ** 2 + imag ** 2  # [601,101]
+        dot_prod = torch.matmul(mel_basis, magnitudes)  # [40, 601]. [601,101] = [40, 101]
         mel = torch.log10(dot_prod + 1e-6)  # [40, 101]
         return mel, magnitudes, dot_prod
 
@@ -164,6 +333,7 @@ class AudioHelper:
         return self.istft(S, phase)
 
     def stft(self, y):
+        import librosa
         return librosa.stft(y=y, n_fft=self.n_fft,
                             hop_length=self.hop_length,
                             win_length=self.win_length)
@@ -175,12 +345,13 @@ class AudioHelper:
                           win_length=self.win_length,
                           center=True,
                           pad_mode='constant',
-                          window=self.hann_window,
+                          window=get_hann_window(self.win_length, device=y.device, dtype=y.dtype),
                           return_complex=True)
 
         return stft
 
     def istft(self, mag, phase):
+        import librosa
         stft_matrix = mag * np.exp(1j * phase)
         return librosa.istft(stft_matrix,
                              hop_length=self.hop_length,
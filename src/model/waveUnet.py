@@ -1,107 +1,9 @@
 # adapted from https://github.com/f90/Wave-U-Net-Pytorch/tree/master/model
 import torch
 import pytorch_lightning as pl
-import torch.nn as nn
-import numpy as np
-from torch.nn import functional as F
 from omegaconf import DictConfig
 from src.utils.losses import Losses, PreEmphasisFilter
-
-class DownSamplingLayer(nn.Module):
-    def __init__(self, channel_in, channel_out, dilation=1, kernel_size=15, stride=1, padding=7):
-        super(DownSamplingLayer, self).__init__()
-        self.main = nn.Sequential(
-            nn.Conv1d(channel_in, channel_out, kernel_size=kernel_size,
-                      stride=stride, padding=padding, dilation=dilation),
-            nn.BatchNorm1d(channel_out),
-            nn.LeakyReLU(negative_slope=0.1)
-        )
-
-    def forward(self, ipt):
-        return self.main(ipt)
-
-class UpSamplingLayer(nn.Module):
-    def __init__(self, channel_in, channel_out, kernel_size=5, stride=1, padding=2):
-        super(UpSamplingLayer, self).__init__()
-        self.main = nn.Sequential(
-            nn.Conv1d(channel_in, channel_out, kernel_size=kernel_size,
-                      stride=stride, padding=padding),
-            nn.BatchNorm1d(channel_out),
-            nn.LeakyReLU(negative_slope=0.1, inplace=True),
-        )
-
-    def forward(self, ipt):
-        return self.main(ipt)
-
-class WaveUNet(nn.Module):
-    def __init__(self, n_layers=12, channels_interval=24):
-        super(WaveUNet, self).__init__()
-
-        self.n_layers = n_layers
-        self.channels_interval = channels_interval
-        encoder_in_channels_list = [1] + [i * self.channels_interval for i in range(1, self.n_layers)]
-        encoder_out_channels_list = [i * self.channels_interval for i in range(1, self.n_layers + 1)]
-
-        #          1    => 2    => 3    => 4    => 5    => 6   => 7   => 8   => 9  => 10 => 11 =>12
-        # 16384 => 8192 => 4096 => 2048 => 1024 => 512 => 256 => 128 => 64 => 32 => 16 =>  8 => 4
-        self.encoder = nn.ModuleList()
-        for i in range(self.n_layers):
-            self.encoder.append(
-                DownSamplingLayer(
-                    channel_in=encoder_in_channels_list[i],
-                    channel_out=encoder_out_channels_list[i]
-                )
-            )
-
-        self.middle = nn.Sequential(
-            nn.Conv1d(self.n_layers * self.channels_interval, self.n_layers * self.channels_interval, 15, stride=1,
-                      padding=7),
-            nn.BatchNorm1d(self.n_layers * self.channels_interval),
-            nn.LeakyReLU(negative_slope=0.1, inplace=True)
-        )
-
-        decoder_in_channels_list = [(2 * i + 1) * self.channels_interval for i in range(1, self.n_layers)] + [
-            2 * self.n_layers * self.channels_interval]
-        decoder_in_channels_list = decoder_in_channels_list[::-1]
-        decoder_out_channels_list = encoder_out_channels_list[::-1]
-        self.decoder = nn.ModuleList()
-        for i in range(self.n_layers):
-            self.decoder.append(
-                UpSamplingLayer(
-                    channel_in=decoder_in_channels_list[i],
-                    channel_out=decoder_out_channels_list[i]
-                )
-            )
-
-        self.out = nn.Sequential(
-            nn.Conv1d(1 + self.channels_interval, 1, kernel_size=1, stride=1),
-            nn.Tanh()
-        )
-
-    def forward(self, input):
-        tmp = []
-        o = input
-
-        # Up Sampling
-        for i in range(self.n_layers):
-            o = self.encoder[i](o)
-            tmp.append(o)
-            # [batch_size, T // 2, channels]
-            o = o[:, :, ::2]
-
-        o = self.middle(o)
-
-        # Down Sampling
-        for i in range(self.n_layers):
-            # [batch_size, T * 2, channels]
-            o = F.interpolate(o, scale_factor=2, mode="linear", align_corners=True)
-            # Skip Connection
-            o = torch.cat([o, tmp[self.n_layers - i - 1]], dim=1)
-            o = self.decoder[i](o)
-
-        o = torch.cat([o, input], dim=1)
-        o = self.out(o)
-        return o
+from src.model.nets.waveunet import DownSamplingLayer, UpSamplingLayer, WaveUNet
 
 class WaveUNet_PL(pl.LightningModule):
     def __init__(self, cfg: DictConfig):
@@ -139,14 +41,14 @@ class WaveUNet_PL(pl.LightningModule):
     def forward(self, x):
         return self.waveunet(x)
 
-    def _lossfn(self, y, y_pred):
+    def _lossfn(self, y, y_pred, lengths=None):
         if self.loss_preemphasis_hp_filter:
             y, y_pred = self.fir_filter(y, y_pred)
 
         if self.loss_preemphasis_aw_filter:
             y, y_pred = self.aw_filter(y, y_pred)
 
-        return self.loss.forward(y, y_pred)
+        return self.loss.forward(y, y_pred, lengths=lengths)
 
     def training_step(self, batch, batch_idx):
         y, y_pred = self._shared_eval_step(batch)
@@ -156,7 +58,7 @@ class WaveUNet_PL(pl.LightningModule):
         return {"loss": loss, "log": logs}
 
     def _shared_eval_step(self, batch):
-        x, y, dvec, name = batch
+        x, y, dvec, name = batch[:4]
         y_pred = self.forward(x)
         return y, y_pred
 
@@ -175,7 +77,8 @@ class WaveUNet_PL(pl.LightningModule):
 
     def test_step(self, batch, batch_idx):
         y, y_pred = self._shared_eval_step(batch)
-        loss = self._lossfn(y, y_pred)
+        lengths = batch[4] if len(batch) > 4 else None  # length bucketed batches, see pad_collate
+        loss = self._lossfn(y, y_pred, lengths)
         self.test_step_outputs.append(loss)
         return {"test_loss": loss}
 
@@ -0,0 +1,59 @@
+## python src/prepare_data.py process_data/dataset=nus dataset=nus model=autoencoder_speaker
+## python src/prepare_data.py process_data/dataset=nus dataset=nus model=autoencoder_speaker --plan
+
+import hydra
+import os
+import sys
+from pathlib import Path
+from omegaconf import DictConfig
+from src.download_data import download_nus48e, download_vocalset, download_vctk
+from src.process_data import process_dataset
+from src.cache_dataset import cache_dataset
+
+# interim folder to the stage filling it
+DOWNLOADS = {'nus-48e': download_nus48e,
+             'vocalset': download_vocalset,
+             'vctk': download_vctk}
+
+
+@hydra.main(version_base=None, config_path="../conf", config_name="config")
+def main(cfg: DictConfig):
+    """
+    Runs the data preparation stages in order, download -> interim -> processed -> cached speech embeddings.
+    Every stage only rebuilds what its inputs invalidated, see process_dataset and cache_dataset.
+    With --plan nothing is built, each stage prints what it would rebuild.
+    """
+    root_path = Path(os.path.abspath(hydra.utils.get_original_cwd()))
+    plan = cfg.process_data.plan
+
+    # downloads and interim folders are per source, only missing ones are fetched
+    missing = []
+    for audio_dir in cfg.process_data.dataset.audio_dirs:
+        interim_path = root_path / audio_dir
+        if interim_path.exists():
+            print(f"interim {interim_path.name}: up to date")
+        elif plan:
+            print(f"interim {interim_path.name}: to download and extract")
+            missing.append(interim_path.name)
+        else:
+            DOWNLOADS[interim_path.name]()
+
+    if len(missing) > 0:
+        print("process and cache: planned after the downloads")
+        return
+
+    num_processed = process_dataset(cfg, root_path, plan=plan)
+
+    # the speech embeddings are only used by the speaker models
+    if cfg.model.model_name == 'AutoEncoder_Speaker_PL' or \
+            cfg.model.model_name == 'AutoEncoder_Speaker_PL2':
+        if plan and num_processed > 0:
+            print("cache: clips changed by processing are embedded as well")
+        cache_dataset(cfg, root_path, plan=plan)
+
+
+if __name__ == "__main__":
+    if '--plan' in sys.argv:
+        sys.argv.remove('--plan')
+        sys.argv.append('process_data.plan=true')
+    main()
@@ -1,7 +1,9 @@
 ## python src/process_data.py process_data/dataset=nus
 ## python src/process_data.py process_data/dataset=vocalset
 ## python src/process_data.py process_data/dataset=nus_vocalset
+## python src/process_data.py process_data/dataset=nus process_data.plan=true  # only show what would rebuild
 
+import hashlib
 import hydra
 import librosa
 import os
@@ -13,35 +15,46 @@ from pydub.silence import split_on_silence
 from pydub.utils import make_chunks
 from tqdm import tqdm
 from omegaconf import DictConfig
+from src.utils.manifest import Manifest, config_hash, combine_hash
+from src.utils.audio_storage import export_segment, storage_ext
+from src.datamodule.energy_index import build_energy_index
 
 
 @hydra.main(version_base=None, config_path="../conf", config_name="config")
 def main(cfg: DictConfig):
     root_path = Path(os.path.abspath(hydra.utils.get_original_cwd()))
+    process_dataset(cfg, root_path, plan=cfg.process_data.plan)
 
-    # read off cfg params
+
+def split_targets(cfg, root_path):
+    """
+    speaker folders of every split, predict uses the test speakers
+    """
     seed = cfg.process_data.seed
-    ext = cfg.process_data.ext
     train_ratio = cfg.process_data.train_ratio
     val_ratio = cfg.process_data.val_ratio
-    sr = cfg.process_data.sr
-    clip_interval_ms = cfg.process_data.clip_interval_ms
-    audio_dirs = cfg.process_data.dataset.audio_dirs
-    dataset_label = cfg.process_data.dataset.dataset_label
-
-    min_silence_len_ms = cfg.process_data.min_silence_len_ms
-    silence_thresh_dbfs = cfg.process_data.silence_thresh_dbfs
-    keep_silence_ms = cfg.process_data.keep_silence_ms
-
-    print("Preparing dataset:", dataset_label)
 
     #train test split by target
     targets = []
-    for a_path in audio_dirs:
+    for a_path in cfg.process_data.dataset.audio_dirs:
         dataset_path = Path(root_path / a_path)
-        dataset_targets = [x for x in dataset_path.iterdir() if x.is_dir()]
+        dataset_targets = sorted(x for x in dataset_path.iterdir() if x.is_dir())
         targets = targets + dataset_targets
 
+    # WARNING: this assumes unique target names across different datasets!
+    target_names = [target.name for target in targets]
+    assert len(set(target_names)) == len(target_names), 'target names are not unique!'
+
+    if cfg.process_data.split == 'hash':
+        splits = {'train': [], 'val': [], 'test': []}
+        for target in targets:
+            splits[hash_split(target.name, seed, train_ratio, val_ratio)].append(target)
+        for split, speakers in splits.items():
+            if len(speakers) == 0:
+                print(f"WARNING: no speakers in {split}, too few speakers for a hash split, try another seed")
+        return {**splits, 'predict': splits['test']}
+
+    assert cfg.process_data.split == 'seed', f"unknown split {cfg.process_data.split}"
     # input is the same as output
     X_train, X_valtest, y_train, y_valtest = train_test_split(targets, targets,
                                                               test_size=(1.0 - train_ratio),
@@ -49,111 +62,173 @@ def main(cfg: DictConfig):
     X_test, X_val, y_test, y_val = train_test_split(X_valtest, y_valtest,
                                                     test_size=(1.0 - val_ratio),
                                                     random_state=seed)
+    return {'train': X_train, 'val': X_val, 'test': X_test, 'predict': X_test}
+
+
+def hash_split(target_name, seed, train_ratio, val_ratio):
+    """
+    Split of a speaker from the hash of its name alone, adding or removing speakers never moves the others.
+    Same ratios as the seed split, val_ratio of what is left after train goes to test.
+    """
+    digest = hashlib.sha1(f"{seed}/{target_name}".encode()).digest()
+    position = int.from_bytes(digest[:8], 'big') / 2 ** 64
+    if position < train_ratio:
+        return 'train'
+    if position < train_ratio + (1.0 - train_ratio) * val_ratio:
+        return 'test'
+    return 'val'
+
+
+def process_dataset(cfg, root_path, plan=False):
+    """
+    Incremental processing of the interim audio into data/processed/<dataset_label>/<split>/<speaker>.
+    Every source file's clips are recorded in process_manifest.json with the hash of the file and of the
+    processing config. Only new or changed files, or files whose config changed, are processed again.
+    Files that moved to another split are moved, clips of files no longer in the dataset are deleted.
+    :param plan: only print what would be rebuilt
+    :return: number of source files to (re)process
+    """
+    ext = cfg.process_data.ext
+    dataset_label = cfg.process_data.dataset.dataset_label
+    print("Preparing dataset:", dataset_label)
 
     target_path = root_path / ("data/processed/" + dataset_label)
+    manifest_path = target_path / 'process_manifest.json'
 
-    # clear folder if exists, then make new folder
-    if target_path.exists():
-        print('Clearing', target_path)
-        shutil.rmtree(target_path)
-    Path.mkdir(target_path)
-
-    target_path_train = target_path / 'train'
-    target_path_val = target_path / 'val'
-    target_path_test = target_path / 'test'
-    target_path_predict = target_path / 'predict'
-
-    process_audio(target_path_train, X_train, y_train,
-                  sr=sr, audio_length_ms=clip_interval_ms, ext=ext,
-                  min_silence_len_ms=min_silence_len_ms,
-                  silence_thresh_dbfs=silence_thresh_dbfs,
-                  keep_silence_ms=keep_silence_ms)
-    process_audio(target_path_val, X_val, y_val,
-                  sr=sr, audio_length_ms=clip_interval_ms, ext=ext,
-                  min_silence_len_ms=min_silence_len_ms,
-                  silence_thresh_dbfs=silence_thresh_dbfs,
-                  keep_silence_ms=keep_silence_ms)
-    process_audio(target_path_test, X_test, y_test,
-                  sr=sr, audio_length_ms=clip_interval_ms, ext=ext,
-                  min_silence_len_ms=min_silence_len_ms,
-                  silence_thresh_dbfs=silence_thresh_dbfs,
-                  keep_silence_ms=keep_silence_ms)
-    process_audio(target_path_predict, X_test, y_test,
-                  sr=sr, audio_length_ms=None, ext=ext)
-
-
-# audio_paths_Y currently used, only folder name used as labels
-def process_audio(target_path, audio_paths_X, audio_paths_Y,
-                  sr=44100, audio_length_ms=None, ext='wav',
-                  min_silence_len_ms=20,
-                  silence_thresh_dbfs=-16,
-                  keep_silence_ms=20):
-    # delete folder if it's already there
-    if target_path.exists():
+    # folders written before the manifest existed are unknown, rebuild them once
+    if not plan and target_path.exists() and not manifest_path.exists():
         print('Clearing', target_path)
         shutil.rmtree(target_path)
-    print('Creating', target_path)
-    Path.mkdir(target_path)
-
-    for target_path in tqdm(audio_paths_X, desc='Processing Target', position=0):
-        # create folders for each target
-        # WARNING: this assumes unique target names across different datasets!
-        if (target_path/target_path.name).exists():
-            assert False , 'target names are not unique!'
-        Path.mkdir(target_path/target_path.name)
-
-        # find audio under target paths
-        target_files = librosa.util.find_files(target_path, ext=ext)
-        for file_x in tqdm(target_files, desc='Processing Audio', position=1, leave=False):
-            # ignore audio_paths_Y
-            x = AudioSegment.from_file(file_x, ext, frame_rate=sr)
-
-            target_path_x = (target_path / target_path.name)
-
-            # force to mono
-            x = x.set_channels(1)
-            # peak normalization each clip
-            x = effects.normalize(x)
-            # fix at 16 bit... 1 is 8bit, 2 is 16 bit, 4 is 32bit. there is no 3 24bit due to api limits
-            x = x.set_sample_width(4)
-            if audio_length_ms is not None:
-                x_silence = split_on_silence(x,
-                                             # split on silences longer than xx ms
-                                             min_silence_len=min_silence_len_ms,
-                                             # anything under xx dBFS is considered silence
-                                             silence_thresh=silence_thresh_dbfs,
-                                             # keep xx ms of leading/trailing silence
-                                             keep_silence=keep_silence_ms)
-
-                if len(x_silence) == 0:
-                    # do not save as it is empty.
-                    continue
-
-                # recombine
-                x = AudioSegment.empty()
-                for i in x_silence:
-                    x += i
-
-                # split the audio clips into 1 sec lengths, pad zero if smaller.
-                x_chunks = make_chunks(x, audio_length_ms)  # Make chunks of one sec
-
-                # Export all individual chunks as wav files
-                export_chunk(x_chunks, file_x, target_path_x)
-            else:
-                # save to destination
-                x.export(target_path_x / Path(file_x).name, format='wav')
-
-
-def export_chunk(chunks, src_file, path_targ):
+    manifest = Manifest(manifest_path)
+
+    clip_params = {'sr': cfg.process_data.sr,
+                   'audio_length_ms': cfg.process_data.clip_interval_ms,
+                   'min_silence_len_ms': cfg.process_data.min_silence_len_ms,
+                   'silence_thresh_dbfs': cfg.process_data.silence_thresh_dbfs,
+                   'keep_silence_ms': cfg.process_data.keep_silence_ms,
+                   'storage_encoding': cfg.process_data.storage_encoding}
+    # no chunking and silence removal for predict
+    predict_params = {'sr': cfg.process_data.sr, 'audio_length_ms': None,
+                      'storage_encoding': cfg.process_data.storage_encoding}
+
+    jobs = {}
+    for split, targets in split_targets(cfg, root_path).items():
+        params = predict_params if split == 'predict' else clip_params
+        params_hash = config_hash(params)
+        for target in targets:
+            for file_x in librosa.util.find_files(target, ext=ext):
+                name = f"{split}/{target.name}/{Path(file_x).name}"
+                key = combine_hash(manifest.file_hash(file_x), params_hash)
+                jobs[name] = {'key': key, 'source': file_x, 'target_dir': target_path / split / target.name,
+                              'params': params}
+
+    todo = [name for name, job in jobs.items() if not manifest.is_built(name, job['key'])]
+    stale = [name for name in manifest.entries if name not in jobs]
+
+    # same file and config, only in another split now
+    stale_by_key = {manifest.entries[name]['key']: name for name in stale}
+    moves = {}
+    for name in todo:
+        if jobs[name]['key'] in stale_by_key:
+            moves[name] = stale_by_key.pop(jobs[name]['key'])
+
+    print(f"process {dataset_label}: {len(todo) - len(moves)} files to process, {len(moves)} to move, "
+          f"{len(set(stale) - set(moves.values()))} stale to delete, {len(jobs) - len(todo)} up to date")
+    if plan:
+        return len(todo) - len(moves)
+
+    try:
+        for name, old_name in moves.items():
+            old_entry = manifest.entries.pop(old_name)
+            jobs[name]['target_dir'].mkdir(parents=True, exist_ok=True)
+            outputs = [Path(output).replace(jobs[name]['target_dir'] / Path(output).name)
+                       for output in old_entry['outputs']]
+            manifest.record(name, old_entry['key'], outputs, source=old_entry['source'])
+
+        for name in stale:
+            if name in manifest.entries:
+                manifest.remove(name)
+
+        for name in tqdm([name for name in todo if name not in moves], desc='Processing Audio'):
+            job = jobs[name]
+            if name in manifest.entries:
+                manifest.remove(name)
+            outputs = process_file(job['source'], job['target_dir'], ext=ext, **job['params'])
+            manifest.record(name, job['key'], outputs, source=job['source'])
+    finally:
+        manifest.save()
+
+    # frame energies for dataset.energy_crop, only changed clips are read
+    for split in ['train', 'val', 'test']:
+        if (target_path / split).exists():
+            build_energy_index(target_path / split, ext=storage_ext(cfg.process_data.storage_encoding),
+                               hop_length=cfg.process_data.energy_hop_length)
+
+    return len(todo) - len(moves)
+
+
+def process_file(file_x, target_dir, sr=44100, audio_length_ms=None, ext='wav',
+                 min_silence_len_ms=20,
+                 silence_thresh_dbfs=-16,
+                 keep_silence_ms=20,
+                 storage_encoding='pcm16'):
+    """
+    Processes one audio file into target_dir, returns the written files
+    :param storage_encoding: file encoding of the written clips, see src/utils/audio_storage.py
+    """
+    Path.mkdir(target_dir, parents=True, exist_ok=True)
+
+    x = AudioSegment.from_file(file_x, ext, frame_rate=sr)
+
+    # force to mono
+    x = x.set_channels(1)
+    # peak normalization each clip
+    x = effects.normalize(x)
+    # process at 32 bit... 1 is 8bit, 2 is 16 bit, 4 is 32bit. there is no 3 24bit due to api limits
+    # the written bit depth is set by storage_encoding
+    x = x.set_sample_width(4)
+    if audio_length_ms is not None:
+        x_silence = split_on_silence(x,
+                                     # split on silences longer than xx ms
+                                     min_silence_len=min_silence_len_ms,
+                                     # anything under xx dBFS is considered silence
+                                     silence_thresh=silence_thresh_dbfs,
+                                     # keep xx ms of leading/trailing silence
+                                     keep_silence=keep_silence_ms)
+
+        if len(x_silence) == 0:
+            # do not save as it is empty.
+            return []
+
+        # recombine
+        x = AudioSegment.empty()
+        for i in x_silence:
+            x += i
+
+        # split the audio clips into 1 sec lengths, pad zero if smaller.
+        x_chunks = make_chunks(x, audio_length_ms)  # Make chunks of one sec
+
+        # Export all individual chunks as wav files
+        return export_chunk(x_chunks, file_x, target_dir, storage_encoding)
+    else:
+        # save to destination
+        return [export_segment(x, target_dir / Path(file_x).name, storage_encoding)]
+
+
+def export_chunk(chunks, src_file, path_targ, storage_encoding='pcm16'):
     """
     Helper function to save a file into chunks of file, while renaming it.
     :param chunks: audio chunks
     :param src_file: file path of the full audio
     :param path_targ: saving directory of the chunks of audio
+    :param storage_encoding: file encoding of the chunks
+    :return: the chunk files
     """
+    chunk_files = []
     for i, chunk in enumerate(chunks):
         chunk_name = (Path(src_file).stem + "_{0}.wav").format(i)
-        chunk.export(path_targ / chunk_name, format="wav")
+        chunk_files.append(export_segment(chunk, path_targ / chunk_name, storage_encoding))
+    return chunk_files
 
 
 def merge(list1, list2):
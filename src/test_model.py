@@ -1,5 +1,6 @@
 import hydra
 import os
+import math
 import torch
 import mlflow
 import simpleaudio as sa
@@ -28,11 +29,16 @@ def main(cfg: DictConfig):
     dm_test = AudioDataModule(data_dir=(cur_path / data_path),
                               cfg=cfg,
                               batch_size=batch_size,
-                              do_aug_in_test=cfg.testing.do_aug_in_test)
+                              do_aug_in_test=cfg.testing.do_aug_in_test,
+                              bucket_by_length=cfg.testing.bucket_by_length,
+                              pad_multiple=cfg.testing.pad_multiple)
+    # predict files differ in length, one at a time unless they are bucketed by length
     dm_pred = AudioDataModule(data_dir=(cur_path / data_path),
                               cfg=cfg,
                               do_aug_in_predict=cfg.testing.do_aug_in_predict,
-                              batch_size=1)
+                              batch_size=batch_size if cfg.testing.bucket_by_length else 1,
+                              bucket_by_length=cfg.testing.bucket_by_length,
+                              pad_multiple=cfg.testing.pad_multiple)
 
     mlflow.pytorch.autolog()
 
@@ -80,7 +86,8 @@ def main(cfg: DictConfig):
 
     with torch.no_grad():
         for batch in tqdm(dm_pred, desc=" predict progress", position=0):
-            x, y, (dvec, dvec_unrelated), (name, name_unrelated) = batch
+            x, y, (dvec, dvec_unrelated), (name, name_unrelated) = batch[:4]
+            lengths = batch[4] if len(batch) > 4 else torch.full((x.size(0),), x.size(2))
 
             if x.device != dev:
                 x = x.to(dev)
@@ -93,10 +100,11 @@ def main(cfg: DictConfig):
                 if isinstance(dvec_unrelated, torch.Tensor) and dvec_unrelated.device != dev:
                     dvec_unrelated = dvec_unrelated.to(dev)
 
-            segments = x.size()[2] // cfg.dataset.block_size
-            resized_samples = segments * cfg.dataset.block_size
-            x = x[:, :, 0:resized_samples]
-            y = y[:, :, 0:resized_samples]
+            # zero padded to whole blocks, the padding is not played back
+            segments = math.ceil(x.size()[2] / cfg.dataset.block_size)
+            padded_samples = segments * cfg.dataset.block_size
+            x = torch.nn.functional.pad(x, (0, padded_samples - x.size()[2]))
+            y = torch.nn.functional.pad(y, (0, padded_samples - y.size()[2]))
 
             if not pred_with_dvec:
                 # do predict without dvec
@@ -110,7 +118,7 @@ def main(cfg: DictConfig):
                     y_pred[:, :, offsets: (offsets + cfg.dataset.block_size)] = y_pred_segment
 
                 print('pred:', name)
-                play_tensor(y_pred[0])
+                play_batch(y_pred, lengths)
 
             else:
                 # predict with its own dvec
@@ -124,7 +132,7 @@ def main(cfg: DictConfig):
                     y_pred[:, :, offsets: (offsets + cfg.dataset.block_size)] = y_pred_segment
 
                 print('pred with own embedding:', name)
-                play_tensor(y_pred[0])
+                play_batch(y_pred, lengths)
 
                 # predict with other's dvec
                 y_pred = torch.zeros_like(y)
@@ -137,12 +145,18 @@ def main(cfg: DictConfig):
                     y_pred[:, :, offsets: (offsets + cfg.dataset.block_size)] = y_pred_segment
 
                 print('pred with other embedding:', name_unrelated)
-                play_tensor(y_pred[0])
+                play_batch(y_pred, lengths)
 
             print('original input')
-            play_tensor(x[0])
+            play_batch(x, lengths)
             print('original target')
-            play_tensor(y[0])
+            play_batch(y, lengths)
+
+
+def play_batch(tensor_samples, lengths, sample_rate=44100):
+    # each example without its padding
+    for tensor_sample, length in zip(tensor_samples, lengths.tolist()):
+        play_tensor(tensor_sample[:, :length], sample_rate)
 
 
 def play_tensor(tensor_sample, sample_rate=44100):
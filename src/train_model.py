@@ -12,6 +12,9 @@ from src.model.waveUnet import WaveUNet_PL
 from src.model.autoencoder import AutoEncoder_PL
 from src.model.autoencoder_speaker import AutoEncoder_Speaker_PL
 from src.model.autoencoder_speaker2 import AutoEncoder_Speaker_PL2
+from src.utils.perf import apply_perf_settings, trainer_perf_kwargs, compile_model, check_loss_precision
+from src.utils.distributed import build_strategy, configure_cpu_threads
+from src.utils.callbacks import ScalingEfficiencyCallback, ProfilingCallback, ShardEpochCallback
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.loggers import MLFlowLogger
 
@@ -21,6 +24,11 @@ def main(cfg: DictConfig):
     sys.stdout = Logger()
     cur_path = Path(os.path.abspath(hydra.utils.get_original_cwd()))
     data_path = cfg.dataset.data_path
+    perf_cfg = cfg.training.perf
+    dist_cfg = cfg.training.distributed
+
+    apply_perf_settings(perf_cfg)
+    configure_cpu_threads(dist_cfg)
 
     if cfg.model.model_name == 'WaveNet_PL':
         model = WaveNet_PL(cfg)
@@ -44,9 +52,11 @@ def main(cfg: DictConfig):
                                cfg=cfg,
                                batch_size=batch_size)
 
-    # model = torch.compile(model)
+    if perf_cfg.check_loss_precision:
+        check_loss_precision(model.loss, perf_cfg.precision, device=cfg.training.accelerator,
+                             block_size=cfg.dataset.block_size)
 
-    mlflow.pytorch.autolog()
+    model = compile_model(model, perf_cfg)
 
     if cfg.training.use_checkpoint_callback:
         checkpoint_callback = ModelCheckpoint(
@@ -63,16 +73,32 @@ def main(cfg: DictConfig):
     else:
         mlf_logger = None
 
+    callbacks = [ScalingEfficiencyCallback(dist_cfg.baseline_samples_per_sec)]
+    if checkpoint_callback is not None:
+        callbacks.append(checkpoint_callback)
+    if cfg.training.profiling.enabled:
+        callbacks.append(ProfilingCallback(cfg.training.profiling, dm_train.stage_timer))
+    if cfg.dataset.train_shards:
+        callbacks.append(ShardEpochCallback())
+
     trainer = pl.Trainer(
         max_epochs=cfg.training.max_epochs,
         check_val_every_n_epoch=cfg.training.check_val_every_n_epoch,
         accelerator=cfg.training.accelerator,
-        callbacks=[checkpoint_callback],
+        strategy=build_strategy(dist_cfg),
+        devices=dist_cfg.devices,
+        num_nodes=dist_cfg.num_nodes,
+        use_distributed_sampler=False,  # AudioDataModule shards by speaker itself
+        callbacks=callbacks,
         logger=mlf_logger,
         log_every_n_steps=1,
-        # profiler="advanced"
+        **trainer_perf_kwargs(perf_cfg),
     )
 
+    # checkpoints are written by rank 0 only, keep mlflow's autologged runs to rank 0 as well
+    if trainer.is_global_zero:
+        mlflow.pytorch.autolog()
+
     if cfg.training.resume_checkpoint:
         ckpt_path = cur_path / Path(cfg.training.checkpoint_file)
     else:
@@ -0,0 +1,59 @@
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+from pathlib import Path
+
+# encodings of the processed clips, name to (soundfile format, subtype, file extension)
+STORAGE_ENCODINGS = {'pcm16': ('WAV', 'PCM_16', 'wav'),
+                     'pcm32': ('WAV', 'PCM_32', 'wav'),
+                     'float32': ('WAV', 'FLOAT', 'wav'),
+                     'flac': ('FLAC', 'PCM_16', 'flac')}
+
+AUDIO_BACKENDS = [None, 'soundfile', 'sox_io', 'ffmpeg']
+
+
+def storage_ext(encoding):
+    """
+    file extension of the processed clips, e.g. cfg.process_data.storage_encoding -> 'wav'
+    """
+    assert encoding in STORAGE_ENCODINGS, f"unknown storage encoding {encoding}, one of {list(STORAGE_ENCODINGS)}"
+    return STORAGE_ENCODINGS[encoding][2]
+
+
+def export_segment(segment, target_file, encoding='pcm16'):
+    """
+    Writes a pydub AudioSegment with the given storage encoding, the suffix of target_file is replaced to match.
+    :return: the written file
+    """
+    file_format, subtype, ext = STORAGE_ENCODINGS[encoding]
+    target_file = Path(target_file).with_suffix('.' + ext)
+
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    samples = samples.reshape(-1, segment.channels) / float(1 << (8 * segment.sample_width - 1))
+    sf.write(target_file, samples, segment.frame_rate, format=file_format, subtype=subtype)
+    return target_file
+
+
+def load_audio(file, backend=None):
+    """
+    Decodes a clip into a float tensor [channels, samples] and its sample rate.
+    :param backend: None for torchaudio.load's default backend, 'soundfile' (libsndfile, called directly),
+                    'sox_io' or 'ffmpeg' (torchaudio.io, needs the ffmpeg libraries)
+    """
+    if backend is None:
+        return torchaudio.load(file)
+    if backend == 'soundfile':
+        data, sr = sf.read(file, dtype='float32', always_2d=True)
+        return torch.from_numpy(data.T.copy()), sr
+    if backend == 'sox_io':
+        return torchaudio.backend.sox_io_backend.load(file)
+    if backend == 'ffmpeg':
+        from torchaudio.io import StreamReader
+        reader = StreamReader(str(file))
+        sr = int(reader.get_src_stream_info(reader.default_audio_stream).sample_rate)
+        reader.add_basic_audio_stream(frames_per_chunk=-1, format='fltp')
+        reader.process_all_packets()
+        waveform, = reader.pop_chunks()
+        return waveform.T, sr
+    raise ValueError(f"unknown audio backend {backend}, one of {AUDIO_BACKENDS}")
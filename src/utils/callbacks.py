@@ -0,0 +1,167 @@
+import time
+import torch
+import pytorch_lightning as pl
+from pytorch_lightning.loggers import MLFlowLogger
+from pytorch_lightning.utilities import rank_zero_info
+from src.utils.losses import Losses
+from src.utils.profiling import StageTimer, add_forward_timer, stage_percentiles
+
+
+class ScalingEfficiencyCallback(pl.Callback):
+    """
+    Logs training throughput over all processes each epoch.
+    With the throughput of a single process given, also logs the scaling efficiency,
+    throughput / (processes * single process throughput).
+    """
+    def __init__(self, baseline_samples_per_sec=None):
+        super().__init__()
+        self.baseline_samples_per_sec = baseline_samples_per_sec
+        self.epoch_start = None
+        self.samples = 0
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self.samples = 0
+        self.epoch_start = time.perf_counter()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        self.samples += batch[0].size(0)
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        elapsed = time.perf_counter() - self.epoch_start
+
+        # the slowest process sets the pace of every all-reduce
+        stats = torch.tensor([elapsed, self.samples], dtype=torch.float64, device=pl_module.device)
+        stats = trainer.strategy.all_gather(stats).reshape(-1, 2)
+        elapsed = stats[:, 0].max().item()
+        samples = stats[:, 1].sum().item()
+
+        samples_per_sec = samples / elapsed
+        pl_module.log('samples_per_sec', samples_per_sec, rank_zero_only=True)
+        message = f"epoch {trainer.current_epoch}: {samples_per_sec:.1f} samples/s over {trainer.world_size} processes"
+
+        if self.baseline_samples_per_sec:
+            efficiency = samples_per_sec / (trainer.world_size * self.baseline_samples_per_sec)
+            pl_module.log('scaling_efficiency', efficiency, rank_zero_only=True)
+            message += f", scaling efficiency {efficiency:.1%}"
+
+        rank_zero_info(message)
+
+
+class ShardEpochCallback(pl.Callback):
+    """
+    Sets the epoch of the streamed training shards from the trainer, so a resumed run carries on with the epoch's
+    shard order and seeds. Lightning only sets the epoch of samplers, an IterableDataset has none.
+    """
+    def on_train_epoch_start(self, trainer, pl_module):
+        set_epoch = getattr(getattr(trainer.train_dataloader, 'dataset', None), 'set_epoch', None)
+        if callable(set_epoch):
+            set_epoch(trainer.current_epoch)
+
+
+class ProfilingCallback(pl.Callback):
+    """
+    Per stage timings of the training hot path, logged every log_every_n_steps:
+    samples/sec, loader starvation (share of wall time spent waiting for the next batch, excluding the
+    host to device copy) and p50/p90/p99 of every stage. Stages are decode, crop and each augmentation in the
+    dataloader workers, h2d, forward of each sub module, each loss term, backward and optimizer.
+    Optionally records a torch profiler trace of a few steps, logged to mlflow as an artifact.
+    """
+    def __init__(self, profiling_cfg, stage_timer: StageTimer):
+        super().__init__()
+        self.cfg = profiling_cfg
+        self.timer = stage_timer
+        self.hooks = []
+        self.torch_profiler = None
+        self.reset_window()
+        self.last_batch_end = None
+
+    def reset_window(self):
+        self.window_start = time.perf_counter()
+        self.samples = 0
+        self.loader_wait = 0.0
+
+    def setup(self, trainer, pl_module, stage):
+        if stage != 'fit':
+            return
+        for name, module in pl_module.named_children():
+            self.hooks += add_forward_timer(module, self.timer, f"forward/{name}")
+        if isinstance(getattr(pl_module, 'loss', None), Losses):
+            pl_module.loss.timer = self.timer
+
+    def teardown(self, trainer, pl_module, stage):
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+        if isinstance(getattr(pl_module, 'loss', None), Losses):
+            pl_module.loss.timer = StageTimer(enabled=False)
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self.last_batch_end = None  # the first batch of an epoch includes the workers starting up
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+        now = self.timer._now()
+        if self.last_batch_end is not None:
+            h2d = self.timer.timings['h2d'][-1] if len(self.timer.timings['h2d']) > 0 else 0.0
+            wait = max(0.0, now - self.last_batch_end - h2d)
+            self.timer.add('loader_wait', wait)
+            self.loader_wait += wait
+        self.step_start = now
+        self.optimizer_start = None
+
+        if self.cfg.torch_profiler_steps > 0 and self.torch_profiler is None and \
+                trainer.global_step == self.cfg.torch_profiler_start_step and trainer.is_global_zero:
+            self.start_torch_profiler()
+
+    def on_before_backward(self, trainer, pl_module, loss):
+        self.backward_start = self.timer._now()
+
+    def on_after_backward(self, trainer, pl_module):
+        self.timer.add('backward', self.timer._now() - self.backward_start)
+
+    def on_before_optimizer_step(self, trainer, pl_module, optimizer):
+        self.optimizer_start = self.timer._now()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        now = self.timer._now()
+        if self.optimizer_start is not None:
+            self.timer.add('optimizer', now - self.optimizer_start)
+        self.timer.add('step', now - self.step_start)
+        self.last_batch_end = now
+        self.samples += batch[0].size(0)
+
+        if self.torch_profiler is not None:
+            self.torch_profiler.step()
+            self.torch_profiler_steps_done += 1
+            if self.torch_profiler_steps_done >= self.cfg.torch_profiler_steps:
+                self.stop_torch_profiler(trainer)
+
+        if (trainer.global_step + 1) % self.cfg.log_every_n_steps == 0:
+            self.log_window(pl_module)
+
+    def log_window(self, pl_module):
+        elapsed = time.perf_counter() - self.window_start
+        metrics = stage_percentiles(self.timer.collect())
+        metrics['profile/samples_per_sec'] = self.samples / elapsed
+        metrics['profile/loader_starvation_pct'] = 100 * self.loader_wait / elapsed
+        pl_module.log_dict(metrics, rank_zero_only=True)
+        self.reset_window()
+
+    def start_torch_profiler(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.torch_profiler = torch.profiler.profile(
+            activities=activities,
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(self.cfg.trace_dir),
+            record_shapes=True,
+            with_stack=False)
+        self.torch_profiler.start()
+        self.torch_profiler_steps_done = 0
+
+    def stop_torch_profiler(self, trainer):
+        self.torch_profiler.stop()
+        self.torch_profiler = None
+        rank_zero_info(f"torch profiler trace saved to {self.cfg.trace_dir}")
+        if isinstance(trainer.logger, MLFlowLogger):
+            trainer.logger.experiment.log_artifacts(trainer.logger.run_id, self.cfg.trace_dir,
+                                                    artifact_path='profiler')
@@ -0,0 +1,51 @@
+import os
+import soundfile as sf
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _list_speaker(speaker_path, ext):
+    suffix = '.' + ext.lower()
+    files = []
+    for dir_path, _, file_names in os.walk(speaker_path):
+        files += [os.path.join(dir_path, name) for name in file_names if name.lower().endswith(suffix)]
+    return sorted(files)
+
+
+def _read_header(file):
+    # header only, nothing is decoded. SoundFile instead of sf.info, which also formats a text summary
+    with sf.SoundFile(file) as f:
+        header = {'sample_rate': f.samplerate, 'channels': f.channels, 'num_frames': f.frames}
+    stat = os.stat(file)
+    header.update({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+    return header
+
+
+def scan_split(split_path, ext='wav', num_workers=None):
+    """
+    Lists the clips of every speaker folder of a split and reads their headers, both in a thread pool.
+    :return: clip files, their speaker names and their headers
+             {'sample_rate', 'channels', 'num_frames', 'size', 'mtime_ns'}, sorted by speaker then file
+    """
+    speaker_paths = sorted(path for path in Path(split_path).iterdir() if path.is_dir())
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        speaker_files = list(executor.map(lambda path: _list_speaker(path, ext), speaker_paths))
+        files = [file for files in speaker_files for file in files]
+        speaker_names = [path.name for path, files in zip(speaker_paths, speaker_files) for _ in files]
+        headers = list(executor.map(_read_header, files))
+    return files, speaker_names, headers
+
+
+def read_headers(files, num_workers=None):
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(_read_header, files))
+
+
+def check_sample_rates(files, sample_rates, sample_rate):
+    """
+    raises before training when any clip is not at sample_rate, instead of mid epoch
+    """
+    wrong = [(file, sr) for file, sr in zip(files, sample_rates) if sr != sample_rate]
+    if len(wrong) > 0:
+        listed = '\n'.join(f"  {file}: {sr}Hz" for file, sr in wrong[:10])
+        raise ValueError(f"{len(wrong)} clips are not at the dataset's {sample_rate}Hz, e.g.\n{listed}")
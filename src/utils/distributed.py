@@ -0,0 +1,30 @@
+import os
+import torch
+from omegaconf import DictConfig
+from pytorch_lightning.strategies import DDPStrategy
+
+
+def build_strategy(dist_cfg: DictConfig):
+    """
+    pl.Trainer strategy from the training.distributed config group
+    """
+    if dist_cfg.strategy != 'ddp':
+        return dist_cfg.strategy
+
+    # gradients are all-reduced in buckets of bucket_cap_mb while the backward pass is still running
+    return DDPStrategy(process_group_backend=dist_cfg.process_group_backend,
+                       bucket_cap_mb=dist_cfg.bucket_cap_mb,
+                       gradient_as_bucket_view=dist_cfg.gradient_as_bucket_view,
+                       find_unused_parameters=dist_cfg.find_unused_parameters)
+
+
+def configure_cpu_threads(dist_cfg: DictConfig):
+    """
+    processes on the same node share its cores, without this every process starts one thread per core
+    """
+    threads = dist_cfg.threads_per_process
+    if threads is None:
+        if dist_cfg.strategy != 'ddp' or not isinstance(dist_cfg.devices, int):
+            return
+        threads = max(1, (os.cpu_count() or 1) // dist_cfg.devices)
+    torch.set_num_threads(threads)
@@ -1,36 +1,14 @@
 import hydra
 import os
 import torch
-import torch.nn as nn
 import torch.onnx
 import onnx
 import onnxruntime as ort
 import numpy as np
-import torchaudio.transforms as T
 from pathlib import Path
 from omegaconf import DictConfig
-from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder, AudioHelper
-
-
-class ResampleGetMel(nn.Module):
-    def __init__(self, cfg, sr):
-        super(ResampleGetMel, self).__init__()
-        self.audio_helper = AudioHelper()
-        # try to be as close as librosa's resampling
-        self.resampler = T.Resample(orig_freq=cfg.dataset.block_size_speaker,
-                                    new_freq=sr,
-                                    lowpass_filter_width=64,
-                                    rolloff=0.9475937167399596,
-                                    resampling_method="sinc_interp_kaiser",
-                                    beta=14.769656459379492,
-                                    )
-
-    def forward(self, waveform_speaker):
-        # embedding d vec
-        waveform_speaker = self.resampler(waveform_speaker)  # resample to 16kHz
-        waveform_speaker = waveform_speaker.squeeze()  # [16000]
-        dvec_mel, _, _ = self.audio_helper.get_mel_torch(waveform_speaker)
-        return dvec_mel
+from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder, SpeakerEmbeddingExtractor
+from src.utils.quantization import quantized_filename, quantize_onnx_dynamic
 
 
 @hydra.main(version_base=None, config_path="../../conf", config_name="config")
@@ -41,57 +19,96 @@ def main(cfg: DictConfig):
     onnx_filename = cur_path / Path(cfg.export_to_onnx.export_filename)
 
     torch_embedder = SpeechEmbedder()
-    chkpt_embed = torch.load(cfg.model.embedder_path, map_location=cfg.training.accelerator)
+    chkpt_embed = torch.load(cfg.model.embedder_path, map_location='cpu')
     torch_embedder.load_state_dict(chkpt_embed)
     torch_embedder.eval()
 
-    resample_get_mel = ResampleGetMel(cfg, sr=torch_embedder.get_target_sample_rate())
-
-    sample_block_size = cfg.export_to_onnx.sample_block_size
-    dummy_wav = torch.randn(1, sample_block_size)
-    mels = resample_get_mel(dummy_wav)
-    dvec_out = torch_embedder(mels)
-    emb_size = cfg.export_to_onnx.emb_size
-    assert dvec_out.size()[0] == emb_size
-
-    dummy_input = torch.randn(40, 101)
-    input_names = ["mel_input1"]
+    # resample + stft + mel + windowed lstm in one graph, from audio at the dataset's sample rate
+    extractor = SpeakerEmbeddingExtractor(torch_embedder, orig_sr=cfg.dataset.sample_rate, use_dft_stft=True)
+    extractor.eval()
+
+    export_embedding_to_onnx(extractor, onnx_filename.as_posix(),
+                             sample_block_size=cfg.export_to_onnx.sample_block_size,
+                             emb_size=cfg.export_to_onnx.emb_size)
+    print("saved: " + onnx_filename.as_posix())
+
+    test_emb_model(extractor, onnx_filename.as_posix(),
+                   batch_sizes=cfg.export_to_onnx.parity_batch_sizes,
+                   lengths=cfg.export_to_onnx.parity_lengths)
+
+    if cfg.export_to_onnx.quantization:
+        # the embedder is lstm + linear, int8 weights with dynamically quantized activations
+        int8_filename = quantize_onnx_dynamic(onnx_filename.as_posix(),
+                                              quantized_filename(onnx_filename, 'dynamic'))
+        print("saved: " + int8_filename)
+        test_quantized_emb_model(onnx_filename.as_posix(), int8_filename,
+                                 length=cfg.export_to_onnx.sample_block_size,
+                                 min_similarity=cfg.export_to_onnx.quantization_min_similarity)
+
+
+def export_embedding_to_onnx(extractor, onnx_filename, sample_block_size, emb_size=256):
+    """
+    Exports a SpeakerEmbeddingExtractor taking audio [b, samples] of any length and returning d-vectors [b, emb_size].
+    The input has to cover at least one lstm window of mel frames, about 0.8s of audio.
+    """
+    dummy_input = torch.randn(1, sample_block_size)
+    with torch.no_grad():
+        dvec_out = extractor(dummy_input)
+    assert dvec_out.size() == (1, emb_size)
+
+    input_names = ["audio"]
     output_names = ["dvec"]
 
     dynamic_axes = {
-        "input1": {1: 'blocksize'},  # dim 1
+        "audio": {0: 'batch', 1: 'samples'},
+        "dvec": {0: 'batch'},
     }
 
     torch.onnx.export(
-        torch_embedder,
+        extractor,
         args=dummy_input,
-        f=onnx_filename.as_posix(),
+        f=onnx_filename,
         input_names=input_names,
         output_names=output_names,
         dynamic_axes=dynamic_axes,
-        # opset_version=17
     )
 
-    onnx_embedder = onnx.load(onnx_filename.as_posix())
+    onnx_embedder = onnx.load(onnx_filename)
     onnx.checker.check_model(onnx_embedder)
 
-    test_emb_model(torch_embedder, onnx_filename.as_posix())
 
+def test_emb_model(extractor, onnx_filename, batch_sizes, lengths):
+    ort_session = ort.InferenceSession(onnx_filename, providers=['CPUExecutionProvider'])
+    extractor.eval()
 
-def test_emb_model(torch_embedder, onnx_filename):
-    ort_session = ort.InferenceSession(onnx_filename)
-    dummy_input = torch.randn(40, 101)
+    for batch_size in batch_sizes:
+        for length in lengths:
+            dummy_input = torch.randn(batch_size, length)
+            onnx_outputs = ort_session.run(None, {"audio": dummy_input.numpy()})
 
-    onnx_outputs = ort_session.run(
-        None,
-        {"mel_input1": dummy_input.numpy()},
-    )
+            with torch.no_grad():
+                torch_outputs = extractor(dummy_input)
 
-    torch_embedder.eval()
-    torch_outputs = torch_embedder(dummy_input)
+            np.testing.assert_allclose(torch_outputs.numpy(), onnx_outputs[0], rtol=1e-03, atol=1e-04,
+                                       err_msg=f"batch size {batch_size}, length {length}")
+    print("Embedding output delta is close... Good!")
+
+
+def test_quantized_emb_model(onnx_filename, int8_filename, length, num_tests=16, min_similarity=0.99):
+    fp32_session = ort.InferenceSession(onnx_filename, providers=['CPUExecutionProvider'])
+    int8_session = ort.InferenceSession(int8_filename, providers=['CPUExecutionProvider'])
+
+    dummy_input = {"audio": torch.randn(num_tests, length).numpy()}
+    dvec_fp32 = fp32_session.run(None, dummy_input)[0]
+    dvec_int8 = int8_session.run(None, dummy_input)[0]
+    similarities = np.sum(dvec_fp32 * dvec_int8, axis=1) / \
+        (np.linalg.norm(dvec_fp32, axis=1) * np.linalg.norm(dvec_int8, axis=1))
 
-    np.testing.assert_allclose(torch_outputs.detach().numpy(), onnx_outputs[0], rtol=1e-05,
-                               atol=1e-05)
+    # d-vectors are compared by cosine similarity downstream
+    print(f"int8 vs fp32 d-vector cosine similarity, min: {np.min(similarities):.4f}, "
+          f"mean: {np.mean(similarities):.4f}")
+    assert np.min(similarities) >= min_similarity, \
+        f"int8 d-vectors differ from fp32, cosine similarity {np.min(similarities):.4f} < {min_similarity}"
 
 
 if __name__ == "__main__":
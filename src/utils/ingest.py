@@ -0,0 +1,101 @@
+import io
+import os
+import shutil
+import zipfile
+import soundfile as sf
+from pathlib import Path, PurePosixPath
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+# each pool worker opens the archive once, zip handles can't be shared between processes
+_archive = None
+
+
+def open_archive(archive_path, nested=None):
+    """
+    Opens a zip, or a zip inside it without extracting it.
+    A nested zip is read in place when it is stored uncompressed, otherwise only that member is extracted next to
+    the outer archive, as seeking in a deflated member means decompressing it again from the start.
+    :param nested: name of the inner zip member, e.g. 'VCTK-Corpus-0.92.zip'
+    """
+    archive = zipfile.ZipFile(archive_path)
+    if nested is None:
+        return archive
+
+    extracted = Path(archive_path).parent / PurePosixPath(nested).name
+    if extracted.exists():
+        archive.close()
+        return zipfile.ZipFile(extracted)
+
+    if archive.getinfo(nested).compress_type == zipfile.ZIP_STORED:
+        return zipfile.ZipFile(archive.open(nested))
+
+    print(f"Extracting {nested}")
+    archive.extract(nested, Path(archive_path).parent)
+    archive.close()
+    return zipfile.ZipFile(extracted)
+
+
+def _init_worker(archive_path, nested):
+    global _archive
+    _archive = open_archive(archive_path, nested)
+
+
+def _ingest_member(task):
+    member, target_path, to_wav = task
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    if to_wav:
+        data, sr = sf.read(io.BytesIO(_archive.read(member)))
+        sf.write(target_path, data, sr, subtype='PCM_16')
+    else:
+        with _archive.open(member) as source, open(target_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+
+def plan_ingest(members, target_dir, speaker_of, suffix=None):
+    """
+    Target file for every member, target_dir/speaker/name.
+    Names repeated within a speaker get _1, _2, ... as the copies in download_data.py always did.
+    :param speaker_of: member name to speaker folder name
+    :param suffix: replaces the member's suffix, e.g. '.wav' when converting
+    """
+    plan = []
+    taken = set()
+    for member in members:
+        member_path = PurePosixPath(member)
+        suffix_out = member_path.suffix if suffix is None else suffix
+        speaker_path = Path(target_dir) / speaker_of(member)
+
+        target_path = speaker_path / (member_path.stem + suffix_out)
+        i = 1
+        while target_path in taken or target_path.exists():
+            target_path = speaker_path / (member_path.stem + '_' + str(i) + suffix_out)
+            i += 1
+        taken.add(target_path)
+        plan.append((member, target_path))
+    return plan
+
+
+def ingest_zip(archive_path, target_dir, select, speaker_of, nested=None, to_wav=False, num_workers=None):
+    """
+    Streams only the selected members of a zip (or of a zip inside it) into target_dir/speaker/,
+    copied as is or decoded and written as 16 bit wav, in a process pool.
+    Nothing else is extracted and the archive is kept, so it can be ingested again offline.
+    :param select: member name to bool
+    :param speaker_of: member name to speaker folder name
+    """
+    with open_archive(archive_path, nested) as archive:
+        members = sorted(name for name in archive.namelist() if select(name))
+
+    plan = plan_ingest(members, target_dir, speaker_of, suffix='.wav' if to_wav else None)
+    tasks = [(member, target_path, to_wav) for member, target_path in plan]
+
+    num_workers = num_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             initializer=_init_worker,
+                             initargs=(archive_path, nested)) as executor:
+        for _ in tqdm(executor.map(_ingest_member, tasks, chunksize=64), total=len(tasks),
+                      desc=Path(archive_path).name):
+            pass
+
+    return [target_path for _, target_path in plan]
@@ -1,9 +1,10 @@
 import torch
 import auraloss
-import torchaudio.transforms as T
 from omegaconf import DictConfig, OmegaConf
 from auraloss.utils import apply_reduction
-from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder, AudioHelper
+from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder, SpeakerEmbeddingExtractor
+from src.model.speaker_encoder.speaker_embedder import get_hann_window, get_mel_basis
+from src.utils.profiling import StageTimer
 
 class ESRLossORG(torch.nn.Module):
     """
@@ -61,51 +62,146 @@ class EMBLoss(torch.nn.Module):
         super(EMBLoss, self).__init__()
         dev = torch.device(cfg.training.accelerator)
 
-        self.embedder = SpeechEmbedder()
+        embedder = SpeechEmbedder()
         chkpt_embed = torch.load(cfg.model.embedder_path, map_location=cfg.training.accelerator)
-        self.embedder.load_state_dict(chkpt_embed)
-        for p in self.embedder.parameters():
+        embedder.load_state_dict(chkpt_embed)
+        for p in embedder.parameters():
             p.requires_grad = False
+        embedder.eval()
 
-        self.embedder.to(dev)
-
-        self.embedder = torch.compile(self.embedder, mode='reduce-overhead')
-
-        self.audio_helper = AudioHelper()
-
-        # try to be as close as librosa's resampling
-        self.resampler = T.Resample(orig_freq=cfg.dataset.block_size_speaker,
-                                    new_freq=self.embedder.get_target_sample_rate(),
-                                    lowpass_filter_width=64,
-                                    rolloff=0.9475937167399596,
-                                    resampling_method="sinc_interp_kaiser",
-                                    beta=14.769656459379492,
-                                    ).to(dev)
+        # resample from the audio's sample rate, mel and lstm all on the training device
+        self.extractor = SpeakerEmbeddingExtractor(embedder, orig_sr=cfg.dataset.sample_rate)
+        self.extractor.to(dev)
 
         self.loss = torch.nn.MSELoss().to(dev)
 
-        self.fallback_device = torch.device('cpu')
-
     def forward(self, pred, target_dvec):
         #  onnx embedding inference a little inaccurate. to use native pytorch inference
 
-        pred_dvec = self.__get_embedding_vec(pred)
+        pred_dvec = self.extractor(pred)  # [b, emb_dim]
         return self.loss(pred_dvec, target_dvec)
 
-    def __get_embedding_vec(self, waveform_speaker):
-        # embedding d vec
-        waveform_speaker = self.resampler(waveform_speaker)  # resample to 16kHz
-        waveform_speaker = waveform_speaker.squeeze(dim=1)  # [b, 16000]
 
-        org_dev = waveform_speaker.device
-        if waveform_speaker.device.type == 'mps':
-            waveform_speaker = waveform_speaker.to(self.fallback_device)
-        dvec_mel, _, _ = self.audio_helper.get_mel_torch(waveform_speaker)
-        dvec_mel = dvec_mel.to(org_dev)
+class SpectralLossEngine(torch.nn.Module):
+    """
+    Composite frequency domain loss, following auraloss.freq.STFTLoss terms
+    (spectral convergence, log magnitude, linear magnitude and phase).
+    Every stft resolution is computed once for input and target, and shared by all terms using it.
+    """
+
+    def __init__(self, eps=1e-8):
+        super(SpectralLossEngine, self).__init__()
+        self.eps = eps
+        self.terms = []
+
+    def add_stft_term(self, fft_size, hop_size, win_length,
+                      w_sc=1.0, w_log_mag=1.0, w_lin_mag=0.0, w_phs=0.0,
+                      sample_rate=None, n_mels=None, weight=1.0):
+        self.terms.append({'resolution': (int(fft_size), int(hop_size), int(win_length)),
+                           'w_sc': w_sc,
+                           'w_log_mag': w_log_mag,
+                           'w_lin_mag': w_lin_mag,
+                           'w_phs': w_phs,
+                           'sample_rate': sample_rate,
+                           'n_mels': n_mels,
+                           'weight': weight})
+
+    def add_multi_resolution_term(self, fft_sizes, hop_sizes, win_lengths, w_phs=0.0, weight=1.0):
+        assert len(fft_sizes) == len(hop_sizes) == len(win_lengths)  # must define all
+        # auraloss averages over the resolutions
+        for fft_size, hop_size, win_length in zip(fft_sizes, hop_sizes, win_lengths):
+            self.add_stft_term(fft_size, hop_size, win_length, w_phs=w_phs,
+                               weight=weight / len(fft_sizes))
+
+    def min_length(self):
+        # torch.stft reflect pads fft_size // 2 samples on each side, the input must be longer than that
+        return max([term['resolution'][0] // 2 + 1 for term in self.terms], default=1)
+
+    def _stft(self, x, resolution, with_phase):
+        fft_size, hop_size, win_length = resolution
+        window = get_hann_window(win_length, device=x.device, dtype=x.dtype)
+        x_stft = torch.stft(x, fft_size, hop_size, win_length, window, return_complex=True)
+        x_mag = torch.sqrt(torch.clamp((x_stft.real ** 2) + (x_stft.imag ** 2), min=self.eps))
+        x_phs = torch.angle(x_stft) if with_phase else None
+        return x_mag, x_phs
+
+    def _resolutions(self):
+        # resolution -> whether any term using it needs the phase
+        resolutions = {}
+        for term in self.terms:
+            resolution = term['resolution']
+            resolutions[resolution] = resolutions.get(resolution, False) or bool(term['w_phs'])
+        return resolutions
+
+    def forward(self, input, target):
+        x = input.reshape(-1, input.size(-1))
+        resolutions = self._resolutions()
+        x_spectra = {res: self._stft(x, res, phs) for res, phs in resolutions.items()}
+        y = target.reshape(-1, target.size(-1))
+        y_spectra = {res: self._stft(y, res, phs) for res, phs in resolutions.items()}
+
+        loss = 0.0
+        for term in self.terms:
+            x_mag, x_phs = x_spectra[term['resolution']]
+            y_mag, y_phs = y_spectra[term['resolution']]
+
+            if term['n_mels'] is not None:
+                fb = get_mel_basis(term['sample_rate'], term['resolution'][0], term['n_mels'],
+                                   device=x_mag.device, dtype=x_mag.dtype)
+                x_mag = torch.matmul(fb, x_mag)
+                y_mag = torch.matmul(fb, y_mag)
+
+            term_loss = 0.0
+            if term['w_sc']:
+                sc_loss = torch.norm(y_mag - x_mag, p="fro") / torch.norm(y_mag, p="fro")
+                term_loss = term_loss + term['w_sc'] * sc_loss
+            if term['w_log_mag']:
+                log_mag_loss = torch.nn.functional.l1_loss(torch.log(x_mag), torch.log(y_mag))
+                term_loss = term_loss + term['w_log_mag'] * log_mag_loss
+            if term['w_lin_mag']:
+                lin_mag_loss = torch.nn.functional.l1_loss(x_mag, y_mag)
+                term_loss = term_loss + term['w_lin_mag'] * lin_mag_loss
+            if term['w_phs']:
+                phs_loss = torch.nn.functional.mse_loss(x_phs, y_phs)
+                term_loss = term_loss + term['w_phs'] * phs_loss
+
+            loss = loss + term['weight'] * term_loss
+        return loss
+
+
+class CombinationLoss(torch.nn.Module):
+    """
+    Weighted sums of auraloss time domain losses (DCLoss, ESRLoss, SDSDRLoss, SNRLoss),
+    evaluated from one pass of shared time domain statistics.
+    """
+
+    def __init__(self, loss_type='DC_SDSDR_SNR_Loss', eps=1e-8):
+        super(CombinationLoss, self).__init__()
+        assert loss_type in ('DC_SDSDR_SNR_Loss', 'ESR_DC_Loss')
+        self.loss_type = loss_type
+        self.eps = eps
+
+    def forward(self, input, target):
+        diff = target - input
+        target_abs_mean = target.abs().mean(-1)
+        # DCLoss
+        lossDC = (diff.mean(-1) ** 2 / target_abs_mean ** 2).mean()
+
+        if self.loss_type == 'ESR_DC_Loss':
+            # ESRLoss
+            lossESR = ((diff ** 2).sum(-1) / (target ** 2).sum(-1)).mean()
+            return lossDC * 1000.0 + lossESR  # loss weighting but chosen from experiments
 
-        dvecs = self.embedder.batched_forward(dvec_mel)
+        # zero mean statistics, shared by SDSDRLoss and SNRLoss
+        input = input - input.mean(-1, keepdim=True)
+        target = target - target.mean(-1, keepdim=True)
+        target_energy = (target ** 2).sum(-1)
+        res_energy = ((input - target) ** 2).sum(-1) + self.eps
 
-        return dvecs
+        alpha = (input * target).sum(-1) / (target_energy + self.eps)
+        lossSDSDR = -(10 * torch.log10((alpha ** 2) * target_energy / res_energy + self.eps)).mean()
+        lossSNR = -(10 * torch.log10(target_energy / res_energy + self.eps)).mean()
+        return lossDC * 10000.0 + lossSDSDR + lossSNR  # loss weighting but chosen from experiments
 
 
 class Losses:
@@ -114,6 +210,7 @@ class Losses:
         self.loss_type = loss_type
         self.sample_rate = sample_rate
         self.cfg = cfg
+        self.timer = StageTimer(enabled=False)  # per term timings, set by ProfilingCallback
 
         self.device = torch.device('cuda')
         if torch.backends.mps.is_available():
@@ -141,67 +238,59 @@ class Losses:
         elif loss_type == 'MSELoss':
             self.loss = torch.nn.MSELoss()
 
-        # frequency domain
+        # frequency domain, stft resolutions are computed once and shared by all terms
         elif loss_type == 'STFTLoss':
+            self.loss = SpectralLossEngine()
             if self.cfg == None:
-                self.loss = auraloss.freq.STFTLoss(fft_size=4096,
-                                                   win_length=4096,
-                                                   hop_size=1024,
-                                                   w_phs=0.2,
-                                                   sample_rate=self.sample_rate,
-                                                   device=self.device)
+                self.loss.add_stft_term(fft_size=4096,
+                                        win_length=4096,
+                                        hop_size=1024,
+                                        w_phs=0.2)
             else:
-                self.loss = auraloss.freq.STFTLoss(fft_size=self.cfg.training.loss.fft_size,
-                                                   win_length=self.cfg.training.loss.win_length,
-                                                   hop_size=self.cfg.training.loss.hop_size,
-                                                   w_phs=self.cfg.training.loss.w_phs,
-                                                   sample_rate=self.sample_rate,
-                                                   device=self.device)
+                self.loss.add_stft_term(fft_size=self.cfg.training.loss.fft_size,
+                                        win_length=self.cfg.training.loss.win_length,
+                                        hop_size=self.cfg.training.loss.hop_size,
+                                        w_phs=self.cfg.training.loss.w_phs)
 
         elif loss_type == 'MelSTFTLoss':
+            self.loss = SpectralLossEngine()
+            # auraloss' MelSTFTLoss default win_length of 1024 is kept
             if self.cfg == None:
-                self.loss = auraloss.freq.MelSTFTLoss(fft_size=4096,
-                                                      hop_size=1024,
-                                                      n_mels=128,
-                                                      w_phs=0.2,
-                                                      sample_rate=self.sample_rate,
-                                                      device=self.device)
+                self.loss.add_stft_term(fft_size=4096,
+                                        win_length=1024,
+                                        hop_size=1024,
+                                        w_phs=0.2,
+                                        sample_rate=self.sample_rate,
+                                        n_mels=128)
             else:
-                self.loss = auraloss.freq.MelSTFTLoss(fft_size=self.cfg.training.loss.fft_size,
-                                                      hop_size=self.cfg.training.loss.hop_size,
-                                                      n_mels=self.cfg.training.loss.n_mels,
-                                                      w_phs=self.cfg.training.loss.w_phs,
-                                                      sample_rate=self.sample_rate,
-                                                      device=self.device)
+                self.loss.add_stft_term(fft_size=self.cfg.training.loss.fft_size,
+                                        win_length=1024,
+                                        hop_size=self.cfg.training.loss.hop_size,
+                                        w_phs=self.cfg.training.loss.w_phs,
+                                        sample_rate=self.sample_rate,
+                                        n_mels=self.cfg.training.loss.n_mels)
 
         elif loss_type == 'MultiResolutionSTFTLoss':
+            self.loss = SpectralLossEngine()
             if self.cfg == None:
-                self.loss = auraloss.freq.MultiResolutionSTFTLoss(
+                self.loss.add_multi_resolution_term(
                     fft_sizes=[512, 1024, 2048, 4096],
                     hop_sizes=[50, 120, 240, 480],
                     win_lengths=[512, 1024, 2048, 4096],
-                    w_phs=0.2,
-                    device=self.device);
+                    w_phs=0.2)
             else:
-                self.loss = auraloss.freq.MultiResolutionSTFTLoss(
+                self.loss.add_multi_resolution_term(
                     fft_sizes=OmegaConf.to_object(self.cfg.training.loss.fft_sizes),
                     win_lengths=OmegaConf.to_object(self.cfg.training.loss.win_lengths),
                     hop_sizes=OmegaConf.to_object(self.cfg.training.loss.hop_sizes),
-                    w_phs=self.cfg.training.loss.w_phs,
-                    device=self.device);
+                    w_phs=self.cfg.training.loss.w_phs)
 
         elif loss_type == 'RandomResolutionSTFTLoss':
             self.loss = auraloss.freq.RandomResolutionSTFTLoss(device=self.device);
 
-        # combination losses
-        elif loss_type == 'DC_SDSDR_SNR_Loss':
-            self.lossDC = auraloss.time.DCLoss()
-            self.lossSDSDR = auraloss.time.SDSDRLoss()
-            self.lossSNR = auraloss.time.SNRLoss()
-
-        elif loss_type == 'ESR_DC_Loss':
-            self.lossDC = auraloss.time.DCLoss()
-            self.lossESR = auraloss.time.ESRLoss()
+        # combination losses, evaluated from shared time domain statistics
+        elif loss_type == 'DC_SDSDR_SNR_Loss' or loss_type == 'ESR_DC_Loss':
+            self.loss = CombinationLoss(loss_type)
 
         elif loss_type == 'EMBLoss':
             self.loss = EMBLoss(self.cfg)
@@ -212,28 +301,26 @@ class Losses:
 
         elif loss_type == 'EMB_MR_Loss':
             self.loss_emb = EMBLoss(self.cfg)
-            self.loss_mr = auraloss.freq.MultiResolutionSTFTLoss(
-                    fft_sizes=OmegaConf.to_object(self.cfg.training.loss.fft_sizes),
-                    win_lengths=OmegaConf.to_object(self.cfg.training.loss.win_lengths),
-                    hop_sizes=OmegaConf.to_object(self.cfg.training.loss.hop_sizes),
-                    w_phs=self.cfg.training.loss.w_phs,
-                    device=self.device)
+            self.loss_mr = SpectralLossEngine()
+            self.loss_mr.add_multi_resolution_term(
+                fft_sizes=OmegaConf.to_object(self.cfg.training.loss.fft_sizes),
+                win_lengths=OmegaConf.to_object(self.cfg.training.loss.win_lengths),
+                hop_sizes=OmegaConf.to_object(self.cfg.training.loss.hop_sizes),
+                w_phs=self.cfg.training.loss.w_phs)
         else:
             assert False
 
-    def forward(self, input, target, dvec=None):
-        if self.loss_type == 'DC_SDSDR_SNR_Loss':
-            lossDC = self.lossDC(input, target)
-            lossSDSDR = self.lossSDSDR(input, target)
-            lossSNR = self.lossSNR(input, target)
-            loss = lossDC * 10000.0 + lossSDSDR + lossSNR # loss weighting but chosen from experiments
-            return loss
-
-        if self.loss_type == 'ESR_DC_Loss':
-            lossDC = self.lossDC(input, target)
-            lossESR = self.lossESR(input, target)
-            loss = lossDC * 1000.0 + lossESR # loss weighting but chosen from experiments
-            return loss
+    def forward(self, input, target, dvec=None, lengths=None):
+        """
+        :param lengths: [b] unpadded lengths of a zero padded batch, see src.datamodule.collate.pad_collate.
+            each example's loss is then taken over its own samples only and averaged
+        """
+        if lengths is not None and bool((lengths < input.size(-1)).any()):
+            losses = [self.forward(input[i:i + 1, ..., :length],
+                                   target[i:i + 1, ..., :length] if target.dim() == input.dim() else target[i:i + 1],
+                                   None if dvec is None else dvec[i:i + 1])
+                      for i, length in enumerate(lengths.tolist())]
+            return torch.stack(losses).mean()
 
         if self.loss_type == 'STFTLoss' or \
                 self.loss_type == 'MelSTFTLoss' or \
@@ -243,23 +330,60 @@ class Losses:
             if input.device.type == 'mps':
                 input = input.to(self.device)
                 target = target.to(self.device)
-            return self.loss(input, target)
+            input, target = self.pad_to_min_length(input, target)
+            with self.timer.time(f'loss/{self.loss_type}'):
+                return self.full_precision(self.loss, input, target)
 
         elif self.loss_type == 'EMBLoss':
-            emb_loss = self.loss(input, target)  # dvec is from target
+            with self.timer.time('loss/emb'):
+                emb_loss = self.loss(input, target)  # dvec is from target
             return emb_loss*3000  # to compensate small number of mse emb loss
 
         elif self.loss_type == 'EMB_MSE_Loss':
-            emb_loss = self.loss_emb(input, dvec)
-            mse_loss = self.loss_mse(input, target)
+            with self.timer.time('loss/emb'):
+                emb_loss = self.loss_emb(input, dvec)
+            with self.timer.time('loss/mse'):
+                mse_loss = self.full_precision(self.loss_mse, input, target)
             return mse_loss + emb_loss
 
         elif self.loss_type == 'EMB_MR_Loss':
-            emb_loss = self.loss_emb(input, dvec)
+            with self.timer.time('loss/emb'):
+                emb_loss = self.loss_emb(input, dvec)
             if input.device.type == 'mps':
                 input = input.to(self.device)
                 target = target.to(self.device)
-            mr_loss = self.loss_mr(input, target)
+            input, target = self.pad_to_min_length(input, target)
+            with self.timer.time('loss/mr'):
+                mr_loss = self.full_precision(self.loss_mr, input, target)
             return mr_loss + emb_loss*3000  # to compensate small number of mse emb loss
 
-        return self.loss(input, target)
+        with self.timer.time(f'loss/{self.loss_type}'):
+            return self.full_precision(self.loss, input, target)
+
+    def min_length(self):
+        """
+        shortest input the spectral losses accept, shorter examples are zero padded to it
+        """
+        if self.loss_type == 'RandomResolutionSTFTLoss':
+            return self.loss.max_fft_size // 2 + 1
+        if self.loss_type == 'EMB_MR_Loss':
+            return self.loss_mr.min_length()
+        if isinstance(getattr(self, 'loss', None), SpectralLossEngine):
+            return self.loss.min_length()
+        return 1
+
+    def pad_to_min_length(self, input, target):
+        pad = self.min_length() - input.size(-1)
+        if pad <= 0:
+            return input, target
+        input = torch.nn.functional.pad(input, (0, pad))
+        if target.dim() == input.dim():
+            target = torch.nn.functional.pad(target, (0, pad))
+        return input, target
+
+    def full_precision(self, loss, input, target):
+        # logs, eps and energy ratios are not safe in fp16/bf16, compute the loss in fp32 under autocast.
+        # the embedding losses handle this themselves, see SpeakerEmbeddingExtractor
+        autocast_device = 'cuda' if input.is_cuda else 'cpu'
+        with torch.autocast(device_type=autocast_device, enabled=False):
+            return loss(input.float(), target.float())
@@ -0,0 +1,69 @@
+import json
+import hashlib
+from pathlib import Path
+
+
+def config_hash(values):
+    """
+    hash of a config subset, e.g. {'sr': 44100, 'clip_interval_ms': 5000}
+    """
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def combine_hash(*hashes):
+    return hashlib.sha1('/'.join(hashes).encode()).hexdigest()
+
+
+class Manifest:
+    """
+    Records what a data preparation stage built, so a rerun only rebuilds what changed.
+    Each entry holds the key of its inputs (content hashes and config subset) and the files it wrote.
+    File hashes are remembered with size and mtime, unchanged files are not read again.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self.file_hashes = {}
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            self.entries = manifest['entries']
+            self.file_hashes = manifest['file_hashes']
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'entries': self.entries, 'file_hashes': self.file_hashes}, f, indent=1)
+        tmp_path.replace(self.path)
+
+    def file_hash(self, path):
+        path = Path(path)
+        stat = path.stat()
+        known = self.file_hashes.get(path.as_posix())
+        if known is not None and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha1']
+
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        self.file_hashes[path.as_posix()] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                             'sha1': sha1.hexdigest()}
+        return sha1.hexdigest()
+
+    def is_built(self, name, key):
+        # built with the same inputs and every output still there
+        entry = self.entries.get(name)
+        return entry is not None and entry['key'] == key and \
+            all(Path(output).exists() for output in entry['outputs'])
+
+    def record(self, name, key, outputs, **info):
+        self.entries[name] = {'key': key, 'outputs': [Path(output).as_posix() for output in outputs], **info}
+
+    def remove(self, name):
+        # deletes the entry's outputs too
+        entry = self.entries.pop(name)
+        for output in entry['outputs']:
+            Path(output).unlink(missing_ok=True)
+            self.file_hashes.pop(output, None)
@@ -0,0 +1,75 @@
+import torch
+import warnings
+from omegaconf import DictConfig
+
+autocast_dtypes = {'bf16-mixed': torch.bfloat16,
+                   '16-mixed': torch.float16}
+
+
+def apply_perf_settings(perf_cfg: DictConfig):
+    """
+    process wide backend settings from the training.perf config group
+    """
+    torch.backends.cudnn.benchmark = perf_cfg.cudnn_benchmark
+    torch.set_float32_matmul_precision(perf_cfg.matmul_precision)
+
+
+def trainer_perf_kwargs(perf_cfg: DictConfig):
+    """
+    pl.Trainer arguments from the training.perf config group.
+    lightning takes care of autocast, and of gradient scaling for 16-mixed
+    """
+    return {'precision': perf_cfg.precision,
+            'benchmark': perf_cfg.cudnn_benchmark}
+
+
+def compile_model(model, perf_cfg: DictConfig):
+    """
+    compiles the whole lightning module, so every model gets the same treatment
+    """
+    if not perf_cfg.compile:
+        return model
+    return torch.compile(model, mode=perf_cfg.compile_mode, dynamic=perf_cfg.compile_dynamic)
+
+
+def check_loss_precision(losses, precision, device='cpu', block_size=16384, emb_size=256,
+                         batch_size=2, rtol=0.05):
+    """
+    Evaluates the loss on synthetic audio in full precision and under the autocast of `precision`,
+    with the prediction in the reduced dtype as a model output would be.
+    Raises ValueError if the reduced precision loss is not finite or drifts from full precision.
+    :param losses: src.utils.losses.Losses
+    :param precision: lightning precision string
+    :param device: accelerator name, e.g. 'cuda', 'cpu', 'mps'
+    """
+    dtype = autocast_dtypes.get(precision)
+    if dtype is None:
+        return  # full precision
+
+    device = torch.device(device)
+    if device.type not in ('cuda', 'cpu'):
+        warnings.warn(f"autocast is not available on {device.type}, skipping loss precision check")
+        return
+
+    generator = torch.Generator().manual_seed(0)
+    target = torch.randn(batch_size, 1, block_size, generator=generator) * 0.5
+    pred = target + 0.1 * torch.randn(batch_size, 1, block_size, generator=generator)
+    dvec = torch.randn(batch_size, emb_size, generator=generator)
+    dvec = dvec / torch.norm(dvec, p=2, dim=1, keepdim=True)
+    target, pred, dvec = target.to(device), pred.to(device), dvec.to(device)
+
+    if losses.loss_type == 'EMBLoss':
+        target = dvec  # compared against the target speaker embedding only
+
+    with torch.no_grad():
+        loss_full = losses.forward(pred, target, dvec)
+        with torch.autocast(device_type=device.type, dtype=dtype):
+            loss_reduced = losses.forward(pred.to(dtype), target, dvec)
+
+    if not torch.isfinite(loss_reduced):
+        raise ValueError(f"{losses.loss_type} is not finite under {precision}: {loss_reduced.item()}")
+
+    drift = (loss_reduced.float() - loss_full.float()).abs() / (loss_full.float().abs() + 1e-8)
+    if drift > rtol:
+        raise ValueError(f"{losses.loss_type} drifts by {drift.item():.2%} under {precision}, "
+                         f"({loss_reduced.item()} vs {loss_full.item()})")
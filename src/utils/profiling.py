@@ -0,0 +1,110 @@
+import time
+import queue
+import torch
+import numpy as np
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+class StageTimer:
+    """
+    Collects wall clock durations per named stage.
+    Dataloader workers hold a copy of the timer, they flush their timings into the shared queue
+    and the training process collects them. Disabled timers cost one attribute check per stage.
+    """
+    def __init__(self, enabled=True, queue=None, sync_cuda=False):
+        self.enabled = enabled
+        self.queue = queue
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()  # async cuda work is waited for at the edges
+        self.timings = defaultdict(list)
+
+    def _now(self):
+        # cuda can not be initialised in a forked dataloader worker, workers never sync
+        if self.sync_cuda and torch.utils.data.get_worker_info() is None:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def worker_timer(self):
+        """
+        a copy for the datasets, it never syncs cuda and flushes into the same queue
+        """
+        return StageTimer(enabled=self.enabled, queue=self.queue, sync_cuda=False)
+
+    def time(self, stage):
+        if not self.enabled:
+            return nullcontext()
+        return self._time(stage)
+
+    @contextmanager
+    def _time(self, stage):
+        start = self._now()
+        try:
+            yield
+        finally:
+            self.timings[stage].append(self._now() - start)
+
+    def add(self, stage, seconds):
+        if self.enabled:
+            self.timings[stage].append(seconds)
+
+    def flush(self):
+        # worker side, hand the timings over to the training process. dropped if nobody is collecting
+        if not self.enabled or self.queue is None or len(self.timings) == 0:
+            return
+        try:
+            self.queue.put_nowait(dict(self.timings))
+        except queue.Full:
+            pass
+        self.timings = defaultdict(list)
+
+    def collect(self):
+        """
+        returns all timings recorded here and flushed by workers since the last collect, {stage: [seconds]}
+        """
+        timings = self.timings
+        self.timings = defaultdict(list)
+        if self.queue is not None:
+            while True:
+                try:
+                    worker_timings = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                for stage, durations in worker_timings.items():
+                    timings[stage] += durations
+        return timings
+
+
+class ForwardTimer:
+    """
+    times a module's forward through hooks, picklable so it can be sent to spawned dataloader workers
+    """
+    def __init__(self, timer: StageTimer, stage):
+        self.timer = timer
+        self.stage = stage
+        self.start = None
+
+    def pre_hook(self, module, args):
+        self.start = self.timer._now()
+
+    def post_hook(self, module, args, output):
+        self.timer.add(self.stage, self.timer._now() - self.start)
+
+
+def add_forward_timer(module, timer: StageTimer, stage):
+    forward_timer = ForwardTimer(timer, stage)
+    return [module.register_forward_pre_hook(forward_timer.pre_hook),
+            module.register_forward_hook(forward_timer.post_hook)]
+
+
+def stage_percentiles(timings, percentiles=(50, 90, 99), prefix='profile/'):
+    """
+    {stage: [seconds]} to flat {prefix + stage_p50_ms: value} metrics
+    """
+    metrics = {}
+    for stage, durations in timings.items():
+        if len(durations) == 0:
+            continue
+        values = np.percentile(np.array(durations) * 1000, percentiles)
+        for percentile, value in zip(percentiles, values):
+            metrics[f"{prefix}{stage}_p{percentile}_ms"] = float(value)
+    return metrics
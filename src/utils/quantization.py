@@ -0,0 +1,124 @@
+import time
+import torch
+import torchaudio
+import librosa
+import numpy as np
+import pandas as pd
+import onnxruntime as ort
+from pathlib import Path
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static)
+from src.utils.losses import Losses
+from src.datamodule.clip_manifest import ClipManifest
+
+
+def quantized_filename(onnx_filename, mode):
+    onnx_filename = Path(onnx_filename)
+    return (onnx_filename.parent / f"{onnx_filename.stem}.int8_{mode}{onnx_filename.suffix}").as_posix()
+
+
+def quantize_onnx_dynamic(onnx_filename, output_filename):
+    """
+    int8 weights, activations quantized on the fly. Suits the lstm/linear heavy speaker models and embedder,
+    where the weights dominate and there is nothing to calibrate.
+    """
+    quantize_dynamic(model_input=onnx_filename,
+                     model_output=output_filename,
+                     op_types_to_quantize=['LSTM', 'MatMul', 'Gemm'],
+                     weight_type=QuantType.QInt8)
+    return output_filename
+
+
+def quantize_onnx_static(onnx_filename, output_filename, calibration_reader):
+    """
+    int8 weights and activations as QDQ pairs, activation ranges calibrated on real clips.
+    Suits the conv models, where the activations dominate.
+    """
+    quantize_static(model_input=onnx_filename,
+                    model_output=output_filename,
+                    calibration_data_reader=calibration_reader,
+                    quant_format=QuantFormat.QDQ,
+                    per_channel=True,
+                    activation_type=QuantType.QInt8,
+                    weight_type=QuantType.QInt8)
+    return output_filename
+
+
+def load_clips(data_path, ext, block_size, num_clips, emb_size=None):
+    """
+    Loads up to num_clips processed clips, centre cropped or padded to block_size, as onnx feeds.
+    Speaker models take the d-vectors from the split's clip manifest.
+    :param data_path: split folder of the processed dataset, e.g. data/processed/nus/val
+    """
+    data_path = Path(data_path)
+    if emb_size is None:
+        files = librosa.util.find_files(data_path, ext=ext)[:num_clips]
+        dvecs = [None] * len(files)
+    else:
+        clips = ClipManifest(data_path)
+        files = clips['x'][:num_clips].tolist()
+        dvecs = [clips.dvec(row).numpy().reshape(1, emb_size) for row in range(0, len(files))]
+
+    assert len(files) > 0, f"no clips found in {data_path}"
+
+    feeds = []
+    for file, dvec in zip(files, dvecs):
+        waveform, _ = torchaudio.load(file)
+        waveform = waveform[:1]  # mono
+        if waveform.size(1) > block_size:
+            start = (waveform.size(1) - block_size) // 2
+            waveform = waveform[:, start:start + block_size]
+        else:
+            waveform = torch.nn.functional.pad(waveform, (0, block_size - waveform.size(1)))
+
+        feed = {'input1': waveform.unsqueeze(0).numpy()}  # [1, 1, block_size]
+        if dvec is not None:
+            feed['dvec'] = dvec
+        feeds.append(feed)
+
+    return feeds
+
+
+class ClipCalibrationReader(CalibrationDataReader):
+    def __init__(self, feeds):
+        self.feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self.feeds, None)
+
+
+def compare_onnx_variants(variants, feeds, reference='fp32', latency_runs=10):
+    """
+    Runs every onnx variant on the feeds on cpu, reports SNR and ESR of each against the reference variant
+    using the project's losses, and the median latency and throughput per clip.
+    :param variants: dict of name to onnx filename
+    """
+    snr_loss = Losses(loss_type='SNRLoss')
+    esr_loss = Losses(loss_type='ESRLoss')
+
+    sessions = {name: ort.InferenceSession(filename, providers=['CPUExecutionProvider'])
+                for name, filename in variants.items()}
+    outputs = {name: [session.run(None, feed)[0] for feed in feeds] for name, session in sessions.items()}
+    reference_out = torch.from_numpy(np.concatenate(outputs[reference]))
+
+    rows = []
+    for name, session in sessions.items():
+        variant_out = torch.from_numpy(np.concatenate(outputs[name]))
+
+        feed = feeds[0]
+        session.run(None, feed)  # warm up
+        timings = []
+        for _ in range(0, latency_runs):
+            start = time.perf_counter()
+            session.run(None, feed)
+            timings.append(time.perf_counter() - start)
+        latency = float(np.median(timings))
+
+        rows.append({'variant': name,
+                     'snr_db': -snr_loss.forward(variant_out, reference_out).item(),
+                     'esr': esr_loss.forward(variant_out, reference_out).item(),
+                     'latency_ms': latency * 1000,
+                     'samples_per_sec': feed['input1'].shape[-1] / latency,
+                     'size_mb': Path(variants[name]).stat().st_size / 1e6})
+
+    return pd.DataFrame(rows)
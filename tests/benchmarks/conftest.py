@@ -0,0 +1,63 @@
+import pytest
+import torch
+import torchaudio
+import pandas as pd
+from pathlib import Path
+from hydra import compose, initialize
+from src.model.nets.autoencoder1d import AutoEncoder1d, AutoEncoder1dConfig
+from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder
+
+# synthetic audio only, everything runs on cpu
+NUM_SPEAKERS = 4
+CLIPS_PER_SPEAKER = 4
+CLIP_SECONDS = 5.0
+
+
+@pytest.fixture(scope='session')
+def cfg():
+    with initialize(version_base=None, config_path='../../conf'):
+        cfg = compose(config_name='config', overrides=['training.accelerator=cpu'])
+    return cfg
+
+
+@pytest.fixture(scope='session')
+def clips_dir(tmp_path_factory, cfg):
+    """
+    speaker folders of white noise clips, laid out like data/processed/<dataset>/<split>
+    """
+    data_path = tmp_path_factory.mktemp('clips')
+    sample_rate = cfg.dataset.sample_rate
+    generator = torch.Generator().manual_seed(0)
+    for speaker in range(0, NUM_SPEAKERS):
+        speaker_path = data_path / f"speaker_{speaker}"
+        speaker_path.mkdir()
+        for clip in range(0, CLIPS_PER_SPEAKER):
+            waveform = (torch.rand(1, int(sample_rate * CLIP_SECONDS), generator=generator) - 0.5) * 0.5
+            torchaudio.save((speaker_path / f"clip_{clip}.wav").as_posix(), waveform, sample_rate)
+    return data_path
+
+
+@pytest.fixture(scope='session')
+def clips_df(clips_dir):
+    x_files = sorted(str(file) for file in clips_dir.glob('*/*.wav'))
+    df = pd.DataFrame({'x': x_files, 'speaker_name': [Path(file).parent.name for file in x_files]})
+    df['related_speakers'] = [df.index[(df['speaker_name'] == speaker_name) & (df.index != index)].tolist()
+                              for index, speaker_name in zip(df.index, df['speaker_name'])]
+    return df
+
+
+@pytest.fixture(scope='session')
+def embedder_path(tmp_path_factory):
+    # randomly initialised, only the speed matters here
+    torch.manual_seed(0)
+    path = tmp_path_factory.mktemp('embedder') / 'embedder.pt'
+    torch.save(SpeechEmbedder().state_dict(), path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def ae_path(tmp_path_factory):
+    # a small autoencoder, the speaker models' fuse_embedding only depends on its channel count
+    path = tmp_path_factory.mktemp('ae')
+    AutoEncoder1d(AutoEncoder1dConfig(multipliers=[1, 1], factors=[2], num_blocks=[1])).save_pretrained(path)
+    return path
@@ -0,0 +1,124 @@
+import copy
+import pickle
+import pytest
+import torch
+import numpy as np
+import soundfile as sf
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from omegaconf import open_dict
+from torch_audiomentations import Compose
+from src.datamodule.audio_dataloader import AudioDataset
+from src.datamodule.audio_datamodule import AudioDataModule
+from src.datamodule.clip_manifest import ClipManifest
+from src.datamodule.augmentations.custom_pitchshift import PitchShift_Slow
+from src.datamodule.augmentations.random_crop import RandomCrop
+
+# augmentation switch and its probability key in conf/augmentations
+AUGMENTATIONS = {'gain': 'gain_p',
+                 'polarity_inv': 'polarity_p',
+                 'pitchshift': 'pitchshift_p',
+                 'colored_noise': 'colored_noise_p',
+                 'gain_indep': 'gain_p_indep',
+                 'timeshift_indep': 'timeshift_p_indep',
+                 'pitchshift_indep': 'pitchshift_p_indep',
+                 'low_pass_x': 'low_pass_p_x'}
+
+
+def augmentation_cfg(cfg, augmentation):
+    # only the one augmentation, always applied
+    cfg = copy.deepcopy(cfg)
+    with open_dict(cfg):
+        for name, p_key in AUGMENTATIONS.items():
+            cfg.augmentations[f"do_{name}"] = name == augmentation
+            if name == augmentation:
+                cfg.augmentations[p_key] = 1.0
+    return cfg
+
+
+@pytest.mark.parametrize('augmentation', ['none'] + list(AUGMENTATIONS.keys()))
+def test_dataset_getitem(benchmark, cfg, clips_df, augmentation):
+    dataset = AudioDataset(clips_df, cfg=augmentation_cfg(cfg, augmentation), do_augmentation=True)
+    torch.manual_seed(0)
+
+    def load_all():
+        for idx in range(0, len(dataset)):
+            dataset[idx]
+
+    benchmark.extra_info['clips'] = len(dataset)
+    benchmark.pedantic(load_all, rounds=3, warmup_rounds=1)
+
+
+def test_pitchshift_slow(benchmark, cfg):
+    apply_augmentation = Compose([PitchShift_Slow(min_transpose_semitones=-0.5,
+                                                  max_transpose_semitones=0.5,
+                                                  p=1.0,
+                                                  sample_rate=cfg.dataset.sample_rate,
+                                                  p_mode='per_example')])
+    audio_samples = torch.rand(size=(2, 1, cfg.dataset.block_size)) - 0.5
+
+    benchmark.pedantic(apply_augmentation, args=(audio_samples,),
+                       kwargs={'sample_rate': cfg.dataset.sample_rate}, rounds=3, warmup_rounds=1)
+
+
+def test_random_crop(benchmark, cfg):
+    crop = RandomCrop(max_length=cfg.dataset.block_size,
+                      sampling_rate=cfg.dataset.sample_rate,
+                      max_length_unit='samples')
+    audio_samples = torch.rand(size=(2, 1, int(cfg.dataset.sample_rate * 5.0))) - 0.5
+
+    benchmark(crop, audio_samples, sampling_rate=cfg.dataset.sample_rate)
+
+
+@pytest.fixture(scope='module', params=[10_000, 100_000], ids=['10k', '100k'])
+def large_split_dir(request, tmp_path_factory):
+    # tiny wavs are enough, form_dataframe only reads their headers. 50 clips per speaker as in nus
+    num_rows = request.param
+    data_path = tmp_path_factory.mktemp(f"split_{num_rows}")
+    header_path = data_path / 'header.wav'
+    sf.write(header_path, np.zeros(16, dtype=np.float32), 44100, subtype='PCM_16')
+    wav_bytes = header_path.read_bytes()
+    clips_per_speaker = 50
+    for speaker in range(0, num_rows // clips_per_speaker):
+        speaker_path = data_path / f"speaker_{speaker}"
+        speaker_path.mkdir()
+        for clip in range(0, clips_per_speaker):
+            (speaker_path / f"clip_{clip}.wav").write_bytes(wav_bytes)
+    return data_path, num_rows
+
+
+def test_form_dataframe(benchmark, cfg, large_split_dir):
+    data_path, num_rows = large_split_dir
+    dm = AudioDataModule(data_dir=Path(data_path), cfg=cfg)
+
+    df = benchmark.pedantic(dm.form_dataframe, args=(data_path,), rounds=1, iterations=1)
+    assert len(df) == num_rows
+
+
+@pytest.fixture(scope='module', params=[10_000, 100_000], ids=['10k', '100k'])
+def large_manifest_dir(request, tmp_path_factory):
+    # a clips.parquet and dvecs.npy as cache_dataset.py writes them, without the clips
+    num_rows = request.param
+    data_path = tmp_path_factory.mktemp(f"manifest_{num_rows}")
+    speaker_names = [f"speaker_{row // 50}" for row in range(0, num_rows)]
+    pq.write_table(pa.table({'x': [f"{name}/clip_{row % 50}.wav" for row, name in enumerate(speaker_names)],
+                             'speaker': pa.array([row // 50 for row in range(0, num_rows)], type=pa.int32()),
+                             'speaker_name': speaker_names,
+                             'num_frames': pa.array([220500] * num_rows, type=pa.int64()),
+                             'dvec_row': pa.array(np.arange(num_rows), type=pa.int32())}),
+                   data_path / 'clips.parquet')
+    np.save(data_path / 'dvecs.npy', np.random.default_rng(0).normal(size=(num_rows, 256)).astype(np.float32))
+    return data_path, num_rows
+
+
+def test_clip_manifest_columns(benchmark, large_manifest_dir):
+    data_path, num_rows = large_manifest_dir
+
+    def load_columns():
+        # what a dataloader worker reads before its first sample
+        clips = ClipManifest(data_path)
+        return clips['x'], clips['speaker_name'], clips['speaker'], clips.dvec(0)
+
+    benchmark.pedantic(load_columns, rounds=3, iterations=1)
+    benchmark.extra_info['worker_pickle_bytes'] = len(pickle.dumps(ClipManifest(data_path)))
@@ -0,0 +1,50 @@
+import copy
+import pytest
+import torch
+from omegaconf import open_dict
+from hydra import compose, initialize
+from src.utils.losses import Losses
+
+BATCH_SIZE = 4
+BLOCK_SIZE = 16384
+
+LOSS_TYPES = ['error_to_signal', 'ESRLoss', 'DCLoss', 'LogCoshLoss', 'SNRLoss', 'SDSDRLoss', 'MSELoss',
+              'STFTLoss', 'MelSTFTLoss', 'MultiResolutionSTFTLoss', 'RandomResolutionSTFTLoss',
+              'DC_SDSDR_SNR_Loss', 'ESR_DC_Loss', 'EMBLoss', 'EMB_MSE_Loss', 'EMB_MR_Loss']
+
+
+@pytest.fixture(scope='module')
+def loss_cfg(cfg, embedder_path):
+    # the embedding losses read the mr resolutions from the training loss config
+    with initialize(version_base=None, config_path='../../conf'):
+        cfg = compose(config_name='config', overrides=['training.accelerator=cpu', 'training/loss=mr_loss'])
+    with open_dict(cfg):
+        cfg.model.embedder_path = str(embedder_path)
+    return cfg
+
+
+@pytest.mark.parametrize('loss_type', LOSS_TYPES)
+def test_loss_forward_backward(benchmark, loss_cfg, loss_type):
+    if loss_type.startswith('EMB'):
+        loss = Losses(loss_type=loss_type, sample_rate=loss_cfg.dataset.sample_rate, cfg=copy.deepcopy(loss_cfg))
+    else:
+        loss = Losses(loss_type=loss_type, sample_rate=loss_cfg.dataset.sample_rate)
+
+    # random resolutions go up to 32768 point ffts, the embedder needs at least one 0.8s lstm window
+    if loss_type == 'RandomResolutionSTFTLoss' or loss_type.startswith('EMB'):
+        block_size = 65536
+    else:
+        block_size = BLOCK_SIZE
+
+    generator = torch.Generator().manual_seed(0)
+    target = torch.randn(BATCH_SIZE, 1, block_size, generator=generator) * 0.5
+    pred = (target + 0.1 * torch.randn(BATCH_SIZE, 1, block_size, generator=generator)).requires_grad_()
+    dvec = torch.nn.functional.normalize(torch.randn(BATCH_SIZE, 256, generator=generator), dim=1)
+    if loss_type == 'EMBLoss':
+        target = dvec  # compared against the target speaker embedding only
+
+    def forward_backward():
+        pred.grad = None
+        loss.forward(pred, target, dvec).backward()
+
+    benchmark.pedantic(forward_backward, rounds=5, warmup_rounds=1)
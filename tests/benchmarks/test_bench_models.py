@@ -0,0 +1,64 @@
+import pytest
+import torch
+from omegaconf import OmegaConf
+from src.model.nets.wavenet import WaveNet
+from src.model.nets.waveunet import WaveUNet
+from src.model.nets.autoencoder_speaker import AutoEncoder_Speaker
+from src.model.nets.autoencoder_speaker2 import AutoEncoder_Speaker2
+from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder
+
+BATCH_SIZE = 4
+BLOCK_SIZE = 16384  # divisible by waveunet's 2^12 downsampling
+
+
+def forward_backward(model, *inputs):
+    model.zero_grad(set_to_none=True)
+    out = model(*inputs)
+    out.square().mean().backward()
+
+
+def test_wavenet(benchmark):
+    torch.manual_seed(0)
+    model = WaveNet(num_channels=4, dilation_depth=9, num_repeat=2, kernel_size=3)
+    x = torch.randn(BATCH_SIZE, 1, BLOCK_SIZE)
+    benchmark(forward_backward, model, x)
+
+
+def test_waveunet(benchmark):
+    torch.manual_seed(0)
+    model = WaveUNet(n_layers=12, channels_interval=24)
+    x = torch.randn(BATCH_SIZE, 1, BLOCK_SIZE)
+    benchmark.pedantic(forward_backward, args=(model, x), rounds=5, warmup_rounds=1)
+
+
+@pytest.mark.parametrize('model_class, latent_slice_size', [(AutoEncoder_Speaker, 128),
+                                                            (AutoEncoder_Speaker2, 1024)])
+def test_fuse_embedding(benchmark, ae_path, model_class, latent_slice_size):
+    # latent slice sizes as in conf/model, z is the encoder output of a 131072 sample block
+    cfg = OmegaConf.create({'model': {'ae_path': str(ae_path),
+                                      'freeze_encoder': True,
+                                      'freeze_decoder': False,
+                                      'bottleneck_dropout': 0.0,
+                                      'emb_size': 256,
+                                      'latent_slice_size': latent_slice_size,
+                                      'lstm_layers': 1}})
+    torch.manual_seed(0)
+    model = model_class(cfg)
+    z = torch.randn(BATCH_SIZE, model.autoencoder.config.channels, 131072 // 32)
+    dvec = torch.randn(BATCH_SIZE, 256)
+
+    def fuse_backward():
+        model.zero_grad(set_to_none=True)
+        model.fuse_embedding(z, dvec).square().mean().backward()
+
+    benchmark.pedantic(fuse_backward, rounds=5, warmup_rounds=1)
+
+
+def test_embedder_batched_forward(benchmark):
+    torch.manual_seed(0)
+    embedder = SpeechEmbedder()
+    embedder.eval()
+    mel = torch.randn(BATCH_SIZE, 40, 301)  # 3s of mel frames at 16kHz
+
+    with torch.no_grad():
+        benchmark(embedder.batched_forward, mel)
@@ -0,0 +1,61 @@
+import copy
+import itertools
+import pytest
+import soundfile as sf
+from pathlib import Path
+from omegaconf import open_dict
+from torch.utils.data import DataLoader
+from src.datamodule.audio_dataloader import AudioDataset
+from src.utils.audio_storage import STORAGE_ENCODINGS, load_audio
+
+# bytes on disk, decode time per clip and loader throughput of each processed clip encoding
+
+
+@pytest.fixture(scope='module', params=list(STORAGE_ENCODINGS.keys()))
+def encoded_df(request, tmp_path_factory, clips_df):
+    encoding = request.param
+    file_format, subtype, ext = STORAGE_ENCODINGS[encoding]
+    data_path = tmp_path_factory.mktemp(encoding)
+    x_files = []
+    for x_file in clips_df['x']:
+        data, sr = sf.read(x_file, dtype='float32')
+        target_file = data_path / Path(x_file).parent.name / (Path(x_file).stem + '.' + ext)
+        target_file.parent.mkdir(exist_ok=True)
+        sf.write(target_file, data, sr, format=file_format, subtype=subtype)
+        x_files.append(str(target_file))
+    df = clips_df.copy()
+    df['x'] = x_files
+    return encoding, df
+
+
+def storage_info(benchmark, encoding, df):
+    benchmark.extra_info['encoding'] = encoding
+    benchmark.extra_info['clips'] = len(df)
+    benchmark.extra_info['bytes_on_disk'] = sum(Path(x_file).stat().st_size for x_file in df['x'])
+
+
+@pytest.mark.parametrize('backend', [None, 'soundfile', 'sox_io'])
+def test_decode(benchmark, encoded_df, backend):
+    encoding, df = encoded_df
+    storage_info(benchmark, encoding, df)
+    x_files = itertools.cycle(df['x'])
+
+    # one clip per call, the reported times are per clip
+    benchmark(lambda: load_audio(next(x_files), backend))
+
+
+@pytest.mark.parametrize('backend', [None, 'soundfile'])
+def test_loader_throughput(benchmark, cfg, encoded_df, backend):
+    encoding, df = encoded_df
+    storage_info(benchmark, encoding, df)
+    cfg = copy.deepcopy(cfg)
+    with open_dict(cfg):
+        cfg.dataset.audio_backend = backend
+    loader = DataLoader(AudioDataset(df, cfg=cfg, do_augmentation=False), batch_size=4, num_workers=0)
+
+    def load_all():
+        for _ in loader:
+            pass
+
+    # clips per second is clips / mean
+    benchmark.pedantic(load_all, rounds=3, warmup_rounds=1)
@@ -0,0 +1,54 @@
+import pytest
+import numpy as np
+import soundfile as sf
+from pathlib import Path
+from hydra import compose, initialize
+
+
+def pytest_addoption(parser):
+    parser.addoption('--run-benchmarks', action='store_true', default=False,
+                     help="run the speed benchmarks in tests/benchmarks, skipped otherwise")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-benchmarks'):
+        return
+    skip_benchmark = pytest.mark.skip(reason="speed benchmark, run with --run-benchmarks")
+    for item in items:
+        if 'benchmark' in getattr(item, 'fixturenames', ()):
+            item.add_marker(skip_benchmark)
+
+
+@pytest.fixture
+def cfg(request):
+    """
+    conf/config.yaml, composed with the overrides given by indirect parametrization, e.g.
+    @pytest.mark.parametrize('cfg', [['model=autoencoder_speaker']], indirect=True)
+    """
+    overrides = getattr(request, 'param', ())
+    with initialize(version_base=None, config_path='../conf'):
+        return compose(config_name='config', overrides=list(overrides))
+
+
+@pytest.fixture
+def split_dir(tmp_path):
+    """
+    Factory writing tiny 44.1kHz pcm16 wav clips into the speaker folders of a split, <split>/<speaker>/<i>.wav.
+    make(split_path, speakers, num_clips, waveform), waveform(row, i) returns the samples of the clip at row of the
+    split and index i of its speaker, noise of 44100 + i samples by default.
+    :return: the clip files and their speaker names, in the order of speakers
+    """
+    def make(split_path=tmp_path, speakers=('a', 'b'), num_clips=2, waveform=None):
+        rng = np.random.default_rng(0)
+        if waveform is None:
+            waveform = lambda row, i: rng.uniform(-0.5, 0.5, 44100 + i)
+        x_files, speaker_names = [], []
+        for speaker in speakers:
+            (Path(split_path) / speaker).mkdir(parents=True, exist_ok=True)
+            for i in range(0, num_clips):
+                x_file = (Path(split_path) / speaker / f"{i}.wav").as_posix()
+                sf.write(x_file, np.asarray(waveform(len(x_files), i), dtype=np.float32), 44100, subtype='PCM_16')
+                x_files.append(x_file)
+                speaker_names.append(speaker)
+        return x_files, speaker_names
+    return make
@@ -0,0 +1,34 @@
+import pytest
+import torch
+import numpy as np
+from pydub import AudioSegment
+from src.utils.audio_storage import STORAGE_ENCODINGS, export_segment, load_audio, storage_ext
+
+
+def make_segment(sample_rate=44100, seconds=0.5):
+    rng = np.random.default_rng(0)
+    samples = (rng.uniform(-0.5, 0.5, int(sample_rate * seconds)) * 2 ** 31).astype(np.int32)
+    return AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=4, channels=1), samples / 2 ** 31
+
+
+@pytest.mark.parametrize('encoding', list(STORAGE_ENCODINGS.keys()))
+@pytest.mark.parametrize('backend', [None, 'soundfile', 'sox_io'])
+def test_round_trip(tmp_path, encoding, backend):
+    segment, samples = make_segment()
+    target_file = export_segment(segment, tmp_path / 'clip.wav', encoding)
+    assert target_file.suffix == '.' + storage_ext(encoding)
+
+    waveform, sr = load_audio(target_file, backend)
+    assert sr == 44100
+    assert waveform.dtype == torch.float32
+    assert waveform.shape == (1, len(samples))
+    # 16 bit encodings are quantized
+    atol = 1e-4 if STORAGE_ENCODINGS[encoding][1] == 'PCM_16' else 1e-6
+    np.testing.assert_allclose(waveform[0].numpy(), samples, atol=atol)
+
+
+def test_pcm16_is_half_of_float32(tmp_path):
+    segment, _ = make_segment()
+    pcm16 = export_segment(segment, tmp_path / 'pcm16.wav', 'pcm16')
+    float32 = export_segment(segment, tmp_path / 'float32.wav', 'float32')
+    assert pcm16.stat().st_size < 0.51 * float32.stat().st_size
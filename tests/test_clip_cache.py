@@ -0,0 +1,87 @@
+import os
+import pytest
+import pickle
+import time
+import torch
+import torchaudio
+import numpy as np
+import pandas as pd
+from src.datamodule.audio_dataloader import AudioDataset
+from src.datamodule.clip_cache import SharedClipCache
+from src.datamodule.audio_datamodule import AudioDataModule
+
+
+def test_cached_clip_matches_decoded(tmp_path, split_dir):
+    x_file = split_dir(speakers=('a',), num_clips=1)[0][0]
+    cache = SharedClipCache(tmp_path / 'cache')
+    decoded = cache.load(x_file)
+    assert cache.cache_file(x_file).exists()
+
+    # a worker gets a pickled copy and reads the same file
+    cached = pickle.loads(pickle.dumps(cache)).load(x_file)
+    assert torch.equal(cached, decoded)
+    assert torch.equal(cached, torchaudio.load(x_file)[0])
+
+    # a rewritten clip is decoded again
+    time.sleep(0.01)
+    torchaudio.save(x_file, torch.zeros(1, 100), 44100)
+    assert cache.load(x_file).shape == (1, 100)
+
+
+def test_cache_key_and_clear(tmp_path, split_dir):
+    x_file = split_dir(speakers=('a',), num_clips=1)[0][0]
+    cache = SharedClipCache(tmp_path / 'cache', backend='soundfile', storage_encoding='pcm16')
+    cache.load(x_file)
+    # clips decoded by another backend or stored with another encoding are not served
+    assert SharedClipCache(tmp_path / 'cache', backend='sox_io').cache_file(x_file) != cache.cache_file(x_file)
+    assert SharedClipCache(tmp_path / 'cache', backend='soundfile', storage_encoding='flac').cache_file(x_file) != \
+        cache.cache_file(x_file)
+
+    cache.clear()
+    assert not (tmp_path / 'cache').exists()
+    assert cache.load(x_file).shape == (1, 44100)
+
+
+@pytest.mark.parametrize('cfg', [['training.clip_cache.enabled=true']], indirect=True)
+def test_teardown_clears_cache(tmp_path, split_dir, cfg):
+    x_file = split_dir(speakers=('a',), num_clips=1)[0][0]
+    cfg.training.clip_cache.dir = (tmp_path / 'cache').as_posix()
+    dm = AudioDataModule(tmp_path, cfg=cfg)
+    dm.clip_cache.load(x_file)
+    cfg.training.clip_cache.keep = True
+    dm.teardown('fit')
+    assert dm.clip_cache.cache_file(x_file).exists()
+    cfg.training.clip_cache.keep = False
+    dm.teardown('fit')
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_evicts_least_recently_read(tmp_path, split_dir):
+    x_files, _ = split_dir(waveform=lambda row, i: np.zeros(44100))
+    clip_bytes = 44100 * 4
+    # room for 3 clips, evicts down to 90%
+    cache = SharedClipCache(tmp_path / 'cache', max_bytes=int(3.5 * clip_bytes))
+    for i, x_file in enumerate(x_files[:3]):
+        cache.load(x_file)
+        cache_file = cache.cache_file(x_file)
+        os.utime(cache_file, ns=(i * 10 ** 9, i * 10 ** 9))
+    cache.load(x_files[0])  # read again, most recent now
+
+    cache.load(x_files[3])
+    assert cache.size() <= 3.5 * clip_bytes
+    assert cache.cache_file(x_files[0]).exists()
+    assert not cache.cache_file(x_files[1]).exists()
+    assert cache.cache_file(x_files[3]).exists()
+
+
+@pytest.mark.parametrize('cfg', [['dataset.do_random_block=false']], indirect=True)
+def test_dataset_with_cache(tmp_path, split_dir, cfg):
+    x_files, speaker_names = split_dir()
+    df = pd.DataFrame({'x': x_files, 'speaker_name': speaker_names, 'related_speakers': [[1], [0], [3], [2]]})
+    cache = SharedClipCache(tmp_path / 'cache')
+    cache.warm(x_files)
+
+    dataset = AudioDataset(df, cfg=cfg)
+    cached_dataset = AudioDataset(df, cfg=cfg, clip_cache=cache)
+    for idx in range(0, len(df)):
+        assert torch.equal(cached_dataset[idx][0], dataset[idx][0])
@@ -0,0 +1,75 @@
+import pytest
+import pickle
+import torch
+import numpy as np
+import pandas as pd
+from src.datamodule.audio_dataloader import AudioDataset
+from src.datamodule.clip_manifest import ClipManifest, SpeakerCentroids, write_clip_manifest
+from src.datamodule.energy_index import build_energy_index
+
+
+SPEAKERS = ('b', 'a', 'c')
+
+
+def test_write_and_read(tmp_path, split_dir):
+    x_files, speaker_names = split_dir(speakers=SPEAKERS)
+    build_energy_index(tmp_path)
+    dvecs = np.random.default_rng(0).normal(size=(len(x_files), 256)).astype(np.float32)
+    write_clip_manifest(tmp_path, x_files, speaker_names, clip_keys=[str(i) for i in range(0, 6)], dvecs=dvecs)
+
+    clips = ClipManifest(tmp_path)
+    assert len(clips) == 6
+    assert clips['x'].tolist() == x_files
+    assert clips['speaker_name'].tolist() == speaker_names
+    assert clips['num_frames'].tolist() == [44100, 44101] * 3
+    assert np.all(clips['voiced_fraction'] == 1.0)
+    np.testing.assert_array_equal(clips.dvec(3).numpy(), dvecs[3])
+    assert clips.related(2).tolist() == [3]
+    assert clips.unrelated(2).tolist() == [0, 1, 4, 5]
+
+    # workers read the columns again instead of receiving them
+    state = pickle.loads(pickle.dumps(clips))
+    assert state.columns == {} and state.dvecs is None
+    np.testing.assert_array_equal(state.dvec(5).numpy(), dvecs[5])
+
+
+@pytest.mark.parametrize('cfg', [['model=autoencoder_speaker']], indirect=True)
+def test_dataset_from_manifest_and_dataframe(tmp_path, split_dir, cfg):
+    x_files, speaker_names = split_dir(speakers=SPEAKERS)
+    dvecs = np.random.default_rng(0).normal(size=(len(x_files), 256)).astype(np.float32)
+    write_clip_manifest(tmp_path, x_files, speaker_names, dvecs=dvecs)
+    df = pd.DataFrame({'x': x_files, 'speaker_name': speaker_names, 'dvec': list(dvecs)})
+
+    from_manifest = AudioDataset(ClipManifest(tmp_path), cfg=cfg)
+    from_dataframe = AudioDataset(df, cfg=cfg)
+    for idx in range(0, len(x_files)):
+        x, _, (own_dvec, target_dvec), (speaker_name, target_speaker_name) = from_manifest[idx]
+        assert torch.equal(x, from_dataframe[idx][0])
+        assert torch.equal(own_dvec, torch.from_numpy(dvecs[idx]))
+        assert speaker_name == speaker_names[idx] and target_speaker_name != speaker_name
+        assert torch.equal(target_dvec, from_dataframe[idx][2][1])
+
+
+@pytest.mark.parametrize('cfg', [['model=autoencoder_speaker']], indirect=True)
+def test_speaker_centroids(tmp_path, split_dir, cfg):
+    x_files, speaker_names = split_dir(speakers=SPEAKERS)
+    dvecs = np.random.default_rng(0).normal(size=(len(x_files), 256)).astype(np.float32)
+    write_clip_manifest(tmp_path, x_files, speaker_names, dvecs=dvecs)
+
+    centroids = SpeakerCentroids.load(tmp_path)
+    assert centroids.speaker_names == ['a', 'b', 'c'] and centroids.counts.tolist() == [2, 2, 2]
+    normalized = dvecs / np.linalg.norm(dvecs, axis=1, keepdims=True)
+    expected = normalized[0] + normalized[1]
+    np.testing.assert_allclose(centroids.centroid('b').numpy(), expected / np.linalg.norm(expected), rtol=1e-5)
+    assert {centroids.other_speaker('a') for _ in range(0, 50)} == {'b', 'c'}
+
+    # the same table from the manifest in memory
+    in_memory = SpeakerCentroids.from_manifest(ClipManifest(tmp_path))
+    assert torch.allclose(in_memory.centroids, centroids.centroids)
+
+    dataset = AudioDataset(ClipManifest(tmp_path), cfg=cfg, centroids=centroids)
+    for idx in range(0, len(x_files)):
+        _, _, (own_dvec, target_dvec), (speaker_name, target_speaker_name) = dataset[idx]
+        assert torch.equal(own_dvec, centroids.centroid(speaker_names[idx]))
+        assert torch.equal(target_dvec, centroids.centroid(target_speaker_name))
+        assert target_speaker_name != speaker_name
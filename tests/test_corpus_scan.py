@@ -0,0 +1,44 @@
+import pytest
+import torch
+import torchaudio
+import numpy as np
+from pathlib import Path
+from src.datamodule.audio_datamodule import AudioDataModule
+from src.utils.corpus_scan import scan_split, check_sample_rates
+
+
+def make_split(split_dir, split_path):
+    # two lengths of silence, with files that are not clips around them
+    split_dir(split_path, speakers=('b', 'a'), waveform=lambda row, i: np.zeros([1000, 2000][i]))
+    for speaker in ['b', 'a']:
+        (split_path / speaker / 'notes.txt').touch()
+    (split_path / 'energy_index.pkl').touch()
+
+
+def test_scan_split(tmp_path, split_dir):
+    make_split(split_dir, tmp_path)
+    x_files, speaker_names, headers = scan_split(tmp_path, ext='wav', num_workers=4)
+    assert [Path(x_file).relative_to(tmp_path).as_posix() for x_file in x_files] == \
+        ['a/0.wav', 'a/1.wav', 'b/0.wav', 'b/1.wav']
+    assert speaker_names == ['a', 'a', 'b', 'b']
+    assert [header['num_frames'] for header in headers] == [1000, 2000, 1000, 2000]
+    assert all(header['sample_rate'] == 44100 and header['channels'] == 1 for header in headers)
+
+
+@pytest.mark.parametrize('cfg', [['model=waveunet']], indirect=True)
+def test_sample_rate_checked_at_setup(tmp_path, split_dir, cfg):
+    for split in ['train', 'val']:
+        make_split(split_dir, tmp_path / split)
+    dm = AudioDataModule(data_dir=tmp_path, cfg=cfg)
+    dm.setup('fit')
+    assert dm.df_train['num_frames'].tolist() == [1000, 2000, 1000, 2000]
+
+    torchaudio.save((tmp_path / 'val' / 'a' / '1.wav').as_posix(), torch.zeros(1, 100), 22050)
+    with pytest.raises(ValueError, match='22050Hz'):
+        AudioDataModule(data_dir=tmp_path, cfg=cfg).setup('fit')
+
+
+def test_check_sample_rates():
+    check_sample_rates(['a.wav'], [44100], 44100)
+    with pytest.raises(ValueError):
+        check_sample_rates(['a.wav', 'b.wav'], [44100, 48000], 44100)
@@ -1,6 +1,9 @@
+import random
 import torch
+import torchaudio
 from torch_audiomentations import Compose
 from src.datamodule.augmentations.custom_pitchshift import PitchShift_Slow
+from src.datamodule.augmentations.pitch_bank import PitchBank, render_pitch_bank
 
 def test_custom_pitchshift():
     # a quick functionality test on the custom pitch shift for torch audiomentations
@@ -20,4 +23,102 @@ def test_custom_pitchshift():
 
     shifted_audio_samples = apply_augmentation(audio_sample, sample_rate=44100)
 
-    assert(torch.equal(audio_sample, shifted_audio_samples) is False)
\ No newline at end of file
+    assert(torch.equal(audio_sample, shifted_audio_samples) is False)
+
+def test_custom_pitchshift_cache(tmp_path):
+    # a repeated input and transposition is read back from the cache instead of shifted again
+    pitch_shift = PitchShift_Slow(min_transpose_semitones=-0.4,
+                                  max_transpose_semitones=-0.1,
+                                  p=1.0,
+                                  sample_rate=44100,
+                                  p_mode='per_example',
+                                  cache_dir=tmp_path)
+    apply_augmentation = Compose([pitch_shift])
+    audio_sample = torch.rand(size=(2, 1, 22050), dtype=torch.float32) - 0.5
+
+    torch.manual_seed(0)
+    random.seed(0)
+    shifted = apply_augmentation(audio_sample.clone(), sample_rate=44100)
+    assert len(list(tmp_path.glob('*/*.npy'))) == 2
+
+    torch.manual_seed(0)
+    random.seed(0)
+    cached = apply_augmentation(audio_sample.clone(), sample_rate=44100)
+    assert len(list(tmp_path.glob('*/*.npy'))) == 2
+    assert torch.equal(shifted, cached)
+
+
+def test_custom_pitchshift_cache_cap(tmp_path):
+    # continuous transpositions add a file per draw, the least recently read are evicted past the cap
+    block_bytes = 22050 * 4
+    pitch_shift = PitchShift_Slow(min_transpose_semitones=-0.4,
+                                  max_transpose_semitones=-0.1,
+                                  p=1.0,
+                                  sample_rate=44100,
+                                  p_mode='per_example',
+                                  cache_dir=tmp_path,
+                                  cache_max_bytes=int(3.5 * block_bytes))
+    apply_augmentation = Compose([pitch_shift])
+    audio_sample = torch.rand(size=(1, 1, 22050), dtype=torch.float32) - 0.5
+    for _ in range(0, 6):
+        apply_augmentation(audio_sample.clone(), sample_rate=44100)
+    assert 0 < len(list(tmp_path.glob('*/*.npy'))) <= 3
+
+
+def test_custom_pitchshift_bank(tmp_path):
+    x_file = (tmp_path / 'clip.wav').as_posix()
+    waveform = torch.rand(size=(1, 22050), dtype=torch.float32) - 0.5
+    torchaudio.save(x_file, waveform, 44100)
+    render_pitch_bank([x_file], tmp_path / 'pitch_bank', semitones=[-0.4, -0.1], sample_rate=44100)
+    bank = PitchBank(tmp_path / 'pitch_bank')
+    assert x_file in bank
+
+    pitch_shift = PitchShift_Slow(min_transpose_semitones=-0.4,
+                                  max_transpose_semitones=-0.1,
+                                  p=1.0,
+                                  sample_rate=44100,
+                                  p_mode='per_example',
+                                  bank=bank)
+    pitch_shift.select_clip(x_file)
+    audio_sample = torchaudio.load(x_file)[0].unsqueeze(0).repeat(2, 1, 1)
+    shifted = Compose([pitch_shift])(audio_sample, sample_rate=44100)
+
+    # every example is one of the rendered variants
+    variants = [torch.from_numpy(bank.shift(0, n_steps)) for n_steps in [-0.4, -0.1]]
+    for example in shifted:
+        assert any(torch.equal(example[0], variant) for variant in variants)
+
+    # interpolated shifts lie between the neighbouring variants
+    halfway = torch.from_numpy(bank.shift(0, -0.25, interpolate=True))
+    assert torch.allclose(halfway, (variants[0] + variants[1]) / 2, atol=1e-6)
+
+
+def test_custom_pitchshift_bank_fallback(tmp_path):
+    x_files = [(tmp_path / f"{name}.wav").as_posix() for name in ['a', 'b']]
+    for x_file in x_files:
+        torchaudio.save(x_file, torch.rand(size=(1, 22050), dtype=torch.float32) - 0.5, 44100)
+    # the bank only covers the first clip
+    render_pitch_bank(x_files[:1], tmp_path / 'pitch_bank', semitones=[-0.4, -0.1], sample_rate=44100)
+    bank = PitchBank(tmp_path / 'pitch_bank')
+    assert bank.is_fresh(x_files[0]) and not bank.is_fresh(x_files[1])
+
+    pitch_shift = PitchShift_Slow(min_transpose_semitones=-0.4,
+                                  max_transpose_semitones=-0.1,
+                                  p=1.0,
+                                  sample_rate=44100,
+                                  p_mode='per_example',
+                                  bank=bank)
+    variants = [torch.from_numpy(bank.shift(0, n_steps)) for n_steps in [-0.4, -0.1]]
+
+    # a clip missing from the bank is shifted on the fly
+    pitch_shift.select_clip(x_files[1])
+    audio_sample = torchaudio.load(x_files[1])[0].unsqueeze(0)
+    shifted = Compose([pitch_shift])(audio_sample.clone(), sample_rate=44100)
+    assert shifted.shape == audio_sample.shape and not torch.equal(shifted, audio_sample)
+
+    # a clip rewritten under the same name and length is not read from the bank
+    torchaudio.save(x_files[0], torch.rand(size=(1, 22050), dtype=torch.float32) - 0.5, 44100)
+    assert x_files[0] in bank and not bank.is_fresh(x_files[0])
+    pitch_shift.select_clip(x_files[0])
+    shifted = Compose([pitch_shift])(torchaudio.load(x_files[0])[0].unsqueeze(0), sample_rate=44100)
+    assert not any(torch.allclose(shifted[0, 0], variant) for variant in variants)
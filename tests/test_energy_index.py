@@ -0,0 +1,61 @@
+import pytest
+import torch
+import numpy as np
+import pandas as pd
+from omegaconf import open_dict
+from src.datamodule.audio_dataloader import AudioDataset
+from src.datamodule.energy_index import frame_energy_db, build_energy_index, EnergyIndex
+
+
+def voiced_last_quarter(row, i):
+    # silent first three quarters, noise in the last quarter
+    waveform = np.zeros(44100)
+    waveform[3 * 44100 // 4:] = np.random.default_rng(row).uniform(-0.5, 0.5, 44100 - 3 * 44100 // 4)
+    return waveform
+
+
+def test_frame_energy_db():
+    db = frame_energy_db(np.concatenate([np.zeros(2048), np.ones(1000)]), hop_length=1024)
+    np.testing.assert_allclose(db, [-100.0, -100.0, 20 * np.log10(np.sqrt(1000 / 1024))], atol=1e-4)
+
+
+def test_build_is_incremental(tmp_path, split_dir):
+    split_dir(num_clips=1, waveform=voiced_last_quarter)
+    assert build_energy_index(tmp_path) == 2
+    assert build_energy_index(tmp_path) == 0
+    assert len(EnergyIndex(tmp_path).clips) == 2
+
+
+def test_voiced_offset(tmp_path, split_dir):
+    x_files, _ = split_dir(num_clips=1, waveform=voiced_last_quarter)
+    build_energy_index(tmp_path, hop_length=1024)
+    index = EnergyIndex(tmp_path)
+    torch.manual_seed(0)
+    offsets = [index.voiced_offset(x_files[0], 44100, 8192, min_voiced_fraction=0.5) for _ in range(0, 100)]
+    # at least half of every crop is in the voiced last quarter
+    assert min(offsets) >= 3 * 44100 // 4 - 8192 // 2 - 1024
+    assert max(offsets) <= 44100 - 8192
+
+    # nothing reaches the fraction, the most voiced crops are drawn
+    offsets = [index.voiced_offset(x_files[0], 44100, 32768, min_voiced_fraction=0.9) for _ in range(0, 20)]
+    assert min(offsets) >= 44100 - 32768 - 1024
+
+
+def test_dataset_voiced_crops(tmp_path, split_dir, cfg):
+    x_files, _ = split_dir(num_clips=1, waveform=voiced_last_quarter)
+    build_energy_index(tmp_path)
+    with open_dict(cfg):
+        cfg.dataset.block_size = 8192
+    df = pd.DataFrame({'x': x_files, 'speaker_name': ['a', 'b'], 'related_speakers': [[], []]})
+    dataset = AudioDataset(df, cfg=cfg, energy_index=EnergyIndex(tmp_path))
+    for idx in range(0, len(df)):
+        x, y, _, _ = dataset[idx]
+        assert x.shape == (1, 8192)
+        assert torch.equal(x, y)
+        assert (x[0].abs() > 0).float().mean() >= 0.4
+
+    # an independent time shift before the crop would move the clip away from its energies
+    with open_dict(cfg):
+        cfg.augmentations.do_timeshift_indep = True
+    with pytest.raises(ValueError):
+        AudioDataset(df, cfg=cfg, do_augmentation=True, energy_index=EnergyIndex(tmp_path))
@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+from pathlib import Path
+
+# model definitions, AudioHelper and the embedding extractor must import without the training stack
+light_modules = ['src.model.nets.wavenet',
+                 'src.model.nets.waveunet',
+                 'src.model.nets.autoencoder_speaker',
+                 'src.model.nets.autoencoder_speaker2',
+                 'src.model.speaker_encoder.speaker_embedder']
+
+training_modules = ['pytorch_lightning', 'hydra', 'mlflow', 'transformers', 'archisound',
+                    'auraloss', 'torch_audiomentations', 'librosa', 'pandas']
+
+# seconds for a fresh interpreter to import a light module, torch included. enforce a tighter one with
+# IMPORT_TIME_BUDGET=2.0 python -m pytest tests/test_import_time.py
+import_time_budget = float(os.environ.get('IMPORT_TIME_BUDGET', 5.0))
+
+
+@pytest.mark.parametrize('module', light_modules)
+def test_light_import(module):
+    script = f"""
+import sys, time, json
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'modules': list(sys.modules)}}))
+"""
+    root = Path(__file__).parent.parent
+    result = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    imported = [m for m in training_modules if m in report['modules']]
+    assert imported == [], f"{module} imports {imported}"
+    assert report['seconds'] < import_time_budget, \
+        f"{module} took {report['seconds']:.2f}s to import, budget {import_time_budget}s"
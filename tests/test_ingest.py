@@ -0,0 +1,53 @@
+import io
+import zipfile
+import numpy as np
+import soundfile as sf
+from pathlib import PurePosixPath
+from src.utils.ingest import ingest_zip
+
+
+def audio_bytes(format):
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros(4410), 44100, format=format, subtype='PCM_16')
+    return buffer.getvalue()
+
+
+def test_ingest_nested_zip(tmp_path):
+    # vctk layout, the corpus zip stored inside the download
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for speaker in ['p225', 'p226']:
+            for mic in ['mic1', 'mic2']:
+                archive.writestr(f"wav48_silence_trimmed/{speaker}/{speaker}_001_{mic}.flac", audio_bytes('FLAC'))
+        archive.writestr('txt/p225/p225_001.txt', 'text')
+    archive_path = tmp_path / 'download.zip'
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr('VCTK-Corpus-0.92.zip', inner.getvalue())
+        archive.writestr('README.txt', 'readme')
+
+    files = ingest_zip(archive_path, tmp_path / 'interim',
+                       select=lambda name: name.endswith('.flac') and 'mic1' in name,
+                       speaker_of=lambda name: PurePosixPath(name).parent.name,
+                       nested='VCTK-Corpus-0.92.zip', to_wav=True, num_workers=2)
+
+    assert sorted(f.relative_to(tmp_path / 'interim').as_posix() for f in files) == \
+        ['p225/p225_001_mic1.wav', 'p226/p226_001_mic1.wav']
+    data, sr = sf.read(files[0])
+    assert sr == 44100 and len(data) == 4410
+    # only the selected members were written, the archive is untouched
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['download.zip', 'interim']
+
+
+def test_ingest_repeated_names(tmp_path):
+    archive_path = tmp_path / 'vocalset.zip'
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        archive.writestr('FULL/female1/arpeggios/belt/f1.wav', audio_bytes('WAV'))
+        archive.writestr('FULL/female1/scales/belt/f1.wav', audio_bytes('WAV'))
+        archive.writestr('__MACOSX/FULL/female1/scales/belt/._f1.wav', b'')
+
+    files = ingest_zip(archive_path, tmp_path / 'interim',
+                       select=lambda name: not name.startswith('__MACOSX'),
+                       speaker_of=lambda name: PurePosixPath(name).parent.parent.parent.name,
+                       num_workers=1)
+    assert sorted(f.name for f in files) == ['f1.wav', 'f1_1.wav']
+    assert all(f.read_bytes() == audio_bytes('WAV') for f in files)
@@ -91,4 +91,19 @@ def test_librosa_torch_melspec():
     mse = torch.square(dot_np - dot_torch).mean().item()
     assert mse < 1e-6
     mse = torch.square(mel_np - mel_torch).mean().item()
-    assert mse < 1e-6
\ No newline at end of file
+    assert mse < 1e-6
+
+def test_audio_helper_shared_cache():
+    # filterbanks and windows are shared across helpers, and follow the input's dtype
+    audio_helper1 = AudioHelper()
+    audio_helper2 = AudioHelper()
+    assert audio_helper1.mel_basis_np is audio_helper2.mel_basis_np
+
+    rand_wav_torch = torch.randn(16000, dtype=torch.float64)
+    mel_64, _, _ = audio_helper1.get_mel_torch(rand_wav_torch)
+    mel_32, _, _ = audio_helper2.get_mel_torch(rand_wav_torch.float())
+    assert mel_64.dtype == torch.float64
+    assert mel_32.dtype == torch.float32
+
+    mse = torch.square(mel_64.float() - mel_32).mean().item()
+    assert mse < 1e-6
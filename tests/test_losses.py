@@ -0,0 +1,97 @@
+import torch
+import auraloss
+from src.utils.losses import Losses
+from src.utils.perf import check_loss_precision
+from src.datamodule.collate import pad_collate
+
+
+def test_spectral_losses_match_auraloss():
+    # shared stft engine gives the same values as the auraloss modules it replaces
+    torch.manual_seed(0)
+    target = torch.randn(2, 1, 16384)
+    pred = target + 0.1 * torch.randn(2, 1, 16384)
+
+    loss = Losses(loss_type='STFTLoss', sample_rate=44100)
+    expected = auraloss.freq.STFTLoss(fft_size=4096, win_length=4096, hop_size=1024, w_phs=0.2)
+    assert torch.allclose(loss.forward(pred, target), expected(pred, target), rtol=1e-4)
+
+    loss = Losses(loss_type='MelSTFTLoss', sample_rate=44100)
+    expected = auraloss.freq.MelSTFTLoss(fft_size=4096, hop_size=1024, n_mels=128, w_phs=0.2,
+                                         sample_rate=44100)
+    assert torch.allclose(loss.forward(pred, target), expected(pred, target), rtol=1e-4)
+
+    loss = Losses(loss_type='MultiResolutionSTFTLoss', sample_rate=44100)
+    expected = auraloss.freq.MultiResolutionSTFTLoss(fft_sizes=[512, 1024, 2048, 4096],
+                                                     hop_sizes=[50, 120, 240, 480],
+                                                     win_lengths=[512, 1024, 2048, 4096],
+                                                     w_phs=0.2)
+    assert torch.allclose(loss.forward(pred, target), expected(pred, target), rtol=1e-4)
+
+
+def test_spectral_loss_gradients():
+    # the models pass the prediction as either argument, both get gradients
+    torch.manual_seed(0)
+    target = torch.randn(2, 1, 8192).requires_grad_()
+    pred = (target.detach() + 0.1 * torch.randn(2, 1, 8192)).requires_grad_()
+
+    loss = Losses(loss_type='MultiResolutionSTFTLoss', sample_rate=44100)
+    loss.forward(pred, target).backward()
+    assert pred.grad is not None and target.grad is not None
+
+
+def test_combination_losses_match_auraloss():
+    torch.manual_seed(0)
+    target = torch.randn(4, 1, 4096)
+    pred = target + 0.1 * torch.randn(4, 1, 4096)
+
+    loss = Losses(loss_type='DC_SDSDR_SNR_Loss')
+    expected = auraloss.time.DCLoss()(pred, target) * 10000.0 + \
+        auraloss.time.SDSDRLoss()(pred, target) + \
+        auraloss.time.SNRLoss()(pred, target)
+    assert torch.allclose(loss.forward(pred, target), expected, rtol=1e-4)
+
+    loss = Losses(loss_type='ESR_DC_Loss')
+    expected = auraloss.time.DCLoss()(pred, target) * 1000.0 + \
+        auraloss.time.ESRLoss()(pred, target)
+    assert torch.allclose(loss.forward(pred, target), expected, rtol=1e-4)
+
+
+def test_losses_are_full_precision_under_autocast():
+    # losses are computed in fp32 from a bf16 model output, so they pass the reduced precision check
+    torch.manual_seed(0)
+    target = torch.randn(2, 1, 16384)
+    pred = target + 0.1 * torch.randn(2, 1, 16384)
+
+    for loss_type in ['ESRLoss', 'SNRLoss', 'MultiResolutionSTFTLoss', 'DC_SDSDR_SNR_Loss']:
+        loss = Losses(loss_type=loss_type, sample_rate=44100)
+        with torch.autocast(device_type='cpu', dtype=torch.bfloat16):
+            loss_bf16 = loss.forward(pred.to(torch.bfloat16), target)
+        assert loss_bf16.dtype == torch.float32
+        check_loss_precision(loss, 'bf16-mixed', device='cpu', block_size=16384)
+
+
+def test_losses_ignore_padding():
+    # a zero padded batch scores the same as its examples scored one by one
+    torch.manual_seed(0)
+    targets = [torch.randn(1, 4096), torch.randn(1, 6000), torch.randn(1, 1500)]
+    preds = [target + 0.1 * torch.randn_like(target) for target in targets]
+    batch = [(pred, target, ([], []), ('a', '')) for pred, target in zip(preds, targets)]
+    pred, target, _, _, lengths = pad_collate(batch, pad_multiple=1024)
+    assert pred.size() == (3, 1, 6144)
+    assert lengths.tolist() == [4096, 6000, 1500]
+
+    for loss_type in ['MSELoss', 'ESRLoss', 'MultiResolutionSTFTLoss']:
+        loss = Losses(loss_type=loss_type, sample_rate=44100)
+        expected = torch.stack([loss.forward(p.unsqueeze(0), t.unsqueeze(0)) for p, t in zip(preds, targets)]).mean()
+        assert torch.allclose(loss.forward(pred, target, lengths=lengths), expected)
+
+
+def test_spectral_losses_pad_short_examples():
+    # examples shorter than half the largest fft are zero padded instead of failing in torch.stft
+    torch.manual_seed(0)
+    pred, target = torch.randn(2, 1, 8192), torch.randn(2, 1, 8192)
+    loss = Losses(loss_type='MultiResolutionSTFTLoss', sample_rate=44100)
+    assert loss.min_length() == 2049
+    assert torch.isfinite(loss.forward(pred, target, lengths=torch.tensor([8192, 1500])))
+    assert torch.isfinite(loss.forward(pred[..., :1500], target[..., :1500]))
+    assert Losses(loss_type='MSELoss').min_length() == 1
@@ -0,0 +1,73 @@
+import pytest
+import torch
+from omegaconf import OmegaConf
+from src.model.autoencoder_speaker import AutoEncoder_Speaker, AutoEncoder1d, AutoEncoder1dConfig
+from src.model.autoencoder_speaker2 import AutoEncoder_Speaker2
+from src.export_model_to_onnx import export_to_onnx, check_onnx_parity, resolve_model_name
+
+
+def make_speaker_model(tmp_path, model_class):
+    # a small autoencoder, saved the same way as the pre-trained one
+    ae_config = AutoEncoder1dConfig(multipliers=[1, 1], factors=[2], num_blocks=[1])
+    AutoEncoder1d(ae_config).save_pretrained(tmp_path / 'ae')
+    cfg = OmegaConf.create({'model': {'ae_path': str(tmp_path / 'ae'),
+                                      'freeze_encoder': True,
+                                      'freeze_decoder': False,
+                                      'bottleneck_dropout': 0.0,
+                                      'emb_size': 256,
+                                      'latent_slice_size': 16,
+                                      'lstm_layers': 1}})
+    torch.manual_seed(0)
+    return model_class(cfg)
+
+
+def split_loop_fuse_embedding(model, z, dvec):
+    # fuse_embedding as it was before the reshape, one slice at a time
+    z_fuses = []
+    for i in range(0, z.size(1)):
+        z_partials = torch.split(z[:, i, :], model.latent_slice_size, dim=1)
+        if isinstance(model, AutoEncoder_Speaker):
+            z_channel_emb_seq_in = torch.stack([torch.cat([z_partial, dvec], dim=1) for z_partial in z_partials],
+                                               dim=1)
+            z_channel_emb_seq_out, _ = model.lstms[i](z_channel_emb_seq_in)
+            projected = torch.stack([model.activations(model.projections[i](z_channel_emb_seq_out[:, z_i, :]))
+                                     for z_i in range(0, z_channel_emb_seq_out.size(1))], dim=1)
+        else:
+            projected = torch.stack([model.activations(model.aslns[i](z_partial, dvec)) for z_partial in z_partials],
+                                    dim=1)
+        z_fuses.append(torch.flatten(projected, start_dim=1))
+    return torch.stack(z_fuses, dim=1)
+
+
+@pytest.mark.parametrize('model_class', [AutoEncoder_Speaker, AutoEncoder_Speaker2])
+def test_fuse_embedding_matches_split_loop(tmp_path, model_class):
+    model = make_speaker_model(tmp_path, model_class)
+    model.eval()
+    for batch_size, length in [(1, 16), (3, 64), (2, 160)]:
+        z = torch.randn(batch_size, model.ae_channel_size, length)
+        dvec = torch.nn.functional.normalize(torch.randn(batch_size, 256), dim=1)
+        with torch.no_grad():
+            assert torch.allclose(model.fuse_embedding(z, dvec), split_loop_fuse_embedding(model, z, dvec),
+                                  atol=1e-6)
+
+
+@pytest.mark.parametrize('model_class', [AutoEncoder_Speaker, AutoEncoder_Speaker2])
+def test_speaker_model_onnx_parity(tmp_path, model_class):
+    torch_model = make_speaker_model(tmp_path, model_class)
+
+    onnx_filename = str(tmp_path / 'speaker.onnx')
+    export_to_onnx(torch_model, onnx_filename, sample_block_size=1024, emb_size=256)
+
+    # batch and block size are both dynamic
+    report = check_onnx_parity(torch_model, onnx_filename, batch_sizes=[1, 3], block_sizes=[512, 1024, 2048],
+                               emb_size=256, latency_runs=1)
+    assert len(report) == 6
+    assert (report['max_abs_diff'] < 1e-2).all()
+
+
+def test_resolve_model_name():
+    assert resolve_model_name('wavenet') == 'WaveNet_PL'
+    assert resolve_model_name('waveunet') == 'WaveUNet_PL'
+    assert resolve_model_name('AutoEncoder_Speaker_PL2') == 'AutoEncoder_Speaker_PL2'
+    with pytest.raises(ValueError, match='WaveUNet_PL'):
+        resolve_model_name('autoencoder')
@@ -0,0 +1,88 @@
+import pytest
+import torch
+import numpy as np
+import soundfile as sf
+from omegaconf import open_dict
+from src.process_data import process_dataset, split_targets
+from src.cache_dataset import cache_dataset
+from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder
+
+
+def tiny_dataset(cfg, tmp_path):
+    # the interim speakers written by make_interim
+    with open_dict(cfg):
+        cfg.process_data.dataset.audio_dirs = ['data/interim/tiny']
+        cfg.process_data.dataset.dataset_label = 'tiny'
+        cfg.process_data.clip_interval_ms = 1000
+        cfg.dataset.data_path = 'data/processed/tiny'
+        cfg.dataset.block_size_speaker = 44100
+        cfg.model.embedder_path = str(tmp_path / 'embedder.pt')
+    return cfg
+
+
+def make_interim(tmp_path, num_speakers=6):
+    rng = np.random.default_rng(0)
+    for speaker in range(0, num_speakers):
+        speaker_path = tmp_path / 'data/interim/tiny' / f"speaker{speaker}"
+        speaker_path.mkdir(parents=True, exist_ok=True)
+        # loud noise, no silences to split on
+        sf.write(speaker_path / 'song.wav', rng.uniform(-0.5, 0.5, 66150), 44100, subtype='PCM_16')
+
+
+@pytest.mark.parametrize('cfg', [['model=autoencoder_speaker']], indirect=True)
+def test_incremental_preparation(tmp_path, cfg):
+    torch.manual_seed(0)
+    torch.save(SpeechEmbedder().state_dict(), tmp_path / 'embedder.pt')
+    make_interim(tmp_path)
+    cfg = tiny_dataset(cfg, tmp_path)
+    cfg.process_data.split = 'hash'
+
+    # the test speakers are processed for predict too
+    num_test = len(split_targets(cfg, tmp_path)['test'])
+    assert process_dataset(cfg, tmp_path, plan=True) == 6 + num_test
+    assert process_dataset(cfg, tmp_path) == 6 + num_test
+    clips = sorted((tmp_path / 'data/processed/tiny').glob('*/*/*.wav'))
+    mtimes = [clip.stat().st_mtime_ns for clip in clips]
+
+    # nothing changed, nothing rebuilt
+    assert process_dataset(cfg, tmp_path) == 0
+    assert [clip.stat().st_mtime_ns for clip in clips] == mtimes
+
+    assert cache_dataset(cfg, tmp_path) == len(clips)
+    assert cache_dataset(cfg, tmp_path, plan=True) == 0
+
+    # a silence threshold that changes no clip reprocesses the files but embeds nothing again
+    with open_dict(cfg):
+        cfg.process_data.silence_thresh_dbfs = -20
+    assert process_dataset(cfg, tmp_path) == 6
+    assert cache_dataset(cfg, tmp_path) == 0
+
+    # a new speaker only processes its own file, whatever split it lands in
+    make_interim(tmp_path, num_speakers=7)
+    assert process_dataset(cfg, tmp_path) in (1, 2)
+    assert process_dataset(cfg, tmp_path) == 0
+
+
+def test_hash_split_is_stable(tmp_path, cfg):
+    make_interim(tmp_path, num_speakers=40)
+    cfg = tiny_dataset(cfg, tmp_path)
+    cfg.process_data.split = 'hash'
+    splits = split_targets(cfg, tmp_path)
+    assert sum(len(splits[split]) for split in ('train', 'val', 'test')) == 40
+    assert splits['predict'] == splits['test']
+    assert len(splits['train']) > len(splits['val'])
+
+    # adding speakers leaves every existing speaker in its split
+    make_interim(tmp_path, num_speakers=60)
+    grown = split_targets(cfg, tmp_path)
+    for split in ('train', 'val', 'test'):
+        assert set(splits[split]) <= set(grown[split])
+
+
+def test_seed_split(tmp_path, cfg):
+    make_interim(tmp_path)
+    cfg = tiny_dataset(cfg, tmp_path)
+    # the default
+    assert cfg.process_data.split == 'seed'
+    splits = split_targets(cfg, tmp_path)
+    assert [len(splits[split]) for split in ('train', 'val', 'test')] == [4, 1, 1]
@@ -0,0 +1,77 @@
+import time
+import pytest
+import torch
+import multiprocessing as mp
+from src.utils.profiling import StageTimer, add_forward_timer, stage_percentiles
+from src.datamodule.audio_datamodule import AudioDataModule
+
+
+def test_stage_timer_disabled():
+    timer = StageTimer(enabled=False)
+    with timer.time('decode'):
+        time.sleep(0.001)
+    timer.add('h2d', 1.0)
+    assert len(timer.collect()) == 0
+
+
+def test_stage_timer_collects_worker_timings():
+    timing_queue = mp.Queue(10)
+    timer = StageTimer(enabled=True, queue=timing_queue)
+
+    # the worker's copy flushes into the queue
+    worker_timer = StageTimer(enabled=True, queue=timing_queue)
+    with worker_timer.time('decode'):
+        time.sleep(0.001)
+    worker_timer.flush()
+    assert len(worker_timer.timings) == 0
+
+    timer.add('h2d', 0.5)
+    time.sleep(0.1)  # queue feeder thread
+    timings = timer.collect()
+    assert timings['h2d'] == [0.5]
+    assert len(timings['decode']) == 1 and timings['decode'][0] > 0
+    assert len(timer.collect()) == 0
+
+
+def test_forward_timer():
+    timer = StageTimer(enabled=True)
+    model = torch.nn.Linear(4, 4)
+    handles = add_forward_timer(model, timer, 'forward/linear')
+    model(torch.randn(2, 4))
+    model(torch.randn(2, 4))
+    for handle in handles:
+        handle.remove()
+    model(torch.randn(2, 4))
+
+    assert len(timer.collect()['forward/linear']) == 2
+
+
+def test_stage_percentiles():
+    metrics = stage_percentiles({'step': [0.001 * i for i in range(1, 101)], 'empty': []})
+    assert set(metrics.keys()) == {'profile/step_p50_ms', 'profile/step_p90_ms', 'profile/step_p99_ms'}
+    assert abs(metrics['profile/step_p50_ms'] - 50.5) < 1e-6
+
+
+@pytest.mark.parametrize('cfg', [['training.profiling.enabled=true']], indirect=True)
+def test_dataset_timer_never_syncs(cfg, monkeypatch, tmp_path):
+    syncs = []
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: True)
+    monkeypatch.setattr(torch.cuda, 'synchronize', lambda: syncs.append(1))
+    dm = AudioDataModule(tmp_path, cfg=cfg)
+    assert dm.stage_timer.sync_cuda and dm.dataset_timer.queue is dm.stage_timer.queue
+
+    # the datasets' timer, in or out of a worker
+    with dm.dataset_timer.time('decode'):
+        pass
+    assert len(syncs) == 0
+
+    # the training process' timer in a forked worker, where cuda can not be initialised
+    monkeypatch.setattr(torch.utils.data, 'get_worker_info', lambda: object())
+    with dm.stage_timer.time('decode'):
+        pass
+    assert len(syncs) == 0
+    monkeypatch.undo()
+    dm.stage_timer.sync_cuda = True
+    monkeypatch.setattr(torch.cuda, 'synchronize', lambda: syncs.append(1))
+    dm.stage_timer._now()
+    assert len(syncs) == 1
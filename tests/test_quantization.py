@@ -0,0 +1,31 @@
+import torch
+import torchaudio
+from src.model.wavenet import WaveNet
+from src.export_model_to_onnx import export_to_onnx
+from src.utils.quantization import (
+    quantized_filename, quantize_onnx_static, load_clips, ClipCalibrationReader, compare_onnx_variants)
+
+
+def test_static_quantization_report(tmp_path):
+    torch.manual_seed(0)
+    val_path = tmp_path / 'val' / 'speaker'
+    val_path.mkdir(parents=True)
+    t = torch.arange(0, 8000) / 44100
+    for i in range(0, 4):
+        clip = 0.5 * torch.sin(2 * torch.pi * (110 * (i + 1)) * t) + 0.01 * torch.randn(8000)
+        torchaudio.save(str(val_path / f'{i}.wav'), clip.unsqueeze(0), 44100)
+
+    torch_model = WaveNet(num_channels=8, dilation_depth=4, num_repeat=1, kernel_size=3)
+    onnx_filename = str(tmp_path / 'wavenet.onnx')
+    export_to_onnx(torch_model, onnx_filename, sample_block_size=4096)
+
+    feeds = load_clips(tmp_path / 'val', ext='wav', block_size=4096, num_clips=4)
+    assert len(feeds) == 4 and feeds[0]['input1'].shape == (1, 1, 4096)
+
+    int8_filename = quantize_onnx_static(onnx_filename, quantized_filename(onnx_filename, 'static'),
+                                         ClipCalibrationReader(feeds))
+    report = compare_onnx_variants({'fp32': onnx_filename, 'int8_static': int8_filename}, feeds, latency_runs=2)
+
+    int8 = report[report['variant'] == 'int8_static'].iloc[0]
+    assert int8['snr_db'] > 10
+    assert int8['latency_ms'] > 0
@@ -0,0 +1,55 @@
+import pandas as pd
+from collections import Counter
+from src.datamodule.samplers import SpeakerShardSampler, LengthBucketBatchSampler
+
+
+def make_df():
+    speaker_names = ['a'] * 9 + ['b'] * 6 + ['c'] * 4
+    return pd.DataFrame({'x': [f'{i}.wav' for i in range(len(speaker_names))], 'speaker_name': speaker_names})
+
+
+def test_speaker_shards_cover_dataset():
+    df = make_df()
+    shards = [list(SpeakerShardSampler(df, num_replicas=3, rank=rank, seed=1)) for rank in range(3)]
+
+    # equal sized shards, every row used, only padded rows repeated
+    assert all(len(shard) == 7 for shard in shards)
+    assert set(sum(shards, [])) == set(range(len(df)))
+
+    # every speaker is spread over every rank
+    for shard in shards:
+        counts = Counter(df.iloc[shard]['speaker_name'])
+        assert counts['a'] >= 3 and counts['b'] >= 2 and counts['c'] >= 1
+
+
+def test_speaker_shards_reshuffle_per_epoch():
+    df = make_df()
+    samplers = [SpeakerShardSampler(df, num_replicas=2, rank=rank, seed=1) for rank in range(2)]
+    first = [list(sampler) for sampler in samplers]
+    for sampler in samplers:
+        sampler.set_epoch(1)
+    second = [list(sampler) for sampler in samplers]
+
+    assert first != second
+    # ranks stay disjoint apart from the single padded row
+    assert len(set(second[0]) & set(second[1])) <= 1
+
+
+def test_speaker_shards_with_epoch():
+    df = make_df()
+    sampler = SpeakerShardSampler(df, num_replicas=1, rank=0, seed=1, with_epoch=True)
+    sampler.set_epoch(3)
+    indexes = list(SpeakerShardSampler(df, num_replicas=1, rank=0, seed=1))
+    sampler.set_epoch(0)
+    assert list(sampler) == [(0, index) for index in indexes]
+
+
+def test_length_buckets():
+    lengths = [5, 100, 7, 98, 6, 99, 50]
+    batches = list(LengthBucketBatchSampler(lengths, batch_size=3))
+    assert batches == [[0, 4, 2], [6, 3, 5], [1]]
+
+    # a shard only, in a shuffled batch order
+    sampler = LengthBucketBatchSampler(lengths, batch_size=2, indexes=[0, 1, 2, 3], shuffle=True, seed=1)
+    assert len(sampler) == 2
+    assert sorted(sampler) == [[0, 2], [3, 1]]
@@ -0,0 +1,95 @@
+import pytest
+import torch
+import numpy as np
+from collections import Counter
+from src.datamodule.clip_manifest import ClipManifest, write_clip_manifest
+from src.utils.corpus_scan import read_headers
+from src.datamodule.audio_datamodule import AudioDataModule
+from src.datamodule.shards import write_shards, read_shard, ShardedAudioDataset
+
+
+SPEAKERS = ('s0', 's1', 's2')
+
+
+def constant_clip(row, i):
+    # each clip a constant, its row found again from the padded block
+    return np.full(44100, row / 100.0)
+
+
+def test_write_and_read(tmp_path, split_dir):
+    x_files, speaker_names = split_dir(tmp_path / 'train', speakers=SPEAKERS, num_clips=5, waveform=constant_clip)
+    shard_files = write_shards(ClipManifest.from_scan(x_files, speaker_names, read_headers(x_files)),
+                               tmp_path / 'train_shards', samples_per_shard=4)
+    assert len(shard_files) == 4
+
+    clips = ClipManifest(tmp_path / 'train_shards')
+    rows = []
+    for shard_file in shard_files:
+        for row, audio in read_shard(shard_file):
+            assert audio == open(clips['x'][row], 'rb').read()
+            rows.append(row)
+    assert sorted(rows) == list(range(0, 15))
+    assert rows != sorted(rows)
+    assert clips['speaker_name'].tolist() == speaker_names
+
+
+def test_ranks_and_workers(tmp_path, split_dir, cfg):
+    x_files, speaker_names = split_dir(tmp_path / 'train', speakers=SPEAKERS, num_clips=5, waveform=constant_clip)
+    write_shards(ClipManifest.from_scan(x_files, speaker_names, read_headers(x_files)),
+                 tmp_path / 'train_shards', samples_per_shard=2)
+
+    seen = Counter()
+    for rank in range(0, 2):
+        dataset = ShardedAudioDataset(tmp_path / 'train_shards', cfg=cfg, num_replicas=2, rank=rank,
+                                      shuffle_buffer=3)
+        loader = torch.utils.data.DataLoader(dataset, batch_size=1, num_workers=2)
+        values = [round(x.max().item() * 100) for x, *_ in loader]
+        # every rank the same number of samples, each clip decoded with its own row
+        assert len(values) == len(dataset) == 7
+        seen.update(values)
+    assert len(seen) >= 13 and set(seen) <= set(range(0, 15))
+
+    # shards are dealt differently every epoch, the same for a given epoch
+    dataset = ShardedAudioDataset(tmp_path / 'train_shards', cfg=cfg, num_replicas=2, rank=0)
+    epochs = []
+    for epoch in range(0, 3):
+        dataset.set_epoch(epoch)
+        epochs.append([round(x.max().item() * 100) for x, *_ in dataset])
+    assert epochs[0] != epochs[1] or epochs[0] != epochs[2]
+
+    # a resumed run, its persistent workers follow the epoch set in the main process
+    resumed = ShardedAudioDataset(tmp_path / 'train_shards', cfg=cfg, num_replicas=2, rank=0)
+    loader = torch.utils.data.DataLoader(resumed, batch_size=1, num_workers=1, persistent_workers=True)
+    for epoch in [2, 1]:
+        resumed.set_epoch(epoch)
+        assert [round(x.max().item() * 100) for x, *_ in loader] == epochs[epoch]
+
+
+@pytest.mark.parametrize('cfg', [['model=autoencoder_speaker']], indirect=True)
+def test_speaker_shards(tmp_path, split_dir, cfg):
+    x_files, speaker_names = split_dir(tmp_path / 'train', speakers=SPEAKERS, num_clips=5, waveform=constant_clip)
+    dvecs = np.random.default_rng(0).normal(size=(len(x_files), 256)).astype(np.float32)
+    write_clip_manifest(tmp_path / 'train', x_files, speaker_names, dvecs=dvecs)
+    write_shards(ClipManifest(tmp_path / 'train'), tmp_path / 'train_shards', samples_per_shard=4)
+
+    dataset = ShardedAudioDataset(tmp_path / 'train_shards', cfg=cfg)
+    samples = list(dataset)
+    assert len(samples) == 15
+    for x, _, (own_dvec, target_dvec), (speaker_name, target_speaker_name) in samples:
+        row = round(x.max().item() * 100)
+        assert torch.equal(own_dvec, torch.from_numpy(dvecs[row]))
+        assert speaker_name == speaker_names[row] and target_speaker_name != speaker_name
+
+
+@pytest.mark.parametrize('cfg', [['dataset.train_shards=true']], indirect=True)
+def test_setup_reads_no_train_folder(tmp_path, split_dir, cfg):
+    x_files, speaker_names = split_dir(tmp_path / 'train', speakers=SPEAKERS, num_clips=5, waveform=constant_clip)
+    write_shards(ClipManifest.from_scan(x_files, speaker_names, read_headers(x_files)),
+                 tmp_path / 'train_shards', samples_per_shard=4)
+    split_dir(tmp_path / 'val', num_clips=1)
+    # only the shards' manifest is read, a scan of the train folder would find nothing
+    (tmp_path / 'train').rename(tmp_path / 'moved')
+
+    dm = AudioDataModule(tmp_path, cfg=cfg, batch_size=2)
+    dm.setup('fit')
+    assert len(dm.df_train) == 15 and len(dm.df_val) == 2
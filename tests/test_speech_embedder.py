@@ -1,7 +1,9 @@
+import pytest
 import torch
 import torchaudio.transforms as T
 from src.model.speaker_encoder.speaker_embedder import AudioHelper
 from src.model.speaker_encoder.speaker_embedder import SpeechEmbedder
+from src.model.speaker_encoder.speaker_embedder import SpeakerEmbeddingExtractor
 
 
 def test_speech_embedder_batched_inference():
@@ -91,4 +93,80 @@ def test_speech_embedder_batched_inference_longaudio():
 
     mse = torch.square(dvecs_single - dvecs_batched).mean().item()
 
-    assert mse < 1e-5
\ No newline at end of file
+    assert mse < 1e-5
+
+
+def test_dft_mel_matches_stft_mel():
+    audio_helper = AudioHelper()
+    wavs = torch.randn(4, 16000)
+
+    mel_stft, _, _ = audio_helper.get_mel_torch(wavs)
+    mel_dft, _, _ = audio_helper.get_mel_dft(wavs)
+
+    assert mel_stft.size() == mel_dft.size()
+    mse = torch.square(mel_stft - mel_dft).mean().item()
+    assert mse < 1e-6
+
+
+def test_speaker_embedding_extractor():
+    embedder = SpeechEmbedder()
+    embedder.eval()
+    org_sr = 44100
+
+    extractor = SpeakerEmbeddingExtractor(embedder, orig_sr=org_sr)
+    assert extractor.resampler.orig_freq == org_sr
+
+    resampler = T.Resample(orig_freq=org_sr,
+                           new_freq=embedder.get_target_sample_rate(),
+                           lowpass_filter_width=64,
+                           rolloff=0.9475937167399596,
+                           resampling_method="sinc_interp_kaiser",
+                           beta=14.769656459379492,
+                           )
+    audio_helper = AudioHelper()
+
+    batch_size = 4
+    wavs = torch.randn(batch_size, 1, org_sr * 2, requires_grad=True)
+
+    dvec_mel, _, _ = audio_helper.get_mel_torch(resampler(wavs.squeeze(dim=1)))
+    dvecs_expected = embedder.batched_forward(dvec_mel)
+
+    dvecs = extractor(wavs)
+    assert dvecs.size() == (batch_size, 256)
+
+    mse = torch.square(dvecs_expected - dvecs).mean().item()
+    assert mse < 1e-8
+
+    # differentiable w.r.t the input waveform
+    dvecs.sum().backward()
+    assert wavs.grad is not None
+
+
+def test_fused_embedding_onnx(tmp_path):
+    from src.utils.export_speaker_embedding_to_onnx import export_embedding_to_onnx, test_emb_model, \
+        test_quantized_emb_model
+    from src.utils.quantization import quantized_filename, quantize_onnx_dynamic
+
+    embedder = SpeechEmbedder()
+    embedder.eval()
+    extractor = SpeakerEmbeddingExtractor(embedder, orig_sr=44100, use_dft_stft=True)
+
+    # the torch resampler is torchaudio's, with a traceable output length
+    wavs = torch.randn(2, 44100 + 17)
+    resampler = T.Resample(orig_freq=44100,
+                           new_freq=16000,
+                           lowpass_filter_width=64,
+                           rolloff=0.9475937167399596,
+                           resampling_method="sinc_interp_kaiser",
+                           beta=14.769656459379492,
+                           )
+    assert torch.allclose(resampler(wavs), extractor.resampler(wavs))
+
+    onnx_filename = str(tmp_path / 'emb.onnx')
+    export_embedding_to_onnx(extractor, onnx_filename, sample_block_size=44100 * 2)
+    test_emb_model(extractor, onnx_filename, batch_sizes=[1, 3], lengths=[44100, 44100 * 3 + 5])
+
+    int8_filename = quantize_onnx_dynamic(onnx_filename, quantized_filename(onnx_filename, 'dynamic'))
+    test_quantized_emb_model(onnx_filename, int8_filename, length=44100 * 2, num_tests=4)
+    with pytest.raises(AssertionError):
+        test_quantized_emb_model(onnx_filename, int8_filename, length=44100 * 2, num_tests=4, min_similarity=1.01)
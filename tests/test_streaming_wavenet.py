@@ -0,0 +1,33 @@
+import torch
+from src.model.wavenet import WaveNet, StreamingWaveNet
+from src.export_model_to_onnx import export_streaming_to_onnx, check_streaming_parity
+
+
+def test_streaming_matches_offline():
+    torch.manual_seed(0)
+    wavenet = WaveNet(num_channels=4, dilation_depth=5, num_repeat=2, kernel_size=3).eval()
+    streaming = StreamingWaveNet(wavenet)
+    signal = torch.randn(2, 1, 1000)
+
+    with torch.no_grad():
+        offline = wavenet(signal)
+        caches = streaming.initial_caches(batch_size=2)
+        blocks = []
+        # buffers smaller than the receptive field, and a ragged last buffer
+        for start in range(0, signal.size(2), 96):
+            out, *caches = streaming(signal[:, :, start:start + 96], *caches)
+            blocks.append(out)
+
+    assert torch.allclose(offline, torch.cat(blocks, dim=2), atol=1e-5)
+
+
+def test_streaming_onnx_parity(tmp_path):
+    torch.manual_seed(0)
+    wavenet = WaveNet(num_channels=4, dilation_depth=5, num_repeat=2, kernel_size=3).eval()
+    onnx_filename = str(tmp_path / 'wavenet.streaming.onnx')
+    export_streaming_to_onnx(StreamingWaveNet(wavenet), onnx_filename, buffer_size=64)
+
+    report = check_streaming_parity(wavenet, onnx_filename, buffer_sizes=[64, 256], signal_length=2048,
+                                    sample_rate=44100)
+    assert list(report['buffer_size']) == [64, 256]
+    assert (report['cpu_load'] > 0).all()